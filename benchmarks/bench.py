@@ -0,0 +1,555 @@
+#!/usr/bin/env python
+"""Benchmarks for the hot paths of the experiment repository.
+
+Builds a synthetic repository hierarchy at production scale and times the
+registry, settings, command expansion and log functions as well as the end-
+to-end latency of the command line interface. The hierarchy consists of a base
+repository with a command registry, nested settings and global variables, and
+a chain of clones several directory levels deep. The deepest clone contains
+the execution log. All benchmarks are run from the deepest clone.
+
+Results are written in JSON format and can be compared against the results
+of a previous run:
+
+    python benchmarks/bench.py --output results.json
+    python benchmarks/bench.py --compare results.json
+
+Use --scale to run a smaller version of the benchmarks and --workdir to keep
+(and reuse) the synthetic repositories between runs. The work directory must
+be empty or contain repositories of an earlier run. Entries that benchmarks
+add to the log are removed before each repetition, so reused repositories do
+not change between runs.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+"""Directory that contains the exprepo package."""
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PACKAGE_DIR)
+
+import exprepo as exp
+from exprepo.cli import main
+from exprepo.command import CommandTemplate, expand_arguments, get_command
+from exprepo.command import get_commands, run_command, COMMAND_SPEC_SUFFIX
+from exprepo.command import INDEX_CACHE
+from exprepo.log import get_index_file, get_log_file, new_entry, print_log
+from exprepo.log import sync_index, LogIndex, INDEX_RECORD
+from exprepo.log import STATUS_FAILED, STATUS_SUCCESS
+from exprepo.settings import get_global_variables, get_settings
+from exprepo.settings import get_global_variables_file, get_settings_file
+from exprepo.settings import get_snapshot_file, nested_merge, read_yaml_file
+from exprepo.settings import YamlDumper, YAML_CACHE
+import exprepo.timing as timing
+import yaml
+
+
+# ------------------------------------------------------------------------------
+# Constants
+# ------------------------------------------------------------------------------
+
+"""Size of the synthetic repositories at scale 1."""
+SIZES = {
+    'commands': 5000,
+    'settings': 50000,
+    'variables': 100,
+    'clone_depth': 5,
+    'clone_settings': 1000,
+    'log_lines': 1000000,
+    'sweep_points': 1000,
+    'lookups': 10000
+}
+
+"""Fan-out of the nested settings. Settings keys have the form
+g<i>/p<j>/k<k>."""
+LEAVES_PER_GROUP = 20
+GROUPS_PER_SECTION = 50
+
+"""Name of the file in the working directory that records the sizes of the
+synthetic repositories."""
+SIZES_FILE = 'sizes.json'
+
+"""Name of the directory in the working directory that contains the synthetic
+repositories."""
+BASE_DIR = 'base'
+
+"""Name with which the command line interface is called."""
+PRG_NAME = 'xpr'
+
+
+# ------------------------------------------------------------------------------
+# Classes
+# ------------------------------------------------------------------------------
+
+class Benchmark(object):
+    """A timed function with an optional untimed setup function that is run
+    before every repetition.
+    """
+    def __init__(self, name, func, setup=None):
+        """Initialize the benchmark.
+
+        Parameters
+        ----------
+        name: string
+            Unique benchmark name
+        func: callable
+            Timed function
+        setup: callable, optional
+            Function that is run before each call of the timed function
+        """
+        self.name = name
+        self.func = func
+        self.setup = setup
+
+    def run(self, repeat):
+        """Run the benchmark the given number of times after one warm-up run.
+        Output that is printed by the timed function is discarded. Returns a
+        dictionary containing the minimum, median, mean and maximum run time
+        in seconds and the mean self time of every instrumented phase (see
+        exprepo.timing) per run.
+
+        Parameters
+        ----------
+        repeat: int
+            Number of timed runs
+
+        Returns
+        -------
+        dict
+        """
+        times = []
+        phases = dict()
+        stdout = sys.stdout
+        with open(os.devnull, 'w') as devnull:
+            for i in range(repeat + 1):
+                if not self.setup is None:
+                    self.setup()
+                sys.stdout = devnull
+                timing.enable()
+                try:
+                    start = time.time()
+                    self.func()
+                    elapsed = time.time() - start
+                finally:
+                    timing.enable(False)
+                    sys.stdout = stdout
+                if i > 0:
+                    times.append(elapsed)
+                    for name, stats in timing.get_phases().items():
+                        phases[name] = phases.get(name, 0.0) + stats['self']
+        times.sort()
+        return {
+            'min': times[0],
+            'median': times[len(times) // 2],
+            'mean': sum(times) / len(times),
+            'max': times[-1],
+            'repeat': repeat,
+            'phases': dict((name, t / repeat) for name, t in phases.items())
+        }
+
+
+# ------------------------------------------------------------------------------
+# Synthetic repositories
+# ------------------------------------------------------------------------------
+
+def build_repositories(work_dir, sizes):
+    """Create the synthetic repository hierarchy in the given directory.
+    Returns the path to the deepest clone.
+
+    Parameters
+    ----------
+    work_dir: string
+        Directory for the repositories
+    sizes: dict
+        Repository sizes
+
+    Returns
+    -------
+    string
+    """
+    rnd = random.Random(42)
+    base_dir = os.path.join(work_dir, BASE_DIR)
+    reg_dir = os.path.join(base_dir, exp.REPO_DIR, exp.COMMAND_DIR)
+    os.makedirs(reg_dir)
+    with open(os.path.join(base_dir, exp.REPO_DIR, exp.BASE_FILE), 'w') as f:
+        f.write('.')
+    # Settings and global variables of the base repository
+    keys = get_settings_keys(sizes['settings'])
+    settings = dict()
+    for key in keys:
+        set_value(settings, key, str(rnd.randint(0, 1000)))
+    write_yaml(get_settings_file(base_dir=base_dir), settings)
+    variables = dict()
+    for i in range(sizes['variables']):
+        variables['v' + str(i)] = '/data/volume' + str(i)
+    write_yaml(
+        os.path.join(base_dir, exp.REPO_DIR, exp.GLOBAL_VARIABLES_FILE),
+        variables
+    )
+    # Command registry. Each command references settings and global
+    # variables.
+    for i in range(sizes['commands']):
+        spec = [
+            {'type': 'const', 'value': 'python'},
+            {'type': 'const', 'value': 'scripts/step' + str(i) + '.py'},
+            {'type': 'var', 'value': keys[rnd.randrange(len(keys))]},
+            {'type': 'var', 'value': keys[rnd.randrange(len(keys))]},
+            {'type': 'const', 'value': '--input'},
+            {
+                'type': 'const',
+                'value': '@(v' + str(i % sizes['variables']) + ')/set' + str(i)
+            },
+            {'type': 'var', 'value': 'seed'}
+        ]
+        filename = os.path.join(reg_dir, 'cmd' + str(i) + COMMAND_SPEC_SUFFIX)
+        write_yaml(filename, spec)
+    # Chain of clones. Each clone overrides a subset of the settings.
+    clone_dir = base_dir
+    for depth in range(sizes['clone_depth']):
+        clone_dir = os.path.join(clone_dir, 'clone' + str(depth))
+        os.makedirs(os.path.join(clone_dir, exp.REPO_DIR))
+        with open(os.path.join(clone_dir, exp.REPO_DIR, exp.BASE_FILE), 'w') as f:
+            f.write('/'.join(['..'] * (depth + 1)))
+        clone_settings = {'seed': '0'}
+        for key in rnd.sample(keys, min(len(keys), sizes['clone_settings'])):
+            set_value(clone_settings, key, str(rnd.randint(0, 1000)))
+        write_yaml(get_settings_file(base_dir=clone_dir), clone_settings)
+    # Execution log of the deepest clone
+    start = time.time() - sizes['log_lines']
+    with open(os.path.join(clone_dir, exp.REPO_DIR, exp.LOG_FILE), 'w') as f:
+        for i in range(sizes['log_lines']):
+            name = 'cmd' + str(rnd.randrange(sizes['commands']))
+            entry = new_entry(
+                name,
+                ['python', 'scripts/' + name + '.py', str(i)],
+                params={'seed': str(i % 100)},
+                status=STATUS_SUCCESS if i % 10 else STATUS_FAILED,
+                exit_code=0 if i % 10 else 1,
+                duration=rnd.random() * 100
+            )
+            entry['time'] = start + i
+            f.write(json.dumps(entry, separators=(',', ':')) + '\n')
+    with open(os.path.join(work_dir, SIZES_FILE), 'w') as f:
+        json.dump(sizes, f)
+    return clone_dir
+
+
+def get_settings_keys(count):
+    """Get the list of parameter paths for the synthetic settings.
+
+    Parameters
+    ----------
+    count: int
+        Number of settings
+
+    Returns
+    -------
+    list(string)
+    """
+    keys = []
+    for i in range(count):
+        section = i // (LEAVES_PER_GROUP * GROUPS_PER_SECTION)
+        group = (i // LEAVES_PER_GROUP) % GROUPS_PER_SECTION
+        leaf = i % LEAVES_PER_GROUP
+        keys.append('g%d/p%d/k%d' % (section, group, leaf))
+    return keys
+
+
+def set_value(settings, key, value):
+    """Set the value of a parameter in a nested settings dictionary.
+
+    Parameters
+    ----------
+    settings: dict
+        Nested settings
+    key: string
+        Parameter path
+    value: string
+        Parameter value
+    """
+    path = key.split('/')
+    el = settings
+    for comp in path[:-1]:
+        el = el.setdefault(comp, dict())
+    el[path[-1]] = value
+
+
+def write_yaml(filename, data):
+    """Write the given data to file in Yaml format.
+
+    Parameters
+    ----------
+    filename: string
+        Output file
+    data: dict or list
+        Serializable data
+    """
+    with open(filename, 'w') as f:
+        yaml.dump(data, f, Dumper=YamlDumper, default_flow_style=False)
+
+
+# ------------------------------------------------------------------------------
+# Benchmarks
+# ------------------------------------------------------------------------------
+
+def get_benchmarks(sizes):
+    """Get the list of benchmarks for the repository hierarchy. Expects the
+    deepest clone to be the current working directory.
+
+    Parameters
+    ----------
+    sizes: dict
+        Repository sizes
+
+    Returns
+    -------
+    list(Benchmark)
+    """
+    rnd = random.Random(7)
+    base_dir = exp.get_base()
+    reg_dir = os.path.join(base_dir, exp.REPO_DIR, exp.COMMAND_DIR)
+    settings_files = [
+        get_settings_file(base_dir=base_dir),
+        get_settings_file(),
+        get_global_variables_file()
+    ]
+    log_file = get_log_file()
+    keys = get_settings_keys(sizes['settings'])
+    lookups = [rnd.choice(keys) for i in range(sizes['lookups'])]
+    name = 'cmd' + str(rnd.randrange(sizes['commands']))
+    sweep = ['seed=1..' + str(sizes['sweep_points'])]
+    def remove_registry_index():
+        INDEX_CACHE.clear()
+        remove_file(os.path.join(reg_dir, exp.COMMAND_INDEX_FILE))
+    def remove_snapshots():
+        YAML_CACHE.clear()
+        for filename in settings_files:
+            remove_file(get_snapshot_file(filename))
+    def reset_log():
+        truncate_log(log_file, sizes['log_lines'])
+    def remove_log_index():
+        reset_log()
+        remove_file(get_index_file(log_file))
+    def merge_settings():
+        base = read_yaml_file(settings_files[0])
+        clone = read_yaml_file(settings_files[1])
+        nested_merge(nested_merge(dict(), base, copy=True), clone, copy=True)
+    def lookup_values():
+        config = get_settings()
+        for key in lookups:
+            config.get_value(key)
+    def expand_sweep():
+        template = CommandTemplate(get_command(name))
+        template.render_many(
+            get_settings(),
+            get_global_variables(),
+            expand_arguments(sweep)
+        )
+    last_time = time.time() - sizes['log_lines'] // 100
+    return [
+        Benchmark('get_commands_cold', get_commands, setup=remove_registry_index),
+        Benchmark('get_commands_warm', get_commands),
+        Benchmark('get_settings_cold', get_settings, setup=remove_snapshots),
+        Benchmark('get_settings_warm', get_settings),
+        Benchmark('nested_merge', merge_settings),
+        Benchmark('config_get_value', lookup_values),
+        Benchmark('expand_variables', expand_sweep),
+        Benchmark(
+            'submit_sweep',
+            lambda: run_command(PRG_NAME, name, sweep, run_local=False),
+            setup=reset_log
+        ),
+        Benchmark(
+            'log_index_build',
+            lambda: sync_index(log_file),
+            setup=remove_log_index
+        ),
+        Benchmark('print_log_tail', lambda: print_log(tail=20)),
+        Benchmark('print_log_range', lambda: print_log(since=last_time)),
+        Benchmark('print_log_filter', lambda: print_log(command=name)),
+        Benchmark(
+            'cli_command_show',
+            lambda: main(PRG_NAME, [exp.CMD_COMMAND, exp.CMD_COMMAND_LIST, name])
+        ),
+        Benchmark(
+            'cli_log_tail',
+            lambda: main(PRG_NAME, [exp.CMD_LOG, exp.OPT_LOG_TAIL, '20'])
+        ),
+        Benchmark(
+            'cli_submit',
+            lambda: main(PRG_NAME, [exp.CMD_SUBMIT, name]),
+            setup=reset_log
+        ),
+        Benchmark('cli_process_log_tail', run_cli_process)
+    ]
+
+
+def remove_file(filename):
+    """Remove a file if it exists.
+
+    Parameters
+    ----------
+    filename: string
+        Path to the file
+    """
+    if os.path.isfile(filename):
+        os.remove(filename)
+
+
+def truncate_log(filename, count):
+    """Remove all but the first count entries from the log and its index.
+
+    Parameters
+    ----------
+    filename: string
+        Path to the log file
+    count: int
+        Number of entries that are kept
+    """
+    sync_index(filename)
+    index_file = get_index_file(filename)
+    index = LogIndex(index_file)
+    try:
+        if len(index) <= count:
+            return
+        offset = index.offset(count)
+    finally:
+        index.close()
+    with open(filename, 'r+b') as f:
+        f.truncate(offset)
+    with open(index_file, 'r+b') as f:
+        f.truncate(count * INDEX_RECORD.size)
+
+
+def run_cli_process():
+    """Run the command line interface in a new interpreter process. Includes
+    interpreter start-up and module imports.
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = PACKAGE_DIR + os.pathsep + env.get('PYTHONPATH', '')
+    with open(os.devnull, 'w') as devnull:
+        subprocess.check_call(
+            [sys.executable, '-m', 'exprepo', exp.CMD_LOG, exp.OPT_LOG_TAIL, '20'],
+            stdout=devnull,
+            env=env
+        )
+
+
+# ------------------------------------------------------------------------------
+# Main
+# ------------------------------------------------------------------------------
+
+def compare_results(results, filename):
+    """Print the median run times of the given results next to those in a
+    previous result file.
+
+    Parameters
+    ----------
+    results: dict
+        Benchmark results
+    filename: string
+        Path to a previous result file
+    """
+    with open(filename, 'r') as f:
+        baseline = json.load(f)['results']
+    print '\n%-24s %12s %12s %8s' % ('benchmark', 'baseline', 'current', 'ratio')
+    for name in sorted(results):
+        if not name in baseline:
+            continue
+        old = baseline[name]['median']
+        new = results[name]['median']
+        ratio = new / old if old > 0 else float('inf')
+        print '%-24s %11.4fs %11.4fs %7.2fx' % (name, old, new, ratio)
+
+
+def main_bench(args):
+    """Build the synthetic repositories, run the benchmarks and write the
+    results.
+
+    Parameters
+    ----------
+    args: argparse.Namespace
+        Command line arguments
+    """
+    sizes = dict()
+    for key in SIZES:
+        sizes[key] = max(1, int(SIZES[key] * args.scale))
+    sizes['clone_depth'] = SIZES['clone_depth']
+    work_dir = args.workdir
+    if work_dir is None:
+        work_dir = tempfile.mkdtemp(prefix='exprepo-bench-')
+    elif not os.path.isdir(work_dir):
+        os.makedirs(work_dir)
+    elif not os.path.isfile(os.path.join(work_dir, SIZES_FILE)) and len(os.listdir(work_dir)) > 0:
+        # Never remove files that were not created by the benchmarks
+        sys.exit('work directory \'' + work_dir + '\' is not empty')
+    cwd = os.getcwd()
+    try:
+        clone_dir = os.path.join(work_dir, BASE_DIR)
+        for depth in range(sizes['clone_depth']):
+            clone_dir = os.path.join(clone_dir, 'clone' + str(depth))
+        sizes_file = os.path.join(work_dir, SIZES_FILE)
+        existing = None
+        if os.path.isfile(sizes_file):
+            with open(sizes_file, 'r') as f:
+                existing = json.load(f)
+        if existing != sizes:
+            # Only remove the repositories of an earlier run
+            if os.path.isdir(os.path.join(work_dir, BASE_DIR)):
+                shutil.rmtree(os.path.join(work_dir, BASE_DIR))
+            remove_file(sizes_file)
+            print 'building repositories in ' + work_dir
+            start = time.time()
+            build_repositories(work_dir, sizes)
+            print 'done in %.1fs' % (time.time() - start)
+        os.chdir(clone_dir)
+        benchmarks = get_benchmarks(sizes)
+        if not args.only is None:
+            names = args.only.split(',')
+            benchmarks = [b for b in benchmarks if b.name in names]
+        results = dict()
+        for benchmark in benchmarks:
+            results[benchmark.name] = benchmark.run(args.repeat)
+            print '%-24s %11.4fs (min %.4fs)' % (
+                benchmark.name,
+                results[benchmark.name]['median'],
+                results[benchmark.name]['min']
+            )
+    finally:
+        os.chdir(cwd)
+        if args.workdir is None:
+            shutil.rmtree(work_dir)
+    doc = {
+        'label': args.label,
+        'time': time.time(),
+        'python': sys.version,
+        'platform': platform.platform(),
+        'scale': args.scale,
+        'sizes': sizes,
+        'results': results
+    }
+    if not args.output is None:
+        with open(args.output, 'w') as f:
+            json.dump(doc, f, indent=2, sort_keys=True)
+    if not args.compare is None:
+        compare_results(results, args.compare)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run exprepo benchmarks')
+    parser.add_argument('--scale', type=float, default=1.0, help='Size factor for the synthetic repositories')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of timed runs per benchmark')
+    parser.add_argument('--workdir', help='Directory for the synthetic repositories (kept between runs)')
+    parser.add_argument('--only', help='Comma-separated list of benchmarks to run')
+    parser.add_argument('--output', help='Write results to this file (JSON)')
+    parser.add_argument('--compare', help='Compare results against a previous result file')
+    parser.add_argument('--label', help='Label for the results (e.g., the version)')
+    main_bench(parser.parse_args())
@@ -4,25 +4,49 @@
 import os
 import sys
 
+from exprepo.timing import timed
+
 # ------------------------------------------------------------------------------
 # Global Constants
 # ------------------------------------------------------------------------------
 
 """Name of the directories that contains the reporitory data."""
+ARRAY_DIR = 'arrays'
+CACHE_DIR = 'cache'
 COMMAND_DIR = 'commands'
 REPO_DIR = '.xpr'
+RESULTS_DIR = 'results'
+RUN_DIR = 'runs'
+SPOOL_DIR = 'spool'
+SWEEP_DIR = 'sweeps'
 
 
 """Name of configuration files."""
 BASE_FILE = 'BASE'
+CLONES_FILE = 'CLONES'
+COMMAND_INDEX_FILE = 'INDEX'
+EVENTS_FILE = 'EVENTS'
+FINGERPRINT_FILE = 'FINGERPRINTS'
 GLOBAL_VARIABLES_FILE = 'GLOBAL'
 LOG_FILE = 'LOG'
+SERVER_LOG_FILE = 'server.log'
+SERVER_PID_FILE = 'server.pid'
+SERVER_SOCKET_FILE = 'server.sock'
 SETTINGS_FILE = 'SETTINGS'
+STATUS_CACHE_FILE = 'STATUS'
 
 
 """Command names."""
+# Job arrays for batch schedulers
+CMD_ARRAY = 'array'
+CMD_ARRAY_RUN = 'run'
+# Cache of successful runs
+CMD_CACHE = 'cache'
+CMD_CACHE_CLEAR = 'clear'
 # Create a clone of an existing repository
 CMD_CLONE = 'clone'
+CMD_CLONE_LIST = 'list'
+CMD_CLONE_SCAN = 'scan'
 CMD_CLONE_SOURCE = 'source'
 # Registry of executable scripts
 CMD_COMMAND = 'command'
@@ -41,16 +65,133 @@ CMD_GLOBAL_SHOW = 'show'
 CMD_INIT = 'init'
 # Command history
 CMD_LOG = 'log'
+CMD_LOG_SAMPLES = 'samples'
+CMD_LOG_SHOW = 'show'
+# Local run queue
+CMD_QUEUE = 'queue'
+CMD_QUEUE_SHOW = 'show'
+# Run pipelines of registered scripts
+CMD_PIPELINE = 'pipeline'
+CMD_PIPELINE_RUN = 'run'
+# Columnar store of run results
+CMD_RESULTS = 'results'
 # Run a script as part of an experiment
 CMD_RUN = 'run'
+# Search the parameter space of a script
+CMD_SEARCH = 'search'
+# Repository server that keeps registry and settings in memory
+CMD_SERVER = 'server'
+CMD_SERVER_START = 'start'
+CMD_SERVER_STATUS = 'status'
+CMD_SERVER_STOP = 'stop'
+# Summary of runs in the repository or in all clones
+CMD_STATUS = 'status'
+# Spool of submitted jobs for workers
+CMD_SPOOL = 'spool'
+CMD_SPOOL_SHOW = 'show'
 # Submit a script without running it locally
 CMD_SUBMIT = 'submit'
+# Run a single task of a job array
+CMD_TASK = 'task'
+# Show the progress of runs from the event stream
+CMD_WATCH = 'watch'
+# Run jobs from the spool
+CMD_WORKER = 'worker'
+
+
+"""Command options."""
+# Show the status of the base repository and all clones
+OPT_ALL = '--all'
+# Comma-separated list of aggregates for results
+OPT_AGGREGATE = '--agg'
+# Submit a parameter sweep as job array for the given scheduler
+OPT_ARRAY = '--array'
+# Skip runs of commands that have been run successfully before
+OPT_CACHE = '--cache'
+# Capture the output of runs in compressed files. The limit and tail options
+# bound the number of bytes that are stored for each output.
+OPT_CAPTURE = '--capture'
+OPT_CAPTURE_LIMIT = '--capture-limit'
+OPT_CAPTURE_TAIL = '--capture-tail'
+# Number of CPUs that are needed by a run
+OPT_CPUS = '--cpus'
+# Stop a worker when no job is pending
+OPT_DRAIN = '--drain'
+# Reduction factor for successive halving
+OPT_ETA = '--eta'
+# Comma-separated list of columns by which results are grouped
+OPT_GROUP = '--group'
+# Comma-separated list of input files (for the cache key or a registered
+# command)
+OPT_INPUTS = '--inputs'
+# Maximum number of commands that are run concurrently
+OPT_JOBS = '-j'
+# Filters and display options for log entries
+OPT_LOG_COMMAND = '--command'
+OPT_LOG_SINCE = '--since'
+OPT_LOG_SKIP = '--skip'
+OPT_LOG_SORT = '--sort'
+OPT_LOG_STATUS = '--status'
+OPT_LOG_TAIL = '--tail'
+OPT_LOG_UNTIL = '--until'
+OPT_LOG_USAGE = '--usage'
+# Maximum step of a run in a Hyperband search
+OPT_MAX_STEP = '--max-step'
+# Memory that is needed by a run
+OPT_MEMORY = '--memory'
+# Search method
+OPT_METHOD = '--method'
+# Key of the metric that is reported by runs of a search
+OPT_METRIC = '--metric'
+# Step of the first rung in a search with early stopping
+OPT_MIN_STEP = '--min-step'
+# Minimize (min) or maximize (max) the metric of a search
+OPT_MODE = '--mode'
+# Print the progress of runs once
+OPT_ONCE = '--once'
+# Comma-separated list of output files for a registered command
+OPT_OUTPUTS = '--outputs'
+# Placement policy for concurrent runs (pin, numa, or node:<n>)
+OPT_PLACEMENT = '--placement'
+# Priority of a run in the run queue
+OPT_PRIORITY = '--priority'
+# Print the time spent in each phase of a command
+OPT_PROFILE = '--profile'
+# Write cProfile statistics for a command to the given file
+OPT_PROFILE_STATS = '--profile-stats'
+# Wait for admission by the local run queue before running
+OPT_QUEUE = '--queue'
+# Skip points of a sweep that are done according to the sweep journal
+OPT_RESUME = '--resume'
+# Number of times a failed run is repeated
+OPT_RETRIES = '--retries'
+# Interval in seconds for sampling the resource usage of a run
+OPT_SAMPLE = '--sample'
+# Seed for sampling parameter values in a search
+OPT_SEED = '--seed'
+# Include the local settings of repositories in the status
+OPT_SETTINGS = '--settings'
+# Unix socket on which the progress view listens for events
+OPT_SOCKET = '--socket'
+# Write submitted jobs to the spool
+OPT_SPOOL = '--spool'
+# Seconds after which the heartbeat of a spooled job is stale
+OPT_STALE = '--stale'
+# Show the captured standard error instead of the standard output
+OPT_STDERR = '--stderr'
+# Number of threads of numerical libraries in each run
+OPT_THREADS = '--threads'
+# Maximum run time of a command in seconds
+OPT_TIMEOUT = '--timeout'
+# Number of trials in a search
+OPT_TRIALS = '--trials'
 
 
 # ------------------------------------------------------------------------------
 # Helper Methods
 # ------------------------------------------------------------------------------
 
+@timed('base')
 def get_base():
     """Get the path to the repository base directory. Not that the value in the
     BASE_FILE is a path expression that is relative to the working dorectory,
@@ -0,0 +1,167 @@
+"""Everything related to the cache of successful runs.
+
+The cache maps the key of a resolved command to the log entry of a successful
+run of that command. The key is derived from the command line components and
+the content digests of declared input files. Each cache entry is a separate
+file in a directory that is named after the first characters of the key.
+Lookups therefore do not depend on the size of the cache or the log. Entries
+are written to a temporary file (named after the key with a unique suffix)
+that is renamed when it is complete.
+"""
+
+import hashlib
+import json
+import os
+import uuid
+
+import exprepo as exp
+
+
+# ------------------------------------------------------------------------------
+# API Methods
+# ------------------------------------------------------------------------------
+
+def clear_cache(name=None):
+    """Remove entries from the cache. If a command name is given only entries
+    for runs of that command are removed. Entries that are being written by
+    concurrent runs are not removed. Returns the number of removed entries.
+
+    Parameters
+    ----------
+    name: string, optional
+        Name of the command
+
+    Returns
+    -------
+    int
+    """
+    cache_dir = get_cache_dir()
+    if not os.path.isdir(cache_dir):
+        return 0
+    if not name is None:
+        # Command names are case-insensitive
+        name = name.lower()
+    count = 0
+    for dir_name in os.listdir(cache_dir):
+        key_dir = os.path.join(cache_dir, dir_name)
+        for key in os.listdir(key_dir):
+            if '.' in key:
+                # Skip temporary files of entries that are being written
+                continue
+            filename = os.path.join(key_dir, key)
+            if not name is None:
+                with open(filename, 'r') as f:
+                    if json.load(f)['command'].lower() != name:
+                        continue
+            os.remove(filename)
+            count += 1
+        if name is None:
+            try:
+                os.rmdir(key_dir)
+            except OSError:
+                # The directory contains entries that are being written
+                pass
+    return count
+
+
+def get_cache_dir():
+    """Get the directory that contains the cache of successful runs.
+
+    Returns
+    -------
+    string
+    """
+    return os.path.join(exp.REPO_DIR, exp.CACHE_DIR)
+
+
+def get_cache_key(cmd, digests=None):
+    """Get the cache key for the given command line components. The key
+    includes the content digests of input files (see
+    exprepo.fingerprint.get_digests).
+
+    Raises ValueError if an input file does not exist.
+
+    Parameters
+    ----------
+    cmd: list(string)
+        Command line components
+    digests: dict, optional
+        Content digests of the input files of the command keyed by their
+        absolute path
+
+    Returns
+    -------
+    string
+    """
+    key = {'args': cmd}
+    if not digests is None:
+        key['inputs'] = list()
+        for path in sorted(digests):
+            if digests[path] is None:
+                raise ValueError('unknown input file \'' + path + '\'')
+            key['inputs'].append([path, digests[path]])
+    return hashlib.sha1(json.dumps(key, sort_keys=True)).hexdigest()
+
+
+def lookup(key):
+    """Get the log entry for a successful run with the given cache key.
+    Returns None if the cache does not contain the key.
+
+    Parameters
+    ----------
+    key: string
+        Cache key
+
+    Returns
+    -------
+    dict
+    """
+    filename = get_entry_file(key)
+    if not os.path.isfile(filename):
+        return None
+    with open(filename, 'r') as f:
+        return json.load(f)
+
+
+def store(key, entry):
+    """Add the log entry for a successful run to the cache.
+
+    Parameters
+    ----------
+    key: string
+        Cache key
+    entry: dict
+        Log entry
+    """
+    filename = get_entry_file(key)
+    key_dir = os.path.dirname(filename)
+    if not os.path.isdir(key_dir):
+        try:
+            os.makedirs(key_dir)
+        except OSError:
+            # The directory may have been created by a concurrent run
+            if not os.path.isdir(key_dir):
+                raise
+    tmp_file = filename + '.' + uuid.uuid4().hex
+    with open(tmp_file, 'w') as f:
+        json.dump(entry, f, separators=(',', ':'))
+    os.rename(tmp_file, filename)
+
+
+# ------------------------------------------------------------------------------
+# Helper Methods
+# ------------------------------------------------------------------------------
+
+def get_entry_file(key):
+    """Get the file for the cache entry with the given key.
+
+    Parameters
+    ----------
+    key: string
+        Cache key
+
+    Returns
+    -------
+    string
+    """
+    return os.path.join(get_cache_dir(), key[:2], key)
@@ -0,0 +1,739 @@
+"""Command line interface of the experiment repository."""
+
+import exprepo as exp
+import exprepo.command as cmd
+from exprepo.cache import clear_cache
+from exprepo.clones import print_clones, print_status, scan_clones
+from exprepo.clones import DEFAULT_JOBS
+from exprepo.events import watch
+from exprepo.init import clone_repository, init_repository
+from exprepo.jobarray import exec_task, run_array
+from exprepo.log import parse_time, print_log, print_output, print_samples
+from exprepo.pipeline import run_pipeline
+from exprepo.results import print_results
+from exprepo.runqueue import parse_memory, print_queue
+from exprepo.search import run_search
+from exprepo.server import print_server_status, start_server, stop_server
+from exprepo.settings import print_settings, update_settings
+from exprepo.settings import print_global_variables, update_global_variables
+from exprepo.spool import print_spool
+from exprepo.worker import run_worker, STALE_TIMEOUT
+
+
+def get_capture(opts):
+    """Get the capture options for run output that are given as command
+    options. Returns None if output is not captured.
+
+    Raises ValueError if an option value is invalid.
+
+    Parameters
+    ----------
+    opts: dict
+        Command options
+
+    Returns
+    -------
+    dict
+    """
+    capture = dict()
+    if exp.OPT_CAPTURE_LIMIT in opts:
+        capture['limit'] = parse_memory(opts[exp.OPT_CAPTURE_LIMIT])
+    if exp.OPT_CAPTURE_TAIL in opts:
+        capture['tail'] = parse_memory(opts[exp.OPT_CAPTURE_TAIL])
+    if len(capture) == 0 and not exp.OPT_CAPTURE in opts:
+        return None
+    return capture
+
+
+def get_resources(opts):
+    """Get the dictionary of resources that are given as command options.
+
+    Raises ValueError if an option value is invalid.
+
+    Parameters
+    ----------
+    opts: dict
+        Command options
+
+    Returns
+    -------
+    dict
+    """
+    resources = dict()
+    if exp.OPT_CPUS in opts:
+        resources['cpus'] = parse_int(opts[exp.OPT_CPUS])
+    if exp.OPT_MEMORY in opts:
+        resources['memory'] = parse_memory(opts[exp.OPT_MEMORY])
+    return resources
+
+
+def help(prg_name):
+    """Print the default help statement contaiing a listing and short
+    description of the currently supported commands.
+
+    Paramaters
+    ----------
+    prg_name : string
+        Name with which the program was called
+    """
+    return """Usage: """ + prg_name + """ <command> [<arguments>]
+
+These are the commands that are currently implements:
+
+  init     Initialize a new experiment reposiroty
+  clone    Create a local copy of the experiment repository
+  status   Summarize the runs in the repository or in all clones
+  command  Manage scripts that are run as part of the experiment
+  config   Show and set the values of a configuration parameters
+  env   Show and set the global variables
+  log      Show execution history of script commands
+  queue    Show the state of the local run queue
+  pipeline Run registered script commands in order of their dependencies
+  results  Aggregate parameters and metrics of runs
+  run      Run a registered script command
+  search   Search parameter values with early stopping of runs
+  server   Start or stop the repository server
+  submit   Submit a script to run on a remote machine
+  spool    Show the state of the jobs in the spool
+  worker   Run jobs from the spool
+  watch    Show the progress of running sweeps
+  cache    Clear the cache of successful runs
+  array    Run the tasks of a submitted job array locally
+  task     Run a single task of a submitted job array
+"""
+
+
+def parse_float(value):
+    """Convert an option value to float. Returns None if the value is None.
+
+    Raises ValueError if the value is not a number.
+
+    Parameters
+    ----------
+    value: string
+        Option value
+
+    Returns
+    -------
+    float
+    """
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError('invalid number \'' + str(value) + '\'')
+
+
+def parse_int(value):
+    """Convert an option value to int. Returns None if the value is None.
+
+    Raises ValueError if the value is not an integer.
+
+    Parameters
+    ----------
+    value: string
+        Option value
+
+    Returns
+    -------
+    int
+    """
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError('invalid number \'' + str(value) + '\'')
+
+
+def parse_options(args, options):
+    """Split a list of command arguments into a dictionary of options and the
+    list of remaining arguments. Options are only recognized at the beginning
+    of the argument list. The options dictionary maps the known option names
+    to a flag indicating whether the option takes a value.
+
+    Raises ValueError if an option that takes a value is the last argument.
+
+    Parameters
+    ----------
+    args: list(string)
+        List of command arguments
+    options: dict
+        Known options
+
+    Returns
+    -------
+    (dict, list(string))
+    """
+    result = dict()
+    pos = 0
+    while pos < len(args) and args[pos] in options:
+        opt = args[pos]
+        if options[opt]:
+            if pos + 1 == len(args):
+                raise ValueError('missing value for option \'' + opt + '\'')
+            result[opt] = args[pos + 1]
+            pos += 2
+        else:
+            result[opt] = True
+            pos += 1
+    return result, args[pos:]
+
+
+def main(prg_name, args):
+    """Main routine to execute a repository command.
+
+    Parameters
+    ----------
+    prg_name : string
+        Name with which the program was called
+    args: list(string)
+        List of command line arguments
+    """
+    # The first argument is the command name
+    cmd_name = args[0]
+    cmd_help = ['usage:', prg_name, args[0]]
+    if cmd_name == exp.CMD_INIT:
+        # Initialize a new repository. Init does not take any further arguments.
+        if len(args) == 1:
+            init_repository()
+        else:
+            print ' '.join(cmd_help)
+    elif cmd_name == exp.CMD_CLONE:
+        # Create a clone repository in the current working directory. Clone
+        # takes and optional source argument that specifies the directory from
+        # which settings are copied. The list and scan sub-commands show and
+        # rebuild the registry of clones in the base repository.
+        cmd_help += [
+            '[',
+                exp.CMD_CLONE_SOURCE, '<source-dir>',
+            '|',
+                exp.CMD_CLONE_LIST,
+            '|',
+                exp.CMD_CLONE_SCAN,
+            ']'
+        ]
+        if len(args) == 1:
+            clone_repository()
+        elif len(args) == 3 and args[1] == exp.CMD_CLONE_SOURCE:
+            clone_repository(source_dir=args[2])
+        elif len(args) == 2 and args[1] == exp.CMD_CLONE_LIST:
+            print_clones()
+        elif len(args) == 2 and args[1] == exp.CMD_CLONE_SCAN:
+            print str(scan_clones()) + ' clones registered'
+        else:
+            print ' '.join(cmd_help)
+    elif cmd_name == exp.CMD_CONFIG:
+        # Show and manipulate the experiment configuration. Expects at least one
+        # addditional parameter specifying the sub-command: Print (SHOW) or
+        # manipulate (SET). To delete a configuration parameter omit the value
+        # in a SET statement
+        cmd_help += [
+            '[',
+                exp.CMD_CONFIG_SHOW,
+            '|',
+                exp.CMD_CONFIG_SET, '<parameter>', '{<value>}',
+            ']'
+        ]
+        if len(args) > 1:
+            #
+            if len(args) == 2 and args[1] == exp.CMD_CONFIG_SHOW:
+                print_settings()
+            elif len(args) == 3 and args[1] == exp.CMD_CONFIG_SET:
+                update_settings(args[2])
+            elif len(args) == 4 and args[1] == exp.CMD_CONFIG_SET:
+                update_settings(args[2], args[3])
+            else:
+                print ' '.join(cmd_help)
+        else:
+            print ' '.join(cmd_help)
+    elif cmd_name == exp.CMD_GLOBAL:
+        # Show and manipulate global variables that descript the local
+        # environment. Expects at least one addditional parameter specifying the
+        # sub-command: Print (SHOW) or manipulate (SET). To delete a variable
+        # omit the value in a SET statement
+        cmd_help += [
+            '[',
+                exp.CMD_GLOBAL_SHOW,
+            '|',
+                exp.CMD_GLOBAL_SET, '<variable>', '{<value>}',
+            ']'
+        ]
+        if len(args) > 1:
+            if len(args) == 2 and args[1] == exp.CMD_GLOBAL_SHOW:
+                print_global_variables()
+            elif len(args) == 3 and args[1] == exp.CMD_GLOBAL_SET:
+                update_global_variables(args[2])
+            elif len(args) == 4 and args[1] == exp.CMD_GLOBAL_SET:
+                update_global_variables(args[2], args[3])
+            else:
+                print ' '.join(cmd_help)
+        else:
+            print ' '.join(cmd_help)
+    elif cmd_name == exp.CMD_COMMAND:
+        # Show and manipulate the experiment script registry. Expects at least
+        # one addditional parameter specifying the sub-command. Commands that
+        # are added or updated may declare their input and output files.
+        files_help = [
+            '{', exp.OPT_INPUTS, '<file>{,<file>}', '}',
+            '{', exp.OPT_OUTPUTS, '<file>{,<file>}', '}',
+            '{', exp.OPT_CPUS, '<n>', '}',
+            '{', exp.OPT_MEMORY, '<size>', '}'
+        ]
+        cmd_help += [
+            '[',
+                exp.CMD_COMMAND_LIST, '{<name>}'
+            '|',
+                exp.CMD_COMMAND_ADD] + files_help + ['<name>', '<spec>',
+            '|',
+                exp.CMD_COMMAND_UPDATE] + files_help + ['<name>', '<spec>',
+            ']'
+        ]
+        if len(args) > 1:
+            opts, cmd_args = parse_options(
+                args[2:],
+                {
+                    exp.OPT_CPUS: True,
+                    exp.OPT_INPUTS: True,
+                    exp.OPT_MEMORY: True,
+                    exp.OPT_OUTPUTS: True
+                }
+            )
+            inputs, outputs = None, None
+            if exp.OPT_INPUTS in opts:
+                inputs = opts[exp.OPT_INPUTS].split(',')
+            if exp.OPT_OUTPUTS in opts:
+                outputs = opts[exp.OPT_OUTPUTS].split(',')
+            resources = get_resources(opts)
+            if len(args) == 2 and args[1] == exp.CMD_COMMAND_LIST:
+                # Print a listing of the registered scripts
+                cmd.list_commands()
+            elif len(args) == 3 and args[1] == exp.CMD_COMMAND_LIST:
+                # Print a listing of the registered scripts
+                cmd.show_command(args[2])
+            elif len(cmd_args) == 2 and args[1] == exp.CMD_COMMAND_ADD:
+                # Add a new command to the script registry
+                cmd.add_command(
+                    cmd_args[0],
+                    cmd_args[1],
+                    inputs=inputs,
+                    outputs=outputs,
+                    resources=resources
+                )
+            elif len(cmd_args) == 2 and args[1] == exp.CMD_COMMAND_UPDATE:
+                # Update the specification of an existing command
+                cmd.add_command(
+                    cmd_args[0],
+                    cmd_args[1],
+                    replace=True,
+                    inputs=inputs,
+                    outputs=outputs,
+                    resources=resources
+                )
+            else:
+                print ' '.join(cmd_help)
+        else:
+            print ' '.join(cmd_help)
+    elif cmd_name == exp.CMD_CACHE:
+        # Invalidate the cache of successful runs. Expects the sub-command and
+        # an optional command name.
+        cmd_help += [exp.CMD_CACHE_CLEAR, '{<name>}']
+        if len(args) in [2, 3] and args[1] == exp.CMD_CACHE_CLEAR:
+            name = args[2] if len(args) == 3 else None
+            print str(clear_cache(name=name)) + ' cache entries removed'
+        else:
+            print ' '.join(cmd_help)
+    elif cmd_name == exp.CMD_LOG:
+        # Print the list of experiment script commands that have been run. The
+        # options and optional list of <key>=<value> arguments filter the
+        # printed entries. The samples sub-command prints the resource usage
+        # samples of a single run. The show sub-command prints the captured
+        # output of a single run.
+        if len(args) > 1 and args[1] == exp.CMD_LOG_SAMPLES:
+            if len(args) == 3:
+                print_samples(args[2])
+            else:
+                print ' '.join(cmd_help + [exp.CMD_LOG_SAMPLES, '<run-id>'])
+        elif len(args) > 1 and args[1] == exp.CMD_LOG_SHOW:
+            opts, cmd_args = parse_options(args[2:], {exp.OPT_STDERR: False})
+            if len(cmd_args) == 1:
+                print_output(cmd_args[0], stderr=exp.OPT_STDERR in opts)
+            else:
+                print ' '.join(
+                    cmd_help + [
+                        exp.CMD_LOG_SHOW,
+                        '{', exp.OPT_STDERR, '}',
+                        '<run-id>'
+                    ]
+                )
+        else:
+            opts, params = parse_options(
+                args[1:],
+                {
+                    exp.OPT_LOG_COMMAND: True,
+                    exp.OPT_LOG_SINCE: True,
+                    exp.OPT_LOG_SKIP: True,
+                    exp.OPT_LOG_SORT: True,
+                    exp.OPT_LOG_STATUS: True,
+                    exp.OPT_LOG_TAIL: True,
+                    exp.OPT_LOG_UNTIL: True,
+                    exp.OPT_LOG_USAGE: False
+                }
+            )
+            param_values = dict()
+            for arg in params:
+                pos = arg.find('=')
+                if pos < 0:
+                    raise ValueError('invalid argument \'' + arg + '\'')
+                param_values[arg[:pos]] = arg[pos+1:]
+            print_log(
+                tail=parse_int(opts.get(exp.OPT_LOG_TAIL)),
+                skip=parse_int(opts.get(exp.OPT_LOG_SKIP, 0)),
+                since=parse_time(opts[exp.OPT_LOG_SINCE]) if exp.OPT_LOG_SINCE in opts else None,
+                until=parse_time(opts[exp.OPT_LOG_UNTIL]) if exp.OPT_LOG_UNTIL in opts else None,
+                command=opts.get(exp.OPT_LOG_COMMAND),
+                status=opts.get(exp.OPT_LOG_STATUS),
+                params=param_values if len(param_values) > 0 else None,
+                sort=opts.get(exp.OPT_LOG_SORT),
+                usage=exp.OPT_LOG_USAGE in opts or exp.OPT_LOG_SORT in opts
+            )
+    elif cmd_name == exp.CMD_PIPELINE:
+        # Run the pipeline for a list of registered commands. The arguments
+        # contain the names of the target commands (all commands that declare
+        # files by default) and an optional list of command arguments.
+        cmd_help += [
+            exp.CMD_PIPELINE_RUN,
+            '{', exp.OPT_JOBS, '<n>', '}',
+            '{<name>}', '{<arguments>}'
+        ]
+        if len(args) > 1 and args[1] == exp.CMD_PIPELINE_RUN:
+            opts, cmd_args = parse_options(args[2:], {exp.OPT_JOBS: True})
+            run_pipeline(
+                prg_name,
+                [arg for arg in cmd_args if not '=' in arg],
+                [arg for arg in cmd_args if '=' in arg],
+                jobs=parse_int(opts.get(exp.OPT_JOBS, 1))
+            )
+        else:
+            print ' '.join(cmd_help)
+    elif cmd_name == exp.CMD_QUEUE:
+        # Show the state of the local run queue
+        cmd_help += [exp.CMD_QUEUE_SHOW]
+        if len(args) == 2 and args[1] == exp.CMD_QUEUE_SHOW:
+            print_queue()
+        else:
+            print ' '.join(cmd_help)
+    elif cmd_name == exp.CMD_RESULTS:
+        # Aggregate the parameter values and metrics of runs. Runs are
+        # filtered by the optional arguments and grouped by the values of the
+        # columns that are given as option.
+        cmd_help += [
+            '{', exp.OPT_GROUP, '<column>{,<column>}', '}',
+            '{', exp.OPT_AGGREGATE, '<function>[:<column>]{,<function>[:<column>]}', '}',
+            '{<column><op><value>}'
+        ]
+        opts, cmd_args = parse_options(
+            args[1:],
+            {exp.OPT_AGGREGATE: True, exp.OPT_GROUP: True}
+        )
+        group_by, aggregates = None, None
+        if exp.OPT_GROUP in opts:
+            group_by = opts[exp.OPT_GROUP].split(',')
+        if exp.OPT_AGGREGATE in opts:
+            aggregates = opts[exp.OPT_AGGREGATE].split(',')
+        print_results(filters=cmd_args, group_by=group_by, aggregates=aggregates)
+    elif cmd_name == exp.CMD_RUN:
+        # Run a registered experiment command. Expects the script name as an
+        # additional argument and an optional list of command arguments. The
+        # number of concurrent runs for a parameter sweep is given as option.
+        # Commands that have been run successfully before are skipped if the
+        # cache option is given. Runs wait for admission by the local run
+        # queue if the queue option or any resource option is given. The
+        # resource usage of runs is sampled if the sample option is given.
+        # The output of runs is written to the run directory if any of the
+        # capture options is given. Runs that exceed the timeout are
+        # terminated and failed runs are retried. The resume option skips
+        # points of the sweep that are done according to its journal. The
+        # placement option pins concurrent runs to CPU sets and the threads
+        # option sets the thread count of numerical libraries.
+        cmd_help += [
+            '{', exp.OPT_JOBS, '<n>', '}',
+            '{', exp.OPT_CACHE, '}',
+            '{', exp.OPT_INPUTS, '<file>{,<file>}', '}',
+            '{', exp.OPT_QUEUE, '}',
+            '{', exp.OPT_CPUS, '<n>', '}',
+            '{', exp.OPT_MEMORY, '<size>', '}',
+            '{', exp.OPT_PRIORITY, '<n>', '}',
+            '{', exp.OPT_SAMPLE, '<seconds>', '}',
+            '{', exp.OPT_CAPTURE, '}',
+            '{', exp.OPT_CAPTURE_LIMIT, '<size>', '}',
+            '{', exp.OPT_CAPTURE_TAIL, '<size>', '}',
+            '{', exp.OPT_TIMEOUT, '<seconds>', '}',
+            '{', exp.OPT_RETRIES, '<n>', '}',
+            '{', exp.OPT_RESUME, '}',
+            '{', exp.OPT_PLACEMENT, '[pin|numa|node:<n>]', '}',
+            '{', exp.OPT_THREADS, '<n>', '}',
+            '<name>', '{<arguments>}'
+        ]
+        opts, cmd_args = parse_options(
+            args[1:],
+            {
+                exp.OPT_CACHE: False,
+                exp.OPT_CAPTURE: False,
+                exp.OPT_CAPTURE_LIMIT: True,
+                exp.OPT_CAPTURE_TAIL: True,
+                exp.OPT_CPUS: True,
+                exp.OPT_INPUTS: True,
+                exp.OPT_JOBS: True,
+                exp.OPT_MEMORY: True,
+                exp.OPT_PLACEMENT: True,
+                exp.OPT_PRIORITY: True,
+                exp.OPT_QUEUE: False,
+                exp.OPT_RESUME: False,
+                exp.OPT_RETRIES: True,
+                exp.OPT_SAMPLE: True,
+                exp.OPT_THREADS: True,
+                exp.OPT_TIMEOUT: True
+            }
+        )
+        if len(cmd_args) >= 1:
+            inputs = None
+            if exp.OPT_INPUTS in opts:
+                inputs = opts[exp.OPT_INPUTS].split(',')
+            queue = get_resources(opts)
+            if exp.OPT_PRIORITY in opts:
+                queue['priority'] = parse_int(opts[exp.OPT_PRIORITY])
+            if len(queue) == 0 and not exp.OPT_QUEUE in opts:
+                queue = None
+            cmd.run_command(
+                prg_name,
+                cmd_args[0],
+                cmd_args[1:],
+                jobs=parse_int(opts.get(exp.OPT_JOBS, 1)),
+                use_cache=exp.OPT_CACHE in opts,
+                inputs=inputs,
+                queue=queue,
+                sample=parse_float(opts.get(exp.OPT_SAMPLE)),
+                capture=get_capture(opts),
+                timeout=parse_float(opts.get(exp.OPT_TIMEOUT)),
+                retries=parse_int(opts.get(exp.OPT_RETRIES, 0)),
+                resume=exp.OPT_RESUME in opts,
+                placement=opts.get(exp.OPT_PLACEMENT),
+                threads=parse_int(opts.get(exp.OPT_THREADS))
+            )
+        else:
+            print ' '.join(cmd_help)
+    elif cmd_name == exp.CMD_SEARCH:
+        # Search the parameter space of a registered command. Expects the
+        # script name and the search space as arguments. Runs report metrics
+        # as JSON objects on standard output. With successive halving (asha)
+        # or Hyperband, runs that fall behind at a rung are stopped early.
+        cmd_help += [
+            '{', exp.OPT_METHOD, '[random|lhs|asha|hyperband]', '}',
+            '{', exp.OPT_TRIALS, '<n>', '}',
+            '{', exp.OPT_JOBS, '<n>', '}',
+            '{', exp.OPT_METRIC, '<key>', '}',
+            '{', exp.OPT_MODE, '[min|max]', '}',
+            '{', exp.OPT_MIN_STEP, '<n>', '}',
+            '{', exp.OPT_MAX_STEP, '<n>', '}',
+            '{', exp.OPT_ETA, '<n>', '}',
+            '{', exp.OPT_SEED, '<n>', '}',
+            '<name>', '{<key>=<low>:<high>{:log}|<values>}'
+        ]
+        opts, cmd_args = parse_options(
+            args[1:],
+            {
+                exp.OPT_ETA: True,
+                exp.OPT_JOBS: True,
+                exp.OPT_MAX_STEP: True,
+                exp.OPT_METHOD: True,
+                exp.OPT_METRIC: True,
+                exp.OPT_MIN_STEP: True,
+                exp.OPT_MODE: True,
+                exp.OPT_SEED: True,
+                exp.OPT_TRIALS: True
+            }
+        )
+        if len(cmd_args) >= 1:
+            run_search(
+                prg_name,
+                cmd_args[0],
+                cmd_args[1:],
+                method=opts.get(exp.OPT_METHOD, 'random'),
+                trials=parse_int(opts.get(exp.OPT_TRIALS, 10)),
+                jobs=parse_int(opts.get(exp.OPT_JOBS, 1)),
+                metric=opts.get(exp.OPT_METRIC),
+                mode=opts.get(exp.OPT_MODE, 'min'),
+                min_step=parse_int(opts.get(exp.OPT_MIN_STEP, 1)),
+                max_step=parse_int(opts.get(exp.OPT_MAX_STEP)),
+                eta=parse_int(opts.get(exp.OPT_ETA, 3)),
+                seed=parse_int(opts.get(exp.OPT_SEED))
+            )
+        else:
+            print ' '.join(cmd_help)
+    elif cmd_name == exp.CMD_SERVER:
+        # Start, stop or show the status of the server for the repository in
+        # the current working directory
+        cmd_help += [
+            '[',
+                exp.CMD_SERVER_START,
+            '|',
+                exp.CMD_SERVER_STOP,
+            '|',
+                exp.CMD_SERVER_STATUS,
+            ']'
+        ]
+        if len(args) == 2 and args[1] == exp.CMD_SERVER_START:
+            start_server()
+        elif len(args) == 2 and args[1] == exp.CMD_SERVER_STOP:
+            stop_server()
+        elif len(args) == 2 and args[1] == exp.CMD_SERVER_STATUS:
+            print_server_status()
+        else:
+            print ' '.join(cmd_help)
+    elif cmd_name == exp.CMD_STATUS:
+        # Print a summary of the runs in the repository. The all option
+        # includes the base repository and all registered clones. Clones are
+        # read concurrently by a pool of threads.
+        cmd_help += [
+            '{', exp.OPT_ALL, '}',
+            '{', exp.OPT_JOBS, '<n>', '}',
+            '{', exp.OPT_LOG_COMMAND, '<name>', '}',
+            '{', exp.OPT_SETTINGS, '}'
+        ]
+        opts, cmd_args = parse_options(
+            args[1:],
+            {
+                exp.OPT_ALL: False,
+                exp.OPT_JOBS: True,
+                exp.OPT_LOG_COMMAND: True,
+                exp.OPT_SETTINGS: False
+            }
+        )
+        if len(cmd_args) == 0:
+            print_status(
+                all_clones=exp.OPT_ALL in opts,
+                command=opts.get(exp.OPT_LOG_COMMAND),
+                settings=exp.OPT_SETTINGS in opts,
+                jobs=parse_int(opts.get(exp.OPT_JOBS, DEFAULT_JOBS))
+            )
+        else:
+            print ' '.join(cmd_help)
+    elif cmd_name == exp.CMD_SPOOL:
+        # Show the state of the jobs in the spool
+        cmd_help += [exp.CMD_SPOOL_SHOW]
+        if len(args) == 2 and args[1] == exp.CMD_SPOOL_SHOW:
+            print_spool()
+        else:
+            print ' '.join(cmd_help)
+    elif cmd_name == exp.CMD_SUBMIT:
+        # Submit a registered experiment command for execution on a remote host.
+        # Expects the script name as an additional argument and an optional list
+        # of command arguments. Parameter sweeps can be written as a job array
+        # for a batch scheduler or to the spool for workers.
+        cmd_help += [
+            '{', exp.OPT_ARRAY, '<scheduler>', '|', exp.OPT_SPOOL, '}',
+            '<name>', '{<arguments>}'
+        ]
+        opts, cmd_args = parse_options(
+            args[1:],
+            {exp.OPT_ARRAY: True, exp.OPT_SPOOL: False}
+        )
+        if len(cmd_args) >= 1 and not (exp.OPT_ARRAY in opts and exp.OPT_SPOOL in opts):
+            cmd.run_command(
+                prg_name,
+                cmd_args[0],
+                cmd_args[1:],
+                run_local=False,
+                scheduler=opts.get(exp.OPT_ARRAY),
+                spool=exp.OPT_SPOOL in opts
+            )
+        else:
+            print ' '.join(cmd_help)
+    elif cmd_name == exp.CMD_ARRAY:
+        # Run the tasks of a job array locally. Simulates the batch scheduler
+        # by setting the task identifier for each task.
+        cmd_help += [exp.CMD_ARRAY_RUN, '{', exp.OPT_JOBS, '<n>', '}', '<array-id>']
+        if len(args) > 1 and args[1] == exp.CMD_ARRAY_RUN:
+            opts, cmd_args = parse_options(args[2:], {exp.OPT_JOBS: True})
+            if len(cmd_args) == 1:
+                run_array(cmd_args[0], jobs=parse_int(opts.get(exp.OPT_JOBS, 1)))
+            else:
+                print ' '.join(cmd_help)
+        else:
+            print ' '.join(cmd_help)
+    elif cmd_name == exp.CMD_TASK:
+        # Run a single task of a job array. Expects the parameter table and the
+        # task index as arguments.
+        cmd_help += ['<table>', '<index>']
+        if len(args) == 3:
+            exec_task(args[1], parse_int(args[2]))
+        else:
+            print ' '.join(cmd_help)
+    elif cmd_name == exp.CMD_WATCH:
+        # Show the progress of sweeps from the event stream. Events are read
+        # from the event file or received on the unix socket that is given as
+        # option.
+        cmd_help += [
+            '{', exp.OPT_SOCKET, '<file>', '}',
+            '{', exp.OPT_ONCE, '}'
+        ]
+        opts, cmd_args = parse_options(
+            args[1:],
+            {exp.OPT_ONCE: False, exp.OPT_SOCKET: True}
+        )
+        if len(cmd_args) == 0:
+            watch(socket_file=opts.get(exp.OPT_SOCKET), once=exp.OPT_ONCE in opts)
+        else:
+            print ' '.join(cmd_help)
+    elif cmd_name == exp.CMD_WORKER:
+        # Run jobs from the spool. The number of slots, the drain option and
+        # the stale timeout for heartbeats are given as options.
+        cmd_help += [
+            '{', exp.OPT_JOBS, '<n>', '}',
+            '{', exp.OPT_DRAIN, '}',
+            '{', exp.OPT_STALE, '<seconds>', '}'
+        ]
+        opts, cmd_args = parse_options(
+            args[1:],
+            {exp.OPT_DRAIN: False, exp.OPT_JOBS: True, exp.OPT_STALE: True}
+        )
+        if len(cmd_args) == 0:
+            run_worker(
+                prg_name,
+                jobs=parse_int(opts.get(exp.OPT_JOBS, 1)),
+                drain=exp.OPT_DRAIN in opts,
+                stale=parse_float(opts.get(exp.OPT_STALE, STALE_TIMEOUT))
+            )
+        else:
+            print ' '.join(cmd_help)
+    elif cmd_name == '--help':
+        print help(prg_name)
+    else:
+        print prg_name + ': \'' + cmd_name + '\' is not a ' + prg_name + ' command. See \'' + prg_name + ' --help.'
+
+
+def run(prg_name, args):
+    """Run a repository command and return the exit code. Prints the help
+    statement if no command is given. Errors are printed to standard output.
+
+    Parameters
+    ----------
+    prg_name : string
+        Name with which the program was called
+    args: list(string)
+        List of command line arguments
+
+    Returns
+    -------
+    int
+    """
+    if len(args) == 0:
+        print help(prg_name)
+        return -1
+    try:
+        main(prg_name, args)
+    except (ValueError, RuntimeError) as ex:
+        print prg_name + ' (ERROR): ' + str(ex)
+    return 0
@@ -0,0 +1,224 @@
+"""Client for the repository server.
+
+Commands are forwarded to the repository server if a server is running for
+the repository in the current working directory. Client and server exchange
+frames that consist of a header with the frame type and payload length
+followed by the payload. The client sends a request frame. The server
+accepts the request and the client confirms that it is still waiting. The
+client then passes its standard input, standard output and standard error
+to the server (SCM_RIGHTS), so the forwarded command reads and writes them
+directly, including a terminal. The server responds with a final frame with
+the exit code. If the server does not accept the request in time, the
+client runs the command itself without confirming. Signals that interrupt
+the client (SIGINT, SIGTERM) are sent to the server and delivered to the
+forwarded command.
+
+This module is imported before any command is run. It therefore only depends
+on modules that are fast to import.
+"""
+
+from _multiprocessing import sendfd
+import errno
+import json
+import os
+import signal
+import socket
+import struct
+import sys
+
+import exprepo as exp
+
+
+# ------------------------------------------------------------------------------
+# Constants
+# ------------------------------------------------------------------------------
+
+"""Frame header containing the frame type and the payload length."""
+FRAME_HEADER = struct.Struct('<cI')
+
+"""Frame types."""
+FRAME_ACCEPT = 'a'
+FRAME_CONFIRM = 'c'
+FRAME_EXIT = 'x'
+FRAME_REQUEST = 'r'
+FRAME_SIGNAL = 's'
+
+"""Seconds to wait for the server to accept a connection and a request
+before the command is run in-process."""
+ACCEPT_TIMEOUT = 2.0
+
+"""File descriptors of the client that are passed to the forwarded command
+(standard input, standard output and standard error)."""
+FORWARDED_FDS = [0, 1, 2]
+
+"""Signals that are forwarded to the server."""
+FORWARDED_SIGNALS = [signal.SIGINT, signal.SIGTERM]
+
+"""Commands that are handled by the server. For commands with sub-commands
+only the listed sub-commands are forwarded."""
+FORWARDED_COMMANDS = {
+    exp.CMD_CONFIG: [exp.CMD_CONFIG_SHOW],
+    exp.CMD_LOG: None,
+    exp.CMD_RUN: None,
+    exp.CMD_SUBMIT: None
+}
+
+
+# ------------------------------------------------------------------------------
+# API Methods
+# ------------------------------------------------------------------------------
+
+def forward(prg_name, args):
+    """Forward a command to the repository server. The command uses the
+    standard input, standard output and standard error of the client. Returns
+    the exit code of the command or None if the command is not handled by
+    the server, no server is running, or the server does not accept the
+    request within ACCEPT_TIMEOUT seconds.
+
+    Parameters
+    ----------
+    prg_name : string
+        Name with which the program was called
+    args: list(string)
+        List of command line arguments
+
+    Returns
+    -------
+    int
+    """
+    if len(args) == 0 or not args[0] in FORWARDED_COMMANDS:
+        return None
+    sub_commands = FORWARDED_COMMANDS[args[0]]
+    if not sub_commands is None and (len(args) < 2 or not args[1] in sub_commands):
+        return None
+    filename = get_socket_file()
+    if not os.path.exists(filename):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    handlers = dict()
+    try:
+        request = {
+            'prg_name': prg_name,
+            'args': args,
+            'cwd': os.getcwd(),
+            'env': dict(os.environ)
+        }
+        sock.settimeout(ACCEPT_TIMEOUT)
+        try:
+            sock.connect(filename)
+            send_frame(sock, FRAME_REQUEST, json.dumps(request))
+            frame = read_frame(sock)
+        except socket.error:
+            # Run the command in-process if the server is not responding.
+            # The server does not run a request that was not confirmed.
+            return None
+        if frame is None or frame[0] != FRAME_ACCEPT:
+            return None
+        send_frame(sock, FRAME_CONFIRM, '')
+        sock.settimeout(None)
+        # Output that is buffered by the client would appear after the
+        # output of the command
+        sys.stdout.flush()
+        sys.stderr.flush()
+        for fd in FORWARDED_FDS:
+            sendfd(sock.fileno(), fd)
+        def forward_signal(signum, frame):
+            send_frame(sock, FRAME_SIGNAL, str(signum))
+        for signum in FORWARDED_SIGNALS:
+            handlers[signum] = signal.signal(signum, forward_signal)
+        while True:
+            frame = read_frame(sock)
+            if frame is None:
+                print >> sys.stderr, prg_name + ' (ERROR): connection to server lost'
+                return 1
+            frame_type, payload = frame
+            if frame_type == FRAME_EXIT:
+                return int(payload)
+    finally:
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+        sock.close()
+
+
+def get_socket_file():
+    """Get the path to the socket of the repository server. The path is
+    relative to the repository directory.
+
+    Returns
+    -------
+    string
+    """
+    return os.path.join(exp.REPO_DIR, exp.SERVER_SOCKET_FILE)
+
+
+def read_frame(sock):
+    """Read a frame from the given socket. Returns a tuple of frame type and
+    payload or None if the connection was closed.
+
+    Parameters
+    ----------
+    sock: socket.socket
+        Connected socket
+
+    Returns
+    -------
+    (string, string)
+    """
+    header = read_bytes(sock, FRAME_HEADER.size)
+    if header is None:
+        return None
+    frame_type, length = FRAME_HEADER.unpack(header)
+    payload = read_bytes(sock, length)
+    if payload is None:
+        return None
+    return frame_type, payload
+
+
+def send_frame(sock, frame_type, payload):
+    """Send a frame with the given type and payload.
+
+    Parameters
+    ----------
+    sock: socket.socket
+        Connected socket
+    frame_type: string
+        Frame type
+    payload: string
+        Frame payload
+    """
+    sock.sendall(FRAME_HEADER.pack(frame_type, len(payload)) + payload)
+
+
+# ------------------------------------------------------------------------------
+# Helper Methods
+# ------------------------------------------------------------------------------
+
+def read_bytes(sock, size):
+    """Read the given number of bytes from a socket. Returns None if the
+    connection is closed before all bytes are read.
+
+    Parameters
+    ----------
+    sock: socket.socket
+        Connected socket
+    size: int
+        Number of bytes
+
+    Returns
+    -------
+    string
+    """
+    chunks = []
+    while size > 0:
+        try:
+            chunk = sock.recv(min(size, 65536))
+        except socket.error as ex:
+            # Retry if reading was interrupted by a signal handler
+            if ex.errno == errno.EINTR:
+                continue
+            raise
+        if chunk == '':
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return ''.join(chunks)
@@ -0,0 +1,385 @@
+"""Everything related to the registry of clones.
+
+The base repository keeps a registry of all clones in the CLONES file. Each
+line contains the path of a clone relative to the base directory. Clones are
+registered when they are created. Clones that were created before the
+registry existed are registered by scanning the directory tree of the base
+repository once. Updates of the registry are serialized by a lock file since
+the registry is replaced when it is rebuilt.
+
+The status of the base repository and all clones is summarized from their
+SETTINGS and LOG files. Summaries are cached in the STATUS file of the base
+repository. The summary of a clone is only computed again if its files have
+changed. Since the log is append-only, only entries that were added since the
+summary was computed are read.
+"""
+
+import json
+from multiprocessing.pool import ThreadPool
+import os
+import time
+import uuid
+
+import exprepo as exp
+from exprepo.log import open_index, STATUS_FAILED
+from exprepo.settings import read_yaml_file, FileLock
+
+
+# ------------------------------------------------------------------------------
+# Constants
+# ------------------------------------------------------------------------------
+
+"""Default number of clones whose status is read concurrently."""
+DEFAULT_JOBS = 16
+
+
+# ------------------------------------------------------------------------------
+# API Methods
+# ------------------------------------------------------------------------------
+
+def get_clones():
+    """Get the paths of all registered clones relative to the base directory
+    in the order in which they were registered.
+
+    Returns
+    -------
+    list(string)
+    """
+    filename = get_clones_file()
+    if not os.path.isfile(filename):
+        return list()
+    result = list()
+    with open(filename, 'r') as f:
+        for line in f:
+            path = line.strip()
+            if path != '' and not path in result:
+                result.append(path)
+    return result
+
+
+def print_clones():
+    """Print the paths of all registered clones relative to the base
+    directory. Clones whose directory no longer contains a repository are
+    marked as missing.
+    """
+    base_dir = exp.get_base()
+    for path in get_clones():
+        if os.path.isdir(os.path.join(base_dir, path, exp.REPO_DIR)):
+            print path
+        else:
+            print path + '  missing'
+
+
+def print_status(all_clones=False, command=None, settings=False, jobs=DEFAULT_JOBS):
+    """Print a summary of the runs in the repository in the current working
+    directory. If the all flag is True, the summary is printed for the base
+    repository and all registered clones. Summaries are read concurrently
+    using a pool of at most jobs threads.
+
+    Raises ValueError if the number of jobs is invalid.
+
+    Parameters
+    ----------
+    all_clones: bool, optional
+        Print the status of the base repository and all registered clones
+    command: string, optional
+        Only print repositories that have run the given command
+    settings: bool, optional
+        Print the local settings of each repository
+    jobs: int, optional
+        Maximum number of repositories that are read concurrently
+    """
+    if jobs < 1:
+        raise ValueError('invalid number of jobs \'' + str(jobs) + '\'')
+    base_dir = exp.get_base()
+    if not all_clones:
+        path = os.path.relpath(os.getcwd(), os.path.abspath(base_dir))
+        summary = get_summary(os.path.join(base_dir, path))
+        print_summary(path, summary, command=command, settings=settings)
+        return
+    paths = ['.'] + [p for p in get_clones() if p != '.']
+    cache = read_status_cache()
+    def read_summary(path):
+        return get_summary(os.path.join(base_dir, path), cached=cache.get(path))
+    if len(paths) == 1:
+        summaries = [read_summary(path) for path in paths]
+    else:
+        pool = ThreadPool(min(jobs, len(paths)))
+        try:
+            summaries = pool.map(read_summary, paths)
+        finally:
+            pool.close()
+            pool.join()
+    updated = dict()
+    for path, summary in zip(paths, summaries):
+        if not summary is None:
+            updated[path] = summary
+        print_summary(path, summary, command=command, settings=settings)
+    if updated != cache:
+        write_status_cache(updated)
+
+
+def register_clone():
+    """Add the repository in the current working directory to the registry
+    of clones in the base repository.
+
+    Raises RuntimeError if the current directory is not a repository.
+    """
+    base_dir = exp.get_base()
+    path = os.path.relpath(os.getcwd(), os.path.abspath(base_dir))
+    filename = get_clones_file()
+    with FileLock(filename):
+        with open(filename, 'a') as f:
+            f.write(path + '\n')
+
+
+def scan_clones():
+    """Rebuild the registry of clones by searching the directory tree of the
+    base repository for clone repositories. Clones that no longer exist are
+    removed from the registry. Clones that are registered while the tree is
+    scanned are kept. Returns the number of registered clones.
+
+    Returns
+    -------
+    int
+    """
+    base_dir = exp.get_base()
+    paths = list()
+    for dir_name, sub_dirs, _ in os.walk(base_dir):
+        if exp.REPO_DIR in sub_dirs:
+            # Do not descend into repository directories
+            sub_dirs.remove(exp.REPO_DIR)
+            path = os.path.relpath(dir_name, base_dir)
+            if path != '.':
+                paths.append(path)
+        sub_dirs.sort()
+    filename = get_clones_file()
+    with FileLock(filename):
+        for path in get_clones():
+            repo_dir = os.path.join(base_dir, path, exp.REPO_DIR)
+            if not path in paths and os.path.isdir(repo_dir):
+                paths.append(path)
+        tmp_file = filename + '.' + uuid.uuid4().hex
+        with open(tmp_file, 'w') as f:
+            for path in paths:
+                f.write(path + '\n')
+        os.rename(tmp_file, filename)
+    return len(paths)
+
+
+# ------------------------------------------------------------------------------
+# Helper Methods
+# ------------------------------------------------------------------------------
+
+def flatten(settings, prefix=''):
+    """Get a dictionary of settings values keyed by their parameter path.
+
+    Parameters
+    ----------
+    settings: dict
+        Nested settings dictionary
+    prefix: string, optional
+        Path of the given dictionary
+
+    Returns
+    -------
+    dict
+    """
+    result = dict()
+    for key in settings:
+        value = settings[key]
+        if isinstance(value, dict):
+            result.update(flatten(value, prefix=prefix + key + '/'))
+        else:
+            result[prefix + key] = value
+    return result
+
+
+def get_clones_file():
+    """Get the path to the registry of clones in the base repository.
+
+    Returns
+    -------
+    string
+    """
+    return os.path.join(exp.get_base(), exp.REPO_DIR, exp.CLONES_FILE)
+
+
+def get_file_key(filename):
+    """Get the modification time and size of a file. Returns None if the file
+    does not exist.
+
+    Parameters
+    ----------
+    filename: string
+        Path to the file
+
+    Returns
+    -------
+    list
+    """
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return [stat.st_mtime, stat.st_size]
+
+
+def get_status_file():
+    """Get the path to the cache of repository summaries in the base
+    repository.
+
+    Returns
+    -------
+    string
+    """
+    return os.path.join(exp.get_base(), exp.REPO_DIR, exp.STATUS_CACHE_FILE)
+
+
+def get_summary(repo_dir, cached=None):
+    """Get the summary of settings and runs for the repository in the given
+    directory. Returns None if the directory does not contain a repository.
+    Parts of a cached summary are reused if the files have not changed.
+
+    Parameters
+    ----------
+    repo_dir: string
+        Repository directory
+    cached: dict, optional
+        Summary that was computed before
+
+    Returns
+    -------
+    dict
+    """
+    data_dir = os.path.join(repo_dir, exp.REPO_DIR)
+    if not os.path.isdir(data_dir):
+        return None
+    summary = dict()
+    # Local settings
+    settings_file = os.path.join(data_dir, exp.SETTINGS_FILE)
+    summary['settings_key'] = get_file_key(settings_file)
+    if not cached is None and cached['settings_key'] == summary['settings_key']:
+        summary['settings'] = cached['settings']
+    elif summary['settings_key'] is None:
+        summary['settings'] = dict()
+    else:
+        summary['settings'] = flatten(read_yaml_file(settings_file) or dict())
+    # Runs in the log
+    log_file = os.path.join(data_dir, exp.LOG_FILE)
+    summary['log_key'] = get_file_key(log_file)
+    if not cached is None and cached['log_key'] == summary['log_key']:
+        for key in ['entries', 'failed', 'commands', 'last']:
+            summary[key] = cached[key]
+        return summary
+    summary['entries'] = 0
+    summary['failed'] = 0
+    summary['commands'] = dict()
+    summary['last'] = None
+    if summary['log_key'] is None:
+        return summary
+    index = open_index(log_file)
+    try:
+        start = 0
+        if not cached is None and cached['entries'] <= len(index):
+            # Only read entries that were appended since the cached summary
+            # was computed
+            start = cached['entries']
+            for key in ['entries', 'failed', 'commands', 'last']:
+                summary[key] = cached[key]
+        with open(log_file, 'rb') as f:
+            for pos in range(start, len(index)):
+                offset = index.offset(pos)
+                if f.tell() != offset:
+                    f.seek(offset)
+                entry = json.loads(f.readline())
+                if entry['status'] == STATUS_FAILED:
+                    summary['failed'] += 1
+                name = entry['command']
+                summary['commands'][name] = summary['commands'].get(name, 0) + 1
+                summary['last'] = {
+                    'time': entry['time'],
+                    'command': name,
+                    'status': entry['status']
+                }
+        summary['entries'] = len(index)
+    finally:
+        index.close()
+    return summary
+
+
+def print_summary(path, summary, command=None, settings=False):
+    """Print a single line summary of a repository. The local settings of
+    the repository are printed below the summary if the settings flag is
+    True.
+
+    Parameters
+    ----------
+    path: string
+        Path to the repository relative to the base directory
+    summary: dict
+        Repository summary (see get_summary)
+    command: string, optional
+        Only print the summary if the repository has run the given command
+    settings: bool, optional
+        Print the local settings of the repository
+    """
+    if summary is None:
+        if command is None:
+            print path + '  missing'
+        return
+    if not command is None and not command in summary['commands']:
+        return
+    line = [
+        path,
+        str(summary['entries']) + ' runs',
+        str(summary['failed']) + ' failed'
+    ]
+    if not command is None:
+        line.append(str(summary['commands'][command]) + ' ' + command)
+    last = summary['last']
+    if not last is None:
+        line.append(
+            time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(last['time']))
+        )
+        line.append(last['command'])
+        line.append(last['status'])
+    print '  '.join(line)
+    if settings:
+        for key in sorted(summary['settings']):
+            print '    ' + key + '=' + str(summary['settings'][key])
+
+
+def read_status_cache():
+    """Read the cached repository summaries keyed by the repository path.
+    Returns an empty dictionary if the cache does not exist or cannot be
+    read.
+
+    Returns
+    -------
+    dict
+    """
+    filename = get_status_file()
+    if not os.path.isfile(filename):
+        return dict()
+    try:
+        with open(filename, 'r') as f:
+            return json.load(f)
+    except ValueError:
+        return dict()
+
+
+def write_status_cache(summaries):
+    """Write the repository summaries to the cache. The file is replaced
+    atomically.
+
+    Parameters
+    ----------
+    summaries: dict
+        Repository summaries keyed by the repository path
+    """
+    filename = get_status_file()
+    tmp_file = filename + '.' + uuid.uuid4().hex
+    with open(tmp_file, 'w') as f:
+        json.dump(summaries, f, separators=(',', ':'))
+    os.rename(tmp_file, filename)
@@ -2,9 +2,31 @@
 
 
 import exprepo as exp
+from exprepo.cache import get_cache_key, lookup, store
+from exprepo.events import emit, EVENT_FAILED, EVENT_FINISHED
+from exprepo.events import EVENT_QUEUED, EVENT_STARTED, EVENT_SWEEP
+from exprepo.execute import execute
+from exprepo.fingerprint import get_digests
+from exprepo.jobarray import write_array
+from exprepo.journal import SweepJournal
+from exprepo.journal import STATE_DONE, STATE_FAILED, STATE_RUNNING
+from exprepo.log import append_entries, get_run_dir, new_entry, new_run_id
+from exprepo.log import LogWriter
+from exprepo.log import SAMPLES_FILE, STDERR_FILE, STDOUT_FILE
+from exprepo.log import STATUS_FAILED, STATUS_SUBMITTED, STATUS_SUCCESS
+from exprepo.placement import CpuAllocator, get_thread_env
+from exprepo.results import sync_results
+from exprepo.runqueue import acquire, release
+from exprepo.spool import spool_jobs
+from exprepo.timing import phase, timed
+import itertools
+import json
+from multiprocessing.pool import ThreadPool
 import os
+import socket
+import time
 from settings import get_settings, get_global_variables
-import subprocess
+from settings import YamlDumper, YamlLoader
 import yaml
 
 
@@ -20,6 +42,25 @@ COMMAND_ELEMENT_CONST = 'const'
 COMMAND_ELEMENT_VAR = 'var'
 COMMAND_ELEMENT_TYPES = [COMMAND_ELEMENT_CONST, COMMAND_ELEMENT_VAR]
 
+"""Seconds before the first retry of a failed run and upper bound for the
+delay between retries."""
+RETRY_DELAY = 1.0
+RETRY_MAX_DELAY = 60.0
+
+"""Separators for argument values that define a parameter sweep. A list of
+values is separated by ',' and an inclusive integer range by '..'."""
+SWEEP_LIST_SEPARATOR = ','
+SWEEP_RANGE_SEPARATOR = '..'
+
+"""Delimiters for references to global variables in command components."""
+VARIABLE_PREFIX = '@('
+VARIABLE_SUFFIX = ')'
+
+"""In-memory copies of registry indexes keyed by the absolute path of the
+index file. Each value is a tuple of modification time, size and content of
+the index file."""
+INDEX_CACHE = dict()
+
 
 # ------------------------------------------------------------------------------
 # Classes
@@ -71,12 +112,100 @@ class VariableCmdElement(CmdElement):
         return '<<' + self.value + '>>'
 
 
+class CommandTemplate(object):
+    """Compiled render plan for a command specification. Parameter paths of
+    variable elements are split and references to global variables in
+    constant elements are located once when the template is created.
+    """
+    def __init__(self, spec):
+        """Compile the given command specification.
+
+        Raises ValueError if a constant element contains an invalid global
+        variable reference.
+
+        Parameters
+        ----------
+        spec: list(CmdElement)
+            Command specification
+        """
+        self.slots = []
+        for obj in spec:
+            if obj.is_var:
+                self.slots.append((obj.value, obj.value.split('/')))
+            else:
+                self.slots.append((None, parse_expression(obj.value)))
+
+    def render(self, config, variables):
+        """Create the list of command components from the given configuration
+        settings and global variables. Returns the command components together
+        with a dictionary of the values for all variable elements.
+
+        Raises ValueError if a referenced parameter or variable does not exist.
+
+        Parameters
+        ----------
+        config: exprepo.settings.Config
+            Configuration settings (including any per-run overrides)
+        variables: exprepo.settings.Config
+            Global variables
+
+        Returns
+        -------
+        list(string), dict
+        """
+        return self.render_many(config, variables, [dict()])[0]
+
+    @timed('expand')
+    def render_many(self, config, variables, overrides):
+        """Create the command components for each of the given sets of
+        parameter overrides. Constant elements and global variables are
+        resolved only once for all override sets.
+
+        Raises ValueError if a referenced parameter or variable does not exist.
+
+        Parameters
+        ----------
+        config: exprepo.settings.Config
+            Configuration settings
+        variables: exprepo.settings.Config
+            Global variables
+        overrides: list(dict)
+            Sets of parameter values that override the configuration settings
+
+        Returns
+        -------
+        list((list(string), dict))
+        """
+        cache = dict()
+        consts = [
+            expand_segments(segments, variables, cache) if para is None else None
+                for para, segments in self.slots
+        ]
+        result = []
+        for values in overrides:
+            run_config = config.overlay(values) if len(values) > 0 else config
+            cmd = list(consts)
+            params = dict()
+            for i in range(len(self.slots)):
+                para, path = self.slots[i]
+                if not para is None:
+                    val = run_config.get_path(path)
+                    params[para] = val
+                    cmd[i] = expand_variables(val, variables, cache)
+            result.append((cmd, params))
+        return result
+
+
 # ------------------------------------------------------------------------------
 # API Methods
 # ------------------------------------------------------------------------------
 
-def add_command(name, spec, replace=False):
+def add_command(name, spec, replace=False, inputs=None, outputs=None, resources=None):
     """Create or replace a script command in the experiment's command registry.
+    Commands may declare the files they read and write. These declarations
+    are used to build pipelines of commands. File names may contain
+    configuration parameters enclosed in << >> and global variables. Commands
+    may also declare the resources they need when run via the run queue.
 
     Raises ValueError if (create) a command with the given name already exists,
     or (replace) no command with the given name exists.
@@ -91,6 +220,13 @@ def add_command(name, spec, replace=False):
     replace: bool, optional
         Flag indicating whether a new command is added to the registry or an
         existing one is replaced.
+    inputs: list(string), optional
+        Names of files that are read by the command
+    outputs: list(string), optional
+        Names of files that are written by the command
+    resources: dict, optional
+        Number of CPUs ('cpus') and memory in bytes ('memory') that are
+        needed by the command
     """
     # Get file for the new command. Raise an expeption if (1) the file already
     # exists and the replace flag is set to False, or (2) the file does not
@@ -110,11 +246,225 @@ def add_command(name, spec, replace=False):
             cmd.append(VariableCmdElement(token[2:-2]).to_dict())
         else:
             cmd.append(ConstantCmdElement(token).to_dict())
-    # Write command specification to file (currently in Yaml format)
+    # Write command specification to file (currently in Yaml format). The
+    # specification is a list of elements unless files or resources are
+    # declared.
+    obj = {
+        'spec': cmd,
+        'inputs': inputs if not inputs is None else list(),
+        'outputs': outputs if not outputs is None else list(),
+        'resources': resources if not resources is None else dict()
+    }
     with open(filename, 'w') as f:
-        yaml.dump(cmd, f, default_flow_style=False)
+        if len(obj['inputs']) + len(obj['outputs']) + len(obj['resources']) == 0:
+            doc = cmd
+        else:
+            doc = {
+                'command': cmd,
+                'inputs': obj['inputs'],
+                'outputs': obj['outputs'],
+                'resources': obj['resources']
+            }
+        yaml.dump(doc, f, Dumper=YamlDumper, default_flow_style=False)
+    # Keep the registry index in sync to avoid re-parsing the new file
+    reg_dir = get_commands_dir()
+    index = read_command_index(reg_dir)
+    index[name.lower()] = get_index_entry(filename, obj)
+    write_command_index(reg_dir, index)
 
 
+@timed('expand')
+def expand_arguments(args):
+    """Expand a list of command arguments into the list of argument
+    dictionaries for all points of a parameter sweep. Each argument is of
+    format <key>=<value>. The value may be a list of values separated by ','
+    (e.g., lr=0.1,0.01) or an inclusive integer range (e.g., seed=1..10). The
+    result is the cross-product of all argument values. Without list or range
+    values the result contains a single dictionary.
+
+    Raises ValueError if an argument is of invalid format.
+
+    Parameters
+    ----------
+    args: list(string)
+        Arguments that override the current configuration settings
+
+    Returns
+    -------
+    list(dict)
+    """
+    keys = []
+    values = []
+    for arg in args:
+        pos = arg.find('=')
+        if pos < 0:
+            raise ValueError('invalid argument \'' + arg + '\'')
+        keys.append(arg[:pos])
+        values.append(expand_value(arg[pos+1:]))
+    return [dict(zip(keys, point)) for point in itertools.product(*values)]
+
+
+def expand_value(value):
+    """Expand an argument value into the list of values it represents. A
+    list element of format <low>..<high> is an integer range only if both
+    bounds are integers. Any other element is kept as a literal value (e.g.,
+    a relative path like ../data).
+
+    Raises ValueError if the lower bound of a range is greater than its
+    upper bound.
+
+    Parameters
+    ----------
+    value: string
+        Argument value
+
+    Returns
+    -------
+    list(string)
+    """
+    result = []
+    for val in value.split(SWEEP_LIST_SEPARATOR):
+        bounds = val.split(SWEEP_RANGE_SEPARATOR)
+        if len(bounds) == 2:
+            try:
+                low, high = int(bounds[0]), int(bounds[1])
+            except ValueError:
+                result.append(val)
+            else:
+                if low > high:
+                    raise ValueError('invalid range \'' + val + '\'')
+                result.extend([str(i) for i in range(low, high + 1)])
+        else:
+            result.append(val)
+    return result
+
+
+def expand_segments(segments, variables, cache):
+    """Concatenate the segments of a parsed expression. References to global
+    variables are replaced by their (expanded) value. Values of variables are
+    kept in the given cache.
+
+    Raises ValueError if a referenced variable does not exist.
+
+    Parameters
+    ----------
+    segments: list((bool, string))
+        Parsed expression (see parse_expression)
+    variables: exprepo.settings.Config
+        Global variables
+    cache: dict
+        Expanded values of global variables
+
+    Returns
+    -------
+    string
+    """
+    if len(segments) == 1 and not segments[0][0]:
+        return segments[0][1]
+    result = []
+    for is_var, text in segments:
+        if is_var:
+            if not text in cache:
+                cache[text] = expand_variables(
+                    variables.get_value(text),
+                    variables,
+                    cache
+                )
+            result.append(cache[text])
+        else:
+            result.append(text)
+    return ''.join(result)
+
+
+def expand_variables(value, variables, cache=None):
+    """Replace all references to global variables in the given value by the
+    variable values. Variable values that contain references themselves are
+    expanded as well.
+
+    Raises ValueError if the value contains an invalid expression or if a
+    referenced variable does not exist.
+
+    Parameters
+    ----------
+    value: string
+        Expression containing references of format @(<name>)
+    variables: exprepo.settings.Config
+        Global variables
+    cache: dict, optional
+        Expanded values of global variables
+
+    Returns
+    -------
+    string
+    """
+    if not VARIABLE_PREFIX in value:
+        return value
+    if cache is None:
+        cache = dict()
+    return expand_segments(parse_expression(value), variables, cache)
+
+
+@timed('registry')
+def get_command(name):
+    """Get the specification of the registered command with the given name.
+    The specification is taken from the registry index unless the command file
+    has been modified since the index was written. Only the specification of
+    the requested command is read.
+
+    Raises ValueError if no command with the given name is found.
+
+    Parameters
+    ----------
+    name: string
+        Command name
+
+    Returns
+    -------
+    list(CmdElement)
+    """
+    entry = get_registry_entry(name)
+    return [CmdElement.from_dict(obj) for obj in entry['spec']]
+
+
+def get_command_files(name):
+    """Get the names of the input and output files that are declared for the
+    registered command with the given name.
+
+    Raises ValueError if no command with the given name is found.
+
+    Parameters
+    ----------
+    name: string
+        Command name
+
+    Returns
+    -------
+    list(string), list(string)
+    """
+    entry = get_registry_entry(name)
+    return entry.get('inputs', list()), entry.get('outputs', list())
+
+
+def get_command_resources(name):
+    """Get the resources that are declared for the registered command with the
+    given name. The result contains the number of CPUs ('cpus') and memory in
+    bytes ('memory') if declared.
+
+    Raises ValueError if no command with the given name is found.
+
+    Parameters
+    ----------
+    name: string
+        Command name
+
+    Returns
+    -------
+    dict
+    """
+    return dict(get_registry_entry(name).get('resources', dict()))
+
+
+@timed('registry')
 def get_commands():
     """Get a dictionary containing the command specifications for the commands
     that are currently registered. The dictionary key is the command name.
@@ -123,17 +473,12 @@ def get_commands():
     -------
     dict
     """
-    # Collect command specifications in a dictionary
+    entries = get_registry_entries()
     commands = dict()
-    reg_dir = get_commands_dir()
-    for f_name in os.listdir(reg_dir):
-        if f_name.endswith(COMMAND_SPEC_SUFFIX):
-            # Read command specification and add to list of commands
-            cmd_name = f_name[:-len(COMMAND_SPEC_SUFFIX)].lower()
-            with open(os.path.join(reg_dir, f_name), 'r') as f:
-                commands[cmd_name] = [
-                    CmdElement.from_dict(obj) for obj in yaml.load(f.read())
-                ]
+    for cmd_name in entries:
+        commands[cmd_name] = [
+            CmdElement.from_dict(obj) for obj in entries[cmd_name]['spec']
+        ]
     return commands
 
 
@@ -153,42 +498,496 @@ def get_commands_dir():
     return command_dir
 
 
-def get_log_file():
-    """Get name of the repository file that stores the command execution log.
+def get_index_entry(filename, obj):
+    """Get the registry index entry for a command specification that has been
+    read from the given file.
+
+    Parameters
+    ----------
+    filename: string
+        Path to the command specification file
+    obj: dict
+        Serialized command specification and declared files (see
+        read_command_file)
 
     Returns
     -------
-    string
+    dict
     """
-    return os.path.join(exp.REPO_DIR, exp.LOG_FILE)
+    stat = os.stat(filename)
+    entry = dict(obj)
+    entry['mtime'] = stat.st_mtime
+    entry['size'] = stat.st_size
+    return entry
 
 
-def list_commands():
-    """List the names and specifications of all scripts that are currently
-    registerd.
+def get_input_digests(spec_inputs, overrides, points, config, variables, inputs=None):
+    """Get the content digests of the input files of resolved points of a
+    parameter sweep. Returns a dictionary that maps the tuple of command line
+    components of each point to a dictionary of digests keyed by the
+    absolute path of the input file (see exprepo.fingerprint.get_digests).
+    Returns None if no input files are declared or given.
+
+    Raises ValueError if a referenced parameter or variable does not exist.
+
+    Parameters
+    ----------
+    spec_inputs: list(string)
+        Input file expressions that are declared for the command
+    overrides: list(dict)
+        Parameter overrides for each point
+    points: list((list(string), dict))
+        Command line components and parameter values for each point
+    config: exprepo.settings.Config
+        Configuration settings
+    variables: exprepo.settings.Config
+        Global variables
+    inputs: list(string), optional
+        Paths to additional input files
+
+    Returns
+    -------
+    dict
+    """
+    if len(spec_inputs) == 0 and (inputs is None or len(inputs) == 0):
+        return None
+    files = list()
+    for pos in range(len(points)):
+        point_files = [os.path.abspath(f) for f in inputs] if not inputs is None else list()
+        point_files.extend(
+            resolve_files(spec_inputs, config.overlay(overrides[pos]), variables)
+        )
+        files.append(point_files)
+    # Digests of files that are shared by points are computed once
+    digests = get_digests([f for point_files in files for f in point_files])
+    result = dict()
+    for pos in range(len(points)):
+        cmd, _ = points[pos]
+        result[tuple(cmd)] = dict([(f, digests[f]) for f in files[pos]])
+    return result
+
+
+def get_registry_entries():
+    """Get the registry index entries for all registered commands. Only
+    command files that were added or modified since the index was written are
+    parsed. The index is rewritten if it is not current.
+
+    Returns
+    -------
+    dict
+    """
+    reg_dir = get_commands_dir()
+    index = read_command_index(reg_dir)
+    # Collect index entries for all command files in the registry directory
+    entries = dict()
+    modified = False
+    for f_name in os.listdir(reg_dir):
+        if f_name.endswith(COMMAND_SPEC_SUFFIX):
+            cmd_name = f_name[:-len(COMMAND_SPEC_SUFFIX)].lower()
+            filename = os.path.join(reg_dir, f_name)
+            entry = index.get(cmd_name)
+            if not is_current_entry(entry, os.stat(filename)):
+                # Read command specification for new or modified files
+                entry = get_index_entry(filename, read_command_file(filename))
+                modified = True
+            entries[cmd_name] = entry
+    # Rewrite the index if files were modified, added, or deleted
+    if modified or len(entries) != len(index):
+        write_command_index(reg_dir, entries)
+    return entries
+
+
+def get_registry_entry(name):
+    """Get the registry index entry for the command with the given name. The
+    command file is only parsed if it has been modified since the index was
+    written.
+
+    Raises ValueError if no command with the given name is found.
+
+    Parameters
+    ----------
+    name: string
+        Command name
+
+    Returns
+    -------
+    dict
+    """
+    reg_dir = get_commands_dir()
+    cmd_name = name.lower()
+    filename = os.path.join(reg_dir, cmd_name + COMMAND_SPEC_SUFFIX)
+    if not os.path.isfile(filename):
+        raise ValueError('unknown command \'' + name + '\'')
+    index = read_command_index(reg_dir)
+    entry = index.get(cmd_name)
+    if not is_current_entry(entry, os.stat(filename)):
+        entry = get_index_entry(filename, read_command_file(filename))
+        index[cmd_name] = entry
+        write_command_index(reg_dir, index)
+    return entry
+
+
+def get_placement(name, policy=None, threads=None, queue=None):
+    """Get the placement options for runs of the given command. The number
+    of cores for each pinned run is the number of CPUs that is declared for
+    the command, overridden by the queue options. Returns None if neither a
+    placement policy nor a number of threads is given.
+
+    Raises ValueError if no command with the given name is found.
+
+    Parameters
+    ----------
+    name: string
+        Command name
+    policy: string, optional
+        Placement policy (see exprepo.placement)
+    threads: int, optional
+        Number of threads of numerical libraries in each run
+    queue: dict, optional
+        Queue options that may override the number of CPUs ('cpus')
+
+    Returns
+    -------
+    dict
+    """
+    if policy is None and threads is None:
+        return None
+    placement = {'policy': policy, 'cpus': 1, 'threads': threads}
+    resources = get_command_resources(name)
+    if 'cpus' in resources:
+        placement['cpus'] = resources['cpus']
+    if not queue is None and 'cpus' in queue:
+        placement['cpus'] = queue['cpus']
+    return placement
+
+
+def get_request(name, queue):
+    """Get the resource request for runs of the given command in the run
+    queue. The request contains the resources that are declared for the
+    command, overridden by the given queue options. Returns None if no queue
+    options are given.
+
+    Raises ValueError if no command with the given name is found.
+
+    Parameters
+    ----------
+    name: string
+        Command name
+    queue: dict
+        Number of CPUs ('cpus'), memory in bytes ('memory') and priority
+        ('priority') for admission by the run queue
+
+    Returns
+    -------
+    dict
+    """
+    if queue is None:
+        return None
+    request = {'cpus': 1, 'memory': 0, 'priority': 0}
+    request.update(get_command_resources(name))
+    request.update(queue)
+    return request
+
+
+def is_current_entry(entry, stat):
+    """Test whether a registry index entry is current for a command file with
+    the given stat result.
+
+    Parameters
+    ----------
+    entry: dict
+        Registry index entry or None
+    stat: posix.stat_result
+        Result of os.stat for the command file
+
+    Returns
+    -------
+    bool
     """
-    commands = get_commands()
+    if entry is None:
+        return False
+    return entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size
+
+
+def list_commands():
+    """List the names of all scripts that are currently registerd."""
+    names = [
+        f_name[:-len(COMMAND_SPEC_SUFFIX)].lower()
+            for f_name in os.listdir(get_commands_dir())
+                if f_name.endswith(COMMAND_SPEC_SUFFIX)
+    ]
     # Print commands sorted by their name
-    for cmd_name in sorted(commands.keys()):
+    for cmd_name in sorted(names):
         print cmd_name
 
 
-def print_log():
-    """Print the log of experiment commands to standard output."""
-    filename = get_log_file()
-    # The file may not exist if no command has been executed yet
+def log_results(name, results, cache_keys=None, writer=None):
+    """Add the results of runs of the given command to the log. Expects an
+    iterator over tuples of the resolved parameter values and the run result
+    (see run_process). Results are logged in the order in which the iterator
+    returns them. If cache keys are given, successful runs are added to the
+    cache of successful runs. Returns the list of log entries.
+
+    Parameters
+    ----------
+    name: string
+        Name of the command
+    results: iterator((dict, dict))
+        Parameter values and run results
+    cache_keys: dict, optional
+        Cache keys for runs keyed by the tuple of command line components
+    writer: exprepo.log.LogWriter, optional
+        Writer that is shared by concurrent runs. Entries are appended to the
+        log directly by default.
+
+    Returns
+    -------
+    list(dict)
+    """
+    entries = []
+    for params, result in results:
+        if result['exit_code'] == 0:
+            status = STATUS_SUCCESS
+        else:
+            status = STATUS_FAILED
+        entry = new_entry(
+            name,
+            result['args'],
+            params=params,
+            status=status,
+            exit_code=result['exit_code'],
+            duration=result['duration'],
+            run_id=result.get('id')
+        )
+        for key in ['inputs', 'usage', 'samples', 'output', 'timed_out', 'attempts', 'sweep', 'worker', 'metrics', 'stopped', 'placement']:
+            if key in result:
+                entry[key] = result[key]
+        if 'queue_wait' in result:
+            entry['queue_wait'] = result['queue_wait']
+            entry['resources'] = result['resources']
+        if not writer is None:
+            writer.append([entry])
+        else:
+            append_entries([entry])
+        if not cache_keys is None and status == STATUS_SUCCESS:
+            store(cache_keys[tuple(result['args'])], entry)
+        entries.append(entry)
+    return entries
+
+
+def lookup_cache(points, digests=None):
+    """Get the cache keys for resolved points of a parameter sweep and the
+    cached log entries of points that have been run successfully before.
+    Returns a dictionary of cache keys for points that have not been run
+    keyed by the tuple of command line components, and a dictionary of log
+    entries keyed by the position of cached points.
+
+    Raises ValueError if an input file does not exist.
+
+    Parameters
+    ----------
+    points: list((list(string), dict))
+        Command line components and parameter values for each point
+    digests: dict, optional
+        Content digests of the input files of each point keyed by the tuple
+        of command line components (see get_input_digests)
+
+    Returns
+    -------
+    dict, dict
+    """
+    cache_keys = dict()
+    cached = dict()
+    for pos in range(len(points)):
+        cmd, _ = points[pos]
+        key = get_cache_key(
+            cmd,
+            digests=digests.get(tuple(cmd)) if not digests is None else None
+        )
+        entry = lookup(key)
+        if entry is None:
+            cache_keys[tuple(cmd)] = key
+        else:
+            cached[pos] = entry
+    return cache_keys, cached
+
+
+def parse_expression(value):
+    """Split a value into a list of segments. Each segment is a tuple of a flag
+    indicating whether the segment is a reference to a global variable and the
+    segment text (or variable name).
+
+    Raises ValueError if a variable reference is not terminated.
+
+    Parameters
+    ----------
+    value: string
+        Expression containing references of format @(<name>)
+
+    Returns
+    -------
+    list((bool, string))
+    """
+    segments = []
+    start = 0
+    pos = value.find(VARIABLE_PREFIX)
+    while pos >= 0:
+        end_pos = value.find(VARIABLE_SUFFIX, pos)
+        if end_pos < 0:
+            raise ValueError('invalid expression \'' + value + '\'')
+        if pos > start:
+            segments.append((False, value[start:pos]))
+        name = value[pos + len(VARIABLE_PREFIX):end_pos].strip()
+        segments.append((True, name))
+        start = end_pos + len(VARIABLE_SUFFIX)
+        pos = value.find(VARIABLE_PREFIX, start)
+    if start < len(value) or len(segments) == 0:
+        segments.append((False, value[start:]))
+    return segments
+
+
+def read_command_file(filename):
+    """Read a serialized command specification from file. Returns a dictionary
+    containing the list of serialized command elements ('spec'), the lists
+    of declared input and output files, and the declared resources. The file
+    either contains the list of command elements or a dictionary with the
+    command elements ('command') and the declarations.
+
+    Parameters
+    ----------
+    filename: string
+        Path to the command specification file
+
+    Returns
+    -------
+    dict
+    """
+    with open(filename, 'r') as f:
+        doc = yaml.load(f.read(), Loader=YamlLoader)
+    if isinstance(doc, dict):
+        return {
+            'spec': doc['command'],
+            'inputs': doc.get('inputs', list()),
+            'outputs': doc.get('outputs', list()),
+            'resources': doc.get('resources', dict())
+        }
+    else:
+        return {
+            'spec': doc,
+            'inputs': list(),
+            'outputs': list(),
+            'resources': dict()
+        }
+
+
+def read_command_index(reg_dir):
+    """Read the registry index from the given registry directory. Returns an
+    empty dictionary if the index does not exist or cannot be read. The index
+    is only read from file if the file has changed since it was last read by
+    this process.
+
+    Parameters
+    ----------
+    reg_dir: string
+        Path to the command registry directory
+
+    Returns
+    -------
+    dict
+    """
+    filename = os.path.abspath(os.path.join(reg_dir, exp.COMMAND_INDEX_FILE))
     if os.path.isfile(filename):
-        with open(filename, 'r') as f:
-            for line in f:
-                print line.strip()
+        stat = os.stat(filename)
+        cached = INDEX_CACHE.get(filename)
+        if not cached is None and cached[:2] == (stat.st_mtime, stat.st_size):
+            return cached[2]
+        try:
+            with open(filename, 'r') as f:
+                index = json.load(f)
+            INDEX_CACHE[filename] = (stat.st_mtime, stat.st_size, index)
+            return index
+        except ValueError:
+            # The index is rebuilt if it is corrupted
+            pass
+    return dict()
+
+
+def resolve_files(files, config, variables):
+    """Resolve the names of declared input or output files. Configuration
+    parameters enclosed in << >> are replaced by their value and references
+    to global variables are expanded. Returns absolute paths.
+
+    Raises ValueError if a referenced parameter or variable does not exist.
+
+    Parameters
+    ----------
+    files: list(string)
+        File name expressions
+    config: exprepo.settings.Config
+        Configuration settings (including any per-run overrides)
+    variables: exprepo.settings.Config
+        Global variables
 
+    Returns
+    -------
+    list(string)
+    """
+    result = []
+    for expr in files:
+        val = ''
+        pos = expr.find('<<')
+        while pos >= 0:
+            end_pos = expr.find('>>', pos)
+            if end_pos < 0:
+                raise ValueError('invalid expression \'' + expr + '\'')
+            val += expr[:pos] + config.get_value(expr[pos+2:end_pos])
+            expr = expr[end_pos+2:]
+            pos = expr.find('<<')
+        val = expand_variables(val + expr, variables)
+        result.append(os.path.abspath(val))
+    return result
 
-def run_command(prg_name, name, args, run_local=True):
+
+def run_command(prg_name, name, args, run_local=True, jobs=1, scheduler=None, spool=False, use_cache=False, inputs=None, queue=None, sample=None, capture=None, timeout=None, retries=0, resume=False, placement=None, threads=None):
     """Run the experiment script with the given name. Constructs the command
     to run the script from the current configuration settings and optional
     arguments that overwrite these settings. The script is only execute if the
     run local flag is True.
 
+    Argument values may define a parameter sweep (see expand_arguments). The
+    resulting commands are run concurrently using a pool of at most jobs
+    workers. Each run is added to the log as soon as it completes. Submitted
+    commands are either printed, written as a job array, or written to the
+    spool.
+
+    The content digests of the given input files and of the input files that
+    are declared for the command are recorded in the log entry of each run.
+    If the use cache flag is True, commands that have been run successfully
+    before are skipped. The cache key for a command includes the digests of
+    its input files.
+
+    If queue options are given, each run waits for admission by the local run
+    queue. The resources that are requested for a run are those declared for
+    the command, overridden by the queue options.
+
+    If a placement policy is given, concurrent runs are pinned to CPU sets
+    (see exprepo.placement). Pinned runs get as many cores as they request
+    CPUs. If a number of threads is given, the thread count of numerical
+    libraries is set for every run. The placement is recorded in the log.
+
+    The resource usage of every run is added to the log. If a sample interval
+    is given, the resource usage is also sampled while commands are running.
+    If capture options are given, the output of each run is captured in the
+    run directory instead of being written to the terminal. The last object
+    that a captured run reported on standard output (its metrics) is then
+    added to the log as well.
+
+    The state of each point of a sweep with more than one point is recorded
+    in a journal (for single runs only if the resume flag is True). If the
+    resume flag is True, points that are done according to the journal of an
+    earlier run of the same sweep are skipped. Runs that exceed the timeout
+    are terminated and failed runs are repeated up to retries times.
+
     Raises ValueError if the specified command is unknown or if the provided
     arguments are of invalid format.
 
@@ -202,54 +1001,380 @@ def run_command(prg_name, name, args, run_local=True):
     run_local: bool, optional
         Flag indicating whether to actuall execute the script or only print
         and log the command line command for submission on a remote machine.
+    jobs: int, optional
+        Maximum number of commands that are run concurrently
+    scheduler: string, optional
+        Name of the batch scheduler. If given, submitted commands are written
+        as a job array for the scheduler.
+    spool: bool, optional
+        Flag indicating whether submitted commands are written to the spool
+    use_cache: bool, optional
+        Flag indicating whether to skip commands that have been run
+        successfully before.
+    inputs: list(string), optional
+        Paths to additional input files of the command
+    queue: dict, optional
+        Number of CPUs ('cpus'), memory in bytes ('memory') and priority
+        ('priority') for admission by the run queue
+    sample: float, optional
+        Seconds between samples of the resource usage of a run
+    capture: dict, optional
+        Maximum number of bytes ('limit') and number of bytes at the end
+        ('tail') that are stored for each output of a run (see run_process)
+    timeout: float, optional
+        Maximum run time of a command in seconds
+    retries: int, optional
+        Number of times a failed command is run again
+    resume: bool, optional
+        Skip points that are done according to the journal of the sweep
+    placement: string, optional
+        Placement policy for runs (pin, numa, or node:<n>)
+    threads: int, optional
+        Number of threads of numerical libraries in each run
     """
-    commands = get_commands()
-    if not name in commands:
-        raise ValueError('unknown command \'' + name + '\'')
-    # Get a dictionary of arguments that override the configuration settings
-    local_args = dict()
-    for arg in args:
-        pos = arg.find('=')
-        if pos < 0:
-            raise ValueError('invalid argument \'' + arg + '\'')
-        local_args[arg[:pos]] = arg[pos+1:]
+    spec = get_command(name)
+    spec_inputs, _ = get_command_files(name)
     # Read the current experiment configuration settings and global variables
+    # once for all points of the sweep
     config = get_settings()
     variables = get_global_variables()
-    # Create the list of command components
-    cmd = []
-    for obj in commands[name]:
-        val = None
-        if obj.is_var:
-            if obj.value in local_args:
-                val = local_args[obj.value]
-            else:
-                val = config.get_value(obj.value)
-        else:
-            val = obj.value
-        # Replace occurrences of variable names in val
-        if '@(' in val:
-            pos = val.find('@(')
-            while pos >= 0:
-                end_pos = val.find(')', pos)
-                if end_pos < 0:
-                    raise ValueError('invalid expression \'' + val + '\'')
-                var_value = variables.get_value(val[pos+2:end_pos].strip())
-                val = val[:pos] + var_value + val[end_pos + 1:]
-                pos = val.find('@(')
-        cmd.append(val)
-    # Run the command if run local flag is True
+    template = CommandTemplate(spec)
+    overrides = expand_arguments(args)
+    points = template.render_many(config, variables, overrides)
+    # Run the commands if run local flag is True
     if run_local:
-        print prg_name + ' (RUN): ' + ' '.join(cmd)
-        result = subprocess.call(cmd)
-        # Add command to log if successfule (i.e., result is 0)
-        if result == 0:
-            with open(get_log_file(), 'a') as f:
-                f.write(' '.join(cmd) + '\n')
+        journal = None
+        done = set()
+        if len(points) > 1 or resume:
+            journal = SweepJournal(name, points)
+            done = journal.open(resume=resume)
+        digests = get_input_digests(
+            spec_inputs,
+            overrides,
+            points,
+            config,
+            variables,
+            inputs=inputs
+        )
+        cache_keys = None
+        if use_cache:
+            # Skip commands for which the cache contains a successful run
+            cache_keys, cached = lookup_cache(points, digests=digests)
+            for pos in sorted(cached):
+                cmd, _ = points[pos]
+                print prg_name + ' (CACHED): ' + ' '.join(cmd) + ' [' + cached[pos]['id'] + ']'
+                if not journal is None:
+                    journal.update(cmd, STATE_DONE, run_id=cached[pos]['id'])
+            points = [points[i] for i in range(len(points)) if not i in cached]
+        if len(done) > 0:
+            print prg_name + ' (RESUME): ' + str(len(done)) + ' runs done in sweep ' + journal.sweep_id
+            points = [p for p in points if not tuple(p[0]) in done]
+        try:
+            run_points(
+                prg_name,
+                name,
+                points,
+                jobs=jobs,
+                cache_keys=cache_keys,
+                digests=digests,
+                request=get_request(name, queue),
+                sample=sample,
+                capture=capture,
+                timeout=timeout,
+                retries=retries,
+                placement=get_placement(
+                    name,
+                    policy=placement,
+                    threads=threads,
+                    queue=queue
+                ),
+                journal=journal
+            )
+        finally:
+            if not journal is None:
+                journal.close()
+        # Add the runs to the results store
+        sync_results()
     else:
-        print prg_name + ' (SUBMIT): ' + ' '.join(cmd)
-        with open(get_log_file(), 'a') as f:
-            f.write('*' + ' '.join(cmd) + '\n')
+        submit_points(prg_name, name, points, scheduler=scheduler, spool=spool)
+
+
+def run_points(prg_name, name, points, jobs=1, cache_keys=None, digests=None, request=None, sample=None, capture=None, timeout=None, retries=0, metrics=None, placement=None, journal=None, verbose=True):
+    """Run the commands for resolved points of a parameter sweep using a pool
+    of at most jobs workers. Each run is added to the log as soon as it
+    completes. Runs that complete concurrently are written to the log in a
+    single batch. Returns the log entries in the order of the given points.
+
+    If a journal is given, the state of each point is recorded in the
+    journal.
+
+    Raises ValueError if the number of jobs, the sample interval, the capture
+    sizes, the timeout, the number of retries or the placement options are
+    invalid.
+
+    Parameters
+    ----------
+    prg_name: string
+        Name with which the program was called
+    name: string
+        Name of the command
+    points: list((list(string), dict))
+        Command line components and parameter values for each point
+    jobs: int, optional
+        Maximum number of commands that are run concurrently
+    cache_keys: dict, optional
+        Cache keys for runs keyed by the tuple of command line components.
+        Successful runs are added to the cache if given.
+    digests: dict, optional
+        Content digests of the input files of runs keyed by the tuple of
+        command line components. Digests are added to the log entries.
+    request: dict, optional
+        Resource request for admission by the run queue (see get_request)
+    sample: float, optional
+        Seconds between samples of the resource usage of a run
+    capture: dict, optional
+        Maximum number of bytes ('limit') and number of bytes at the end
+        ('tail') that are stored for each output of a run (see run_process)
+    timeout: float, optional
+        Maximum run time of a command in seconds
+    retries: int, optional
+        Number of times a failed command is run again
+    metrics: func, optional
+        Function that is called with the run identifier and every object
+        that is reported by a run (see run_process)
+    placement: dict, optional
+        Placement policy ('policy'), number of physical cores for each
+        pinned run ('cpus') and number of threads ('threads') (see get_placement)
+    journal: exprepo.journal.SweepJournal, optional
+        Journal of the sweep
+    verbose: bool, optional
+        Print each command before it is run
+
+    Returns
+    -------
+    list(dict)
+    """
+    if jobs < 1:
+        raise ValueError('invalid number of jobs \'' + str(jobs) + '\'')
+    if not sample is None and sample <= 0:
+        raise ValueError('invalid sample interval \'' + str(sample) + '\'')
+    if not capture is None:
+        limit, tail = capture.get('limit'), capture.get('tail', 0)
+        if not limit is None and limit < 0:
+            raise ValueError('invalid capture limit \'' + str(limit) + '\'')
+        if tail < 0 or (not limit is None and tail > limit):
+            raise ValueError('invalid capture tail \'' + str(tail) + '\'')
+    if not timeout is None and timeout <= 0:
+        raise ValueError('invalid timeout \'' + str(timeout) + '\'')
+    if retries < 0:
+        raise ValueError('invalid number of retries \'' + str(retries) + '\'')
+    allocator = None
+    if not placement is None:
+        allocator = CpuAllocator(
+            policy=placement.get('policy'),
+            cpus=placement.get('cpus', 1),
+            threads=placement.get('threads')
+        )
+    if len(points) == 0:
+        return list()
+    # Run identifiers are assigned up front to return entries in order
+    run_ids = [new_run_id() for point in points]
+    sweep_id = journal.sweep_id if not journal is None else new_run_id()
+    emit(EVENT_SWEEP, sweep=sweep_id, command=name, total=len(points))
+    for pos in range(len(points)):
+        emit(EVENT_QUEUED, run_id=run_ids[pos], sweep=sweep_id, args=points[pos][0])
+    # Runs are logged by the worker that ran them. Concurrent workers share a
+    # writer that commits their entries in batches.
+    writer = LogWriter() if jobs > 1 and len(points) > 1 else None
+    def run_point(pos):
+        cmd, _ = points[pos]
+        if not journal is None:
+            journal.update(cmd, STATE_RUNNING, run_id=run_ids[pos])
+        params, result = run_process(
+            prg_name,
+            points[pos],
+            request=request,
+            sample=sample,
+            capture=capture,
+            timeout=timeout,
+            retries=retries,
+            metrics=metrics,
+            allocator=allocator,
+            run_id=run_ids[pos],
+            verbose=verbose
+        )
+        if not journal is None:
+            result['sweep'] = journal.sweep_id
+        if not digests is None:
+            result['inputs'] = digests[tuple(cmd)]
+        entry = log_results(
+            name,
+            [(params, result)],
+            cache_keys=cache_keys,
+            writer=writer
+        )[0]
+        if not journal is None:
+            if entry['status'] == STATUS_SUCCESS:
+                journal.update(cmd, STATE_DONE, run_id=entry['id'])
+            else:
+                journal.update(cmd, STATE_FAILED, run_id=entry['id'])
+        return entry
+    if writer is None:
+        return [run_point(pos) for pos in range(len(points))]
+    pool = ThreadPool(min(jobs, len(points)))
+    try:
+        return pool.map(run_point, range(len(points)))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def run_process(prg_name, point, request=None, sample=None, capture=None, timeout=None, retries=0, metrics=None, allocator=None, run_id=None, verbose=True):
+    """Run the command line command for a resolved point of a parameter sweep.
+    Returns a tuple of the parameter values of the point and the run result.
+    The result is a dictionary containing the unique run identifier, the
+    command line components, the exit code, the run time in seconds and the
+    resource usage (see exprepo.execute.execute). If a resource request is
+    given, the command is run after it has been admitted by the run queue.
+    The result then also contains the time spent waiting in the queue and
+    the requested resources. If a sample interval is given, resource usage
+    samples are written to the run directory. If capture options are given,
+    standard output and standard error are written to compressed files in the
+    run directory.
+
+    A command that exceeds the timeout is terminated. A failed command is run
+    again up to retries times. The delay before each retry doubles, starting
+    at RETRY_DELAY seconds. The result of the last attempt is returned and
+    contains the number of attempts.
+
+    If the output is captured or a metrics function is given, objects that
+    the command reports on standard output (one JSON object per line) are
+    recorded in the result. Otherwise standard output is inherited by the
+    command. The metrics function is called with the run identifier and
+    every reported object. The command is stopped if the function returns
+    True. Stopped commands are not retried.
+
+    If a CPU allocator is given, the command is pinned to the CPUs that are
+    allocated for it and the thread count of numerical libraries is set.
+    The result then contains the placement of the last attempt.
+
+    Parameters
+    ----------
+    prg_name: string
+        Name with which the program was called
+    point: (list(string), dict)
+        Command line components and parameter values
+    request: dict, optional
+        Number of CPUs ('cpus'), memory in bytes ('memory') and priority
+        ('priority') for admission by the run queue
+    sample: float, optional
+        Seconds between samples of the resource usage
+    capture: dict, optional
+        Maximum number of bytes ('limit') and number of bytes at the end
+        ('tail') that are stored for each output. The output is not limited
+        if no limit is given.
+    timeout: float, optional
+        Maximum run time of the command in seconds
+    retries: int, optional
+        Number of times a failed command is run again
+    metrics: func, optional
+        Function that is called with the run identifier and every reported
+        object
+    allocator: exprepo.placement.CpuAllocator, optional
+        Allocator of CPU sets for concurrent runs
+    run_id: string, optional
+        Unique run identifier. A new identifier is created by default.
+    verbose: bool, optional
+        Print the command before it is run
+
+    Returns
+    -------
+    (dict, dict)
+    """
+    cmd, params = point
+    if run_id is None:
+        run_id = new_run_id()
+    run_dir = get_run_dir(run_id)
+    if not sample is None or not capture is None:
+        os.makedirs(run_dir)
+    samples_file = None
+    if not sample is None:
+        samples_file = os.path.join(run_dir, SAMPLES_FILE)
+    outputs = dict()
+    if not metrics is None:
+        outputs['metrics'] = lambda obj: metrics(run_id, obj)
+    if not capture is None:
+        outputs['report'] = True
+        outputs['stdout_file'] = os.path.join(run_dir, STDOUT_FILE)
+        outputs['stderr_file'] = os.path.join(run_dir, STDERR_FILE)
+        outputs['output_limit'] = capture.get('limit')
+        outputs['output_tail'] = capture.get('tail', 0)
+    attempts, queue_wait = 0, 0.0
+    host = socket.gethostname()
+    while True:
+        ticket_id = None
+        if not request is None:
+            with phase('queue'):
+                ticket_id, wait = acquire(
+                    cpus=request['cpus'],
+                    memory=request['memory'],
+                    priority=request['priority']
+                )
+            queue_wait += wait
+        alloc_id, placement = None, None
+        if not allocator is None:
+            alloc_id, placement = allocator.acquire()
+            if not placement['threads'] is None:
+                outputs['env'] = get_thread_env(placement['threads'])
+            outputs['cpus'] = placement['cpus']
+        started = {'host': host}
+        if not placement is None and not placement['cpus'] is None:
+            started['cpus'] = placement['cpus']
+        try:
+            if verbose:
+                print prg_name + ' (RUN): ' + ' '.join(cmd)
+            result = execute(
+                cmd,
+                sample_interval=sample,
+                samples_file=samples_file,
+                timeout=timeout,
+                started=lambda pid: emit(EVENT_STARTED, run_id=run_id, pid=pid, **started),
+                **outputs
+            )
+        except OSError as ex:
+            emit(EVENT_FAILED, run_id=run_id, error=str(ex))
+            raise
+        finally:
+            if not allocator is None:
+                allocator.release(alloc_id)
+            if not ticket_id is None:
+                release(ticket_id)
+        attempts += 1
+        if result['exit_code'] == 0 or result.get('stopped') or attempts > retries:
+            break
+        delay = min(RETRY_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY)
+        if verbose:
+            print prg_name + ' (RETRY): ' + ' '.join(cmd) + ' in %.0fs' % delay
+        time.sleep(delay)
+    result['id'] = run_id
+    result['args'] = cmd
+    if attempts > 1:
+        result['attempts'] = attempts
+    if not placement is None:
+        result['placement'] = placement
+    event = {
+        'exit_code': result['exit_code'],
+        'duration': result['duration'],
+        'attempts': attempts
+    }
+    for key in ['usage', 'timed_out', 'stopped']:
+        if key in result:
+            event[key] = result[key]
+    emit(EVENT_FINISHED if result['exit_code'] == 0 else EVENT_FAILED, run_id=run_id, **event)
+    if not request is None:
+        result['queue_wait'] = queue_wait
+        result['resources'] = request
+    return params, result
 
 
 def show_command(name):
@@ -262,13 +1387,101 @@ def show_command(name):
     name: string
         Name of the command to be printed
     """
-    commands = get_commands()
-    if name in commands:
-        print 'command: ' + name + '\n'
-        print 'parameters:'
-        i = 1
-        for obj in commands[name]:
-            print '(' + str(i) + ')  ' + obj.to_spec
-            i += 1
+    spec = get_command(name)
+    inputs, outputs = get_command_files(name)
+    print 'command: ' + name + '\n'
+    print 'parameters:'
+    i = 1
+    for obj in spec:
+        print '(' + str(i) + ')  ' + obj.to_spec
+        i += 1
+    if len(inputs) > 0:
+        print '\ninputs:'
+        for filename in inputs:
+            print '  ' + filename
+    if len(outputs) > 0:
+        print '\noutputs:'
+        for filename in outputs:
+            print '  ' + filename
+    resources = get_command_resources(name)
+    if len(resources) > 0:
+        print '\nresources:'
+        for key in sorted(resources):
+            print '  ' + key + ': ' + str(resources[key])
+
+
+def submit_points(prg_name, name, points, scheduler=None, spool=False, verbose=True):
+    """Submit the commands for resolved points of a parameter sweep without
+    running them. The commands are either printed, written as a job array
+    for the given batch scheduler, or written to the spool of the repository
+    if the spool flag is True. Returns the log entries for the submitted
+    commands.
+
+    Raises ValueError if the scheduler is unknown.
+
+    Parameters
+    ----------
+    prg_name: string
+        Name with which the program was called
+    name: string
+        Name of the command
+    points: list((list(string), dict))
+        Command line components and parameter values for each point
+    scheduler: string, optional
+        Name of the batch scheduler
+    spool: bool, optional
+        Write the commands to the spool for workers
+    verbose: bool, optional
+        Print the submitted commands or the job array identifier
+
+    Returns
+    -------
+    list(dict)
+    """
+    entries = []
+    if not scheduler is None:
+        array_id = write_array([cmd for cmd, _ in points], scheduler)
+        if verbose:
+            print prg_name + ' (SUBMIT): job array ' + array_id + ' (' + str(len(points)) + ' tasks)'
+        for i in range(len(points)):
+            cmd, params = points[i]
+            entry = new_entry(name, cmd, params=params, status=STATUS_SUBMITTED)
+            entry['array'] = array_id
+            entry['task'] = i
+            entries.append(entry)
+    elif spool:
+        for cmd, params in points:
+            entry = new_entry(name, cmd, params=params, status=STATUS_SUBMITTED)
+            entry['spool'] = True
+            entries.append(entry)
+        spool_jobs(name, points, entries)
+        if verbose:
+            for entry in entries:
+                print prg_name + ' (SPOOL): ' + ' '.join(entry['args']) + ' [' + entry['id'] + ']'
     else:
-        raise ValueError('unknown command \'' + name + '\'')
+        for cmd, params in points:
+            if verbose:
+                print prg_name + ' (SUBMIT): ' + ' '.join(cmd)
+            entries.append(
+                new_entry(name, cmd, params=params, status=STATUS_SUBMITTED)
+            )
+    append_entries(entries)
+    return entries
+
+
+def write_command_index(reg_dir, index):
+    """Write the registry index to the given registry directory. The index is
+    written to a temporary file first that then replaces the existing index.
+
+    Parameters
+    ----------
+    reg_dir: string
+        Path to the command registry directory
+    index: dict
+        Registry index
+    """
+    filename = os.path.join(reg_dir, exp.COMMAND_INDEX_FILE)
+    tmp_file = filename + '.' + str(os.getpid())
+    with open(tmp_file, 'w') as f:
+        json.dump(index, f, separators=(',', ':'))
+    os.rename(tmp_file, filename)
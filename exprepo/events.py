@@ -0,0 +1,527 @@
+"""Everything related to the event stream of run lifecycles.
+
+Runs emit events as JSON objects, one per line. Every event contains the
+event type ('event'), the time, and the run identifier ('run'). Runs of a
+sweep are announced by a sweep event with the number of points and a queued
+event for every point. A started event contains the process id and the host.
+Heartbeat events are emitted periodically for running runs. A run ends with
+a finished event if the command exited with code zero and a failed event
+otherwise, both containing the exit code, the duration and the resource
+usage.
+
+Events are written to the file .xpr/EVENTS by default. The XPR_EVENTS
+environment variable selects a different file, a unix socket (unix:<path>)
+that a consumer listens on, or disables events (none). Emitting an event
+never blocks. Events are written by a background thread and events that
+do not fit into the bounded queue (e.g., because the consumer is too slow)
+are dropped. An event file that exceeds MAX_EVENTS_SIZE bytes is renamed
+with the suffix .1 (replacing earlier events) and a new file is started, so
+events never take more than twice that space.
+"""
+
+import atexit
+from collections import deque
+import fcntl
+import json
+import os
+import select
+import socket
+import sys
+import threading
+import time
+
+import exprepo as exp
+
+
+# ------------------------------------------------------------------------------
+# Constants
+# ------------------------------------------------------------------------------
+
+"""Event types."""
+EVENT_DROPPED = 'dropped'
+EVENT_FAILED = 'failed'
+EVENT_FINISHED = 'finished'
+EVENT_HEARTBEAT = 'heartbeat'
+EVENT_QUEUED = 'queued'
+EVENT_STARTED = 'started'
+EVENT_SWEEP = 'sweep'
+
+"""Environment variable that selects the event target, the value that
+disables events and the prefix of unix socket targets."""
+ENV_EVENTS = 'XPR_EVENTS'
+EVENTS_NONE = 'none'
+EVENTS_UNIX = 'unix:'
+
+"""Seconds between heartbeat events of running runs."""
+HEARTBEAT_INTERVAL = 10.0
+
+"""Size in bytes at which the event file is rotated and the suffix of the
+rotated file."""
+MAX_EVENTS_SIZE = 16 * 1024 * 1024
+ROTATED_SUFFIX = '.1'
+
+"""Maximum number of events that wait to be written."""
+MAX_PENDING = 10000
+
+"""Seconds that are waited for pending events to be written at exit."""
+FLUSH_TIMEOUT = 1.0
+
+"""Seconds between refreshs of the watch view and the number of bytes at
+the end of the event file that are read when the view starts."""
+WATCH_INTERVAL = 1.0
+WATCH_TAIL = 1024 * 1024
+
+"""Maximum number of sweeps that are shown by the watch view."""
+WATCH_SWEEPS = 5
+
+"""Emitters by their target. Emitters are created on first use."""
+EMITTERS = dict()
+EMITTERS_LOCK = threading.Lock()
+
+
+# ------------------------------------------------------------------------------
+# Classes
+# ------------------------------------------------------------------------------
+
+class EventEmitter(object):
+    """Writer for events to a file or unix socket. Events are queued by emit
+    and written by a daemon thread. The thread also emits heartbeat events
+    for all runs that have started and not ended.
+    """
+    def __init__(self, target):
+        """Initialize the emitter and start the writer thread.
+
+        Parameters
+        ----------
+        target: string
+            Absolute path to the event file or unix:<path> for a socket
+        """
+        self.target = target
+        self.cond = threading.Condition()
+        self.pending = deque()
+        self.dropped = 0
+        self.running = dict()
+        self.closed = False
+        self.sock = None
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self, timeout=FLUSH_TIMEOUT):
+        """Stop the writer thread after pending events have been written or
+        the timeout expired.
+
+        Parameters
+        ----------
+        timeout: float, optional
+            Maximum number of seconds to wait
+        """
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        self.thread.join(timeout)
+
+    def emit(self, event, run_id=None, **values):
+        """Queue an event. The event is dropped if the queue is full.
+
+        Parameters
+        ----------
+        event: string
+            Event type
+        run_id: string, optional
+            Run identifier
+        values: dict
+            Event attributes
+        """
+        values['event'] = event
+        values['time'] = time.time()
+        if not run_id is None:
+            values['run'] = run_id
+        with self.cond:
+            if event == EVENT_STARTED:
+                self.running[run_id] = values['time']
+            elif event in [EVENT_FAILED, EVENT_FINISHED]:
+                self.running.pop(run_id, None)
+            if len(self.pending) >= MAX_PENDING:
+                self.dropped += 1
+                return
+            self.pending.append(values)
+            self.cond.notify()
+
+    def run(self):
+        """Write pending events until the emitter is closed."""
+        heartbeat = time.time() + HEARTBEAT_INTERVAL
+        while True:
+            with self.cond:
+                while len(self.pending) == 0 and time.time() < heartbeat:
+                    if self.closed:
+                        return
+                    self.cond.wait(heartbeat - time.time())
+                if time.time() >= heartbeat:
+                    now = time.time()
+                    for run_id, started in self.running.items():
+                        self.pending.append({
+                            'event': EVENT_HEARTBEAT,
+                            'time': now,
+                            'run': run_id,
+                            'elapsed': now - started
+                        })
+                    heartbeat = now + HEARTBEAT_INTERVAL
+                events = list(self.pending)
+                if self.dropped > 0:
+                    # Let consumers know that events are missing
+                    events.append({
+                        'event': EVENT_DROPPED,
+                        'time': time.time(),
+                        'count': self.dropped
+                    })
+                    self.dropped = 0
+                self.pending.clear()
+            try:
+                self.write(events)
+            except (IOError, OSError, socket.error):
+                # Events are dropped if the target is not available
+                if not self.sock is None:
+                    self.sock.close()
+                    self.sock = None
+
+    def write(self, events):
+        """Write events to the target. The event file is rotated once it
+        exceeds MAX_EVENTS_SIZE bytes.
+
+        Parameters
+        ----------
+        events: list(dict)
+            Events
+        """
+        if len(events) == 0:
+            return
+        data = ''.join([json.dumps(e, separators=(',', ':')) + '\n' for e in events])
+        if self.target.startswith(EVENTS_UNIX):
+            if self.sock is None:
+                self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self.sock.connect(self.target[len(EVENTS_UNIX):])
+            self.sock.sendall(data)
+        else:
+            while True:
+                with open(self.target, 'a') as f:
+                    # The lock ensures that only one process rotates the file
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                    info = os.fstat(f.fileno())
+                    if not os.path.exists(self.target) or is_rotated(f, self.target):
+                        # The file was rotated while waiting for the lock
+                        continue
+                    if info.st_size < MAX_EVENTS_SIZE:
+                        f.write(data)
+                        return
+                    os.rename(self.target, self.target + ROTATED_SUFFIX)
+
+
+class SweepProgress(object):
+    """Progress of the runs in a sweep as reconstructed from events."""
+    def __init__(self, sweep_id, command=None, total=0, started=None):
+        """Initialize the progress.
+
+        Parameters
+        ----------
+        sweep_id: string
+            Sweep identifier
+        command: string, optional
+            Name of the command
+        total: int, optional
+            Number of runs in the sweep
+        started: float, optional
+            Time at which the sweep started
+        """
+        self.sweep_id = sweep_id
+        self.command = command
+        self.total = total
+        self.started = started
+        self.running = dict()
+        self.finished = 0
+        self.failed = 0
+        self.last = started
+
+    def format(self, now):
+        """Get the lines that show the progress of the sweep.
+
+        Parameters
+        ----------
+        now: float
+            Current time
+
+        Returns
+        -------
+        list(string)
+        """
+        done = self.finished + self.failed
+        line = [
+            self.sweep_id,
+            self.command if not self.command is None else '?',
+            '%d/%d done' % (done, self.total),
+            '%d failed' % self.failed,
+            '%d running' % len(self.running)
+        ]
+        if not self.started is None:
+            elapsed = (now if done < self.total else self.last) - self.started
+            line.append('elapsed %s' % format_seconds(elapsed))
+            if done > 0 and done < self.total:
+                eta = elapsed / done * (self.total - done)
+                line.append('eta %s' % format_seconds(eta))
+        lines = ['  '.join(line)]
+        for run_id in sorted(self.running, key=lambda r: self.running[r]['time']):
+            run = self.running[run_id]
+            lines.append('  %s  %s  pid %s  %s' % (
+                run_id,
+                run.get('host', '?'),
+                run.get('pid', '?'),
+                format_seconds(now - run['time'])
+            ))
+        return lines
+
+
+# ------------------------------------------------------------------------------
+# API Methods
+# ------------------------------------------------------------------------------
+
+def emit(event, run_id=None, **values):
+    """Emit an event to the event target of the repository in the current
+    working directory (see get_event_target). Does nothing if events are
+    disabled.
+
+    Parameters
+    ----------
+    event: string
+        Event type
+    run_id: string, optional
+        Run identifier
+    values: dict
+        Event attributes
+    """
+    target = get_event_target()
+    if target is None:
+        return
+    with EMITTERS_LOCK:
+        emitter = EMITTERS.get(target)
+        if emitter is None:
+            emitter = EventEmitter(target)
+            EMITTERS[target] = emitter
+            # Write pending events when the process exits
+            atexit.register(emitter.close)
+    emitter.emit(event, run_id=run_id, **values)
+
+
+def get_event_target():
+    """Get the target for events. Returns None if events are disabled.
+
+    Returns
+    -------
+    string
+    """
+    target = os.environ.get(ENV_EVENTS)
+    if target == EVENTS_NONE:
+        return None
+    if target is None or target == '':
+        if not os.path.isdir(exp.REPO_DIR):
+            return None
+        target = os.path.join(exp.REPO_DIR, exp.EVENTS_FILE)
+    if target.startswith(EVENTS_UNIX):
+        return EVENTS_UNIX + os.path.abspath(target[len(EVENTS_UNIX):])
+    return os.path.abspath(target)
+
+
+def watch(socket_file=None, once=False):
+    """Show the progress of sweeps from the event stream until interrupted.
+    Events are read from the event file of the repository (or the file given
+    by XPR_EVENTS). If a socket file is given, the view listens on a unix
+    socket for events instead. If the once flag is True, the view is printed
+    once for the events in the event file.
+
+    Parameters
+    ----------
+    socket_file: string, optional
+        Path to the unix socket to listen on
+    once: bool, optional
+        Print the view once and return
+    """
+    sweeps = dict()
+    runs = dict()
+    if not socket_file is None:
+        if os.path.exists(socket_file):
+            os.remove(socket_file)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(socket_file)
+        server.listen(16)
+        sources = {server: None}
+    else:
+        target = get_event_target()
+        if target is None or target.startswith(EVENTS_UNIX):
+            raise ValueError('no event file')
+        f = open(target, 'a+')
+        f.seek(0, os.SEEK_END)
+        if f.tell() > WATCH_TAIL:
+            # Skip the partial line at the start of the tail
+            f.seek(-WATCH_TAIL, os.SEEK_END)
+            f.readline()
+        else:
+            f.seek(0)
+    try:
+        buffer = ''
+        while True:
+            if socket_file is None:
+                # Seeking clears the end-of-file flag so that events that
+                # were appended since the last read are returned
+                f.seek(0, os.SEEK_CUR)
+                buffer += f.read()
+                if is_rotated(f, target):
+                    # Continue with the new event file
+                    f.close()
+                    f = open(target, 'a+')
+                    f.seek(0)
+                    buffer += f.read()
+                lines = buffer.split('\n')
+                buffer = lines.pop()
+                for line in lines:
+                    update_progress(sweeps, runs, line)
+            else:
+                readable, _, _ = select.select(sources.keys(), [], [], WATCH_INTERVAL)
+                for sock in readable:
+                    if sock is server:
+                        conn, _ = server.accept()
+                        sources[conn] = ''
+                        continue
+                    data = sock.recv(65536)
+                    if len(data) == 0:
+                        sock.close()
+                        del sources[sock]
+                        continue
+                    lines = (sources[sock] + data).split('\n')
+                    sources[sock] = lines.pop()
+                    for line in lines:
+                        update_progress(sweeps, runs, line)
+            print_progress(sweeps, clear=not once and sys.stdout.isatty())
+            if once:
+                break
+            if socket_file is None:
+                time.sleep(WATCH_INTERVAL)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if socket_file is None:
+            f.close()
+        else:
+            for sock in sources:
+                sock.close()
+            os.remove(socket_file)
+
+
+# ------------------------------------------------------------------------------
+# Helper Methods
+# ------------------------------------------------------------------------------
+
+def format_seconds(seconds):
+    """Format a number of seconds as h:mm:ss.
+
+    Parameters
+    ----------
+    seconds: float
+        Number of seconds
+
+    Returns
+    -------
+    string
+    """
+    seconds = int(max(0, seconds))
+    return '%d:%02d:%02d' % (seconds // 3600, (seconds // 60) % 60, seconds % 60)
+
+
+def is_rotated(f, filename):
+    """Test whether the given open event file has been replaced by a new file
+    (see EventEmitter.write).
+
+    Parameters
+    ----------
+    f: file
+        Open event file
+    filename: string
+        Path to the event file
+
+    Returns
+    -------
+    bool
+    """
+    try:
+        return os.fstat(f.fileno()).st_ino != os.stat(filename).st_ino
+    except OSError:
+        return False
+
+
+def print_progress(sweeps, clear=False):
+    """Print the progress of the most recent sweeps in the order in which
+    they started.
+
+    Parameters
+    ----------
+    sweeps: dict
+        Progress of sweeps by their identifier
+    clear: bool, optional
+        Clear the terminal before printing
+    """
+    now = time.time()
+    lines = list()
+    for sweep in sorted(sweeps.values(), key=lambda s: s.started)[-WATCH_SWEEPS:]:
+        lines.extend(sweep.format(now))
+    if clear:
+        sys.stdout.write('\033[H\033[J')
+    print '\n'.join(lines) if len(lines) > 0 else 'no runs'
+    sys.stdout.flush()
+
+
+def update_progress(sweeps, runs, line):
+    """Update the progress of sweeps with an event. Lines that are not valid
+    events are ignored. Runs that were not queued as part of a sweep are
+    counted in a sweep with the identifier '-'.
+
+    Parameters
+    ----------
+    sweeps: dict
+        Progress of sweeps by their identifier
+    runs: dict
+        Sweep identifier of each run
+    line: string
+        Event in JSON format
+    """
+    try:
+        event = json.loads(line)
+        event_type = event['event']
+    except (ValueError, KeyError, TypeError):
+        return
+    if event_type == EVENT_SWEEP:
+        sweeps[event['sweep']] = SweepProgress(
+            event['sweep'],
+            command=event.get('command'),
+            total=event.get('total', 0),
+            started=event['time']
+        )
+        return
+    run_id = event.get('run')
+    if event_type == EVENT_QUEUED:
+        runs[run_id] = event.get('sweep')
+        return
+    sweep_id = runs.get(run_id, '-')
+    sweep = sweeps.get(sweep_id)
+    if sweep is None:
+        sweep = SweepProgress(sweep_id, started=event['time'])
+        sweeps[sweep_id] = sweep
+    if event_type == EVENT_STARTED:
+        if sweep_id == '-' and not run_id in sweep.running:
+            sweep.total += 1
+        sweep.running[run_id] = event
+    elif event_type in [EVENT_FINISHED, EVENT_FAILED]:
+        sweep.running.pop(run_id, None)
+        if event_type == EVENT_FINISHED:
+            sweep.finished += 1
+        else:
+            sweep.failed += 1
+        sweep.last = event['time']
+
@@ -0,0 +1,795 @@
+"""Everything related to executing command line commands.
+
+Commands are run as child processes. The resource usage of the child process
+tree (CPU time, peak resident set size and I/O volume) is collected when the
+child terminates. The peak resident set size that the kernel reports for a
+terminated child includes the memory of this process at the time the child
+was forked. The peak is therefore monitored from /proc while the command is
+running. Optionally, the CPU utilization, resident set size and I/O
+volume of the process tree are sampled at a fixed interval while the command
+is running. Samples are written as fixed-size binary records.
+
+A command can be pinned to a set of CPUs. The affinity is set in the child
+process before the command is executed. Additional environment variables
+(e.g., thread counts of numerical libraries) are passed to the command.
+
+Standard output and standard error of a command can be captured instead of
+being written to the terminal. The output is streamed through pipes into
+compressed files. The size of the stored output can be capped. Output that
+exceeds the cap is dropped, except for the last bytes of the output that are
+kept in a ring buffer if a tail size is given.
+
+If a timeout is given, the command is run in a new session. The whole process
+group is terminated when the command exceeds the timeout.
+
+Commands may report metrics by printing JSON objects on standard output, one
+per line. Reported objects are parsed from the output as it is written to
+the terminal or captured. If a metrics callback is given, every reported
+object is passed to the callback. The callback can stop the command early,
+which terminates the process group of the command.
+"""
+
+from collections import deque
+import errno
+import gzip
+import json
+import os
+import resource
+import signal
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+from exprepo.placement import get_affinity_setter
+from exprepo.timing import phase
+
+
+# ------------------------------------------------------------------------------
+# Constants
+# ------------------------------------------------------------------------------
+
+"""Sample records contain the time since the start of the run, CPU
+utilization (in percent), resident set size, and the number of bytes read and
+written by the process tree."""
+SAMPLE_RECORD = struct.Struct('<ffQQQ')
+
+"""Size of blocks in block I/O counters of the resource usage."""
+BLOCK_SIZE = 512
+
+"""Clock ticks per second and page size for values in /proc."""
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = resource.getpagesize()
+
+"""Number of bytes that are read from an output pipe at a time."""
+CAPTURE_CHUNK_SIZE = 65536
+
+"""Compression level for captured output. Favors speed over size."""
+CAPTURE_COMPRESS_LEVEL = 1
+
+"""Maximum length of a line that is parsed as a reported object. Longer lines
+are ignored."""
+MAX_REPORT_SIZE = 1024 * 1024
+
+"""Seconds between reads of the peak memory usage of a running command. The
+interval doubles from the minimum to the maximum so that short commands are
+read often."""
+MEMORY_POLL_MAX_INTERVAL = 0.5
+MEMORY_POLL_MIN_INTERVAL = 0.005
+
+"""Seconds between terminating and killing the process group of a command
+that exceeded its timeout."""
+KILL_GRACE_PERIOD = 5.0
+
+
+# ------------------------------------------------------------------------------
+# Classes
+# ------------------------------------------------------------------------------
+
+class MemoryMonitor(threading.Thread):
+    """Thread that monitors the peak resident set size of a running command.
+    The peak is the maximum of the high-water mark of the command process
+    (which is reset when the command is executed) and the resident set size
+    of the process tree at every poll. Growth after the last poll before the
+    command terminates is not seen.
+    """
+    def __init__(self, pid):
+        """Initialize the monitor. The memory usage is read once before the
+        thread is started.
+
+        Parameters
+        ----------
+        pid: int
+            Identifier of the command process
+        """
+        super(MemoryMonitor, self).__init__()
+        self.daemon = True
+        self.pid = pid
+        self.stopped = threading.Event()
+        # Peak resident set size in bytes (None until the first successful
+        # read)
+        self.peak = None
+        self.poll()
+
+    def poll(self):
+        """Read the memory usage of the command and update the peak."""
+        values = [read_peak_rss(self.pid), read_process_tree(self.pid)[1]]
+        values = [v for v in values if v > 0]
+        if len(values) > 0:
+            self.peak = max(values + [self.peak or 0])
+
+    def run(self):
+        interval = MEMORY_POLL_MIN_INTERVAL
+        while not self.stopped.wait(interval):
+            self.poll()
+            interval = min(2 * interval, MEMORY_POLL_MAX_INTERVAL)
+
+    def stop(self):
+        """Stop monitoring and wait for the thread to terminate."""
+        self.stopped.set()
+        self.join()
+
+
+class MetricsParser(object):
+    """Parser for objects that a command reports on standard output. Lines
+    that contain a JSON object are counted and the last reported value of
+    every key is kept (objects may report different metrics). If a
+    callback is given, every object is passed to it. If the callback returns
+    True, the process group of the command is terminated.
+    """
+    def __init__(self, pgid, callback=None):
+        """Initialize the parser.
+
+        Parameters
+        ----------
+        pgid: int
+            Identifier of the process group of the command
+        callback: func, optional
+            Function that is called with every reported object
+        """
+        self.pgid = pgid
+        self.callback = callback
+        self.count = 0
+        self.last = None
+        self.stopped = False
+        # Incomplete last line of the output that was fed so far
+        self.pending = ''
+
+    def close(self):
+        """Parse an incomplete last line at the end of the output."""
+        self.parse_line(self.pending)
+        self.pending = ''
+
+    def feed(self, data):
+        """Parse the complete lines in a chunk of the output.
+
+        Parameters
+        ----------
+        data: string
+            Chunk of the output
+        """
+        lines = (self.pending + data).split('\n')
+        self.pending = lines.pop()
+        if len(self.pending) > MAX_REPORT_SIZE:
+            self.pending = ''
+        for line in lines:
+            self.parse_line(line)
+
+    def parse_line(self, line):
+        """Parse a single line of the output.
+
+        Parameters
+        ----------
+        line: string
+            Line of the output
+        """
+        if self.stopped or not line.startswith('{') or len(line) > MAX_REPORT_SIZE:
+            return
+        try:
+            obj = json.loads(line)
+        except ValueError:
+            return
+        if not isinstance(obj, dict):
+            return
+        self.count += 1
+        if self.last is None:
+            self.last = dict()
+        self.last.update(obj)
+        if not self.callback is None and self.callback(obj):
+            self.stopped = True
+            kill_group(self.pgid, signal.SIGTERM)
+
+
+class MetricsReader(threading.Thread):
+    """Thread that reads the standard output of a command line by line. Lines
+    are written to the standard output of this process and passed to a
+    metrics parser.
+    """
+    def __init__(self, fd, parser):
+        """Initialize the reader.
+
+        Parameters
+        ----------
+        fd: int
+            Read end of the output pipe
+        parser: MetricsParser
+            Parser for reported objects
+        """
+        super(MetricsReader, self).__init__()
+        self.daemon = True
+        self.fd = fd
+        self.parser = parser
+
+    def run(self):
+        with os.fdopen(self.fd, 'rb') as f:
+            for line in iter(f.readline, ''):
+                sys.stdout.write(line)
+                self.parser.parse_line(line.rstrip('\n'))
+
+
+class OutputCapture(threading.Thread):
+    """Thread that reads the output of a command from a pipe and writes it to
+    a compressed file. If a limit is given, at most limit bytes are stored.
+    The stored output consists of the first bytes of the output and, if a
+    tail size is given, the last tail bytes of the output. A line with the
+    number of omitted bytes separates both parts. If only a tail size is
+    given, only the last tail bytes are stored. If a metrics parser is given,
+    the complete output is passed to the parser.
+    """
+    def __init__(self, fd, filename, limit=None, tail=0, parser=None):
+        """Initialize the capture.
+
+        Parameters
+        ----------
+        fd: int
+            Read end of the output pipe
+        filename: string
+            Path to the compressed output file
+        limit: int, optional
+            Maximum number of bytes that are stored
+        tail: int, optional
+            Number of bytes at the end of the output that are stored
+        parser: MetricsParser, optional
+            Parser for reported objects
+        """
+        super(OutputCapture, self).__init__()
+        self.daemon = True
+        self.fd = fd
+        self.filename = filename
+        self.parser = parser
+        if not limit is None:
+            self.head = limit - tail
+        else:
+            # Without a limit, the whole output is stored unless only the
+            # tail is kept
+            self.head = 0 if tail > 0 else None
+        self.tail = tail
+        # Total number of bytes in the output and number of bytes that were
+        # not stored
+        self.size = 0
+        self.omitted = 0
+
+    def run(self):
+        f = gzip.open(self.filename, 'wb', CAPTURE_COMPRESS_LEVEL)
+        try:
+            head_size = 0
+            buffer = deque()
+            buffer_size = 0
+            while True:
+                data = os.read(self.fd, CAPTURE_CHUNK_SIZE)
+                if data == '':
+                    break
+                self.size += len(data)
+                if not self.parser is None:
+                    self.parser.feed(data)
+                if self.head is None:
+                    f.write(data)
+                    continue
+                if head_size < self.head:
+                    n = min(len(data), self.head - head_size)
+                    f.write(data[:n])
+                    head_size += n
+                    data = data[n:]
+                if data == '' or self.tail == 0:
+                    continue
+                buffer.append(data)
+                buffer_size += len(data)
+                while buffer_size > self.tail:
+                    excess = buffer_size - self.tail
+                    if len(buffer[0]) <= excess:
+                        buffer_size -= len(buffer.popleft())
+                    else:
+                        buffer[0] = buffer[0][excess:]
+                        buffer_size -= excess
+            self.omitted = self.size - head_size - buffer_size
+            if not self.head is None and self.omitted > 0:
+                if head_size > 0:
+                    f.write('\n')
+                f.write('[' + str(self.omitted) + ' bytes omitted]\n')
+            if not self.head is None:
+                for data in buffer:
+                    f.write(data)
+            if not self.parser is None:
+                self.parser.close()
+        finally:
+            f.close()
+            os.close(self.fd)
+
+    def get_result(self):
+        """Get the number of bytes in the output and the number of bytes that
+        were not stored.
+
+        Returns
+        -------
+        dict
+        """
+        return {'size': self.size, 'omitted': self.omitted}
+
+
+class Sampler(threading.Thread):
+    """Thread that samples the resource usage of a process tree from /proc at
+    a fixed interval and writes sample records to file.
+    """
+    def __init__(self, pid, interval, filename):
+        """Initialize the sampler.
+
+        Parameters
+        ----------
+        pid: int
+            Identifier of the root process
+        interval: float
+            Seconds between samples
+        filename: string
+            Path to the output file
+        """
+        super(Sampler, self).__init__()
+        self.daemon = True
+        self.pid = pid
+        self.interval = interval
+        self.filename = filename
+        self.stopped = threading.Event()
+        self.count = 0
+        # Maximum resident set size of the process tree over all samples
+        self.max_rss = 0
+
+    def run(self):
+        start = time.time()
+        last_time, last_ticks = start, 0
+        with open(self.filename, 'wb') as f:
+            while not self.stopped.wait(self.interval):
+                ticks, rss, read_bytes, write_bytes = read_process_tree(self.pid)
+                self.max_rss = max(self.max_rss, rss)
+                now = time.time()
+                cpu = 0.0
+                if now > last_time:
+                    seconds = float(ticks - last_ticks) / CLOCK_TICKS
+                    cpu = max(0.0, 100.0 * seconds / (now - last_time))
+                last_time, last_ticks = now, ticks
+                f.write(
+                    SAMPLE_RECORD.pack(
+                        now - start,
+                        cpu,
+                        rss,
+                        read_bytes,
+                        write_bytes
+                    )
+                )
+                f.flush()
+                self.count += 1
+
+    def stop(self):
+        """Stop sampling and wait for the thread to terminate."""
+        self.stopped.set()
+        self.join()
+
+
+class Watchdog(threading.Thread):
+    """Thread that terminates the process group of a command if the command
+    does not finish within the timeout. The group is killed if it does not
+    terminate within the grace period.
+    """
+    def __init__(self, pgid, timeout):
+        """Initialize the watchdog.
+
+        Parameters
+        ----------
+        pgid: int
+            Identifier of the process group
+        timeout: float
+            Seconds until the process group is terminated
+        """
+        super(Watchdog, self).__init__()
+        self.daemon = True
+        self.pgid = pgid
+        self.timeout = timeout
+        self.stopped = threading.Event()
+        self.expired = False
+
+    def run(self):
+        if self.stopped.wait(self.timeout):
+            return
+        self.expired = True
+        kill_group(self.pgid, signal.SIGTERM)
+        if not self.stopped.wait(KILL_GRACE_PERIOD):
+            kill_group(self.pgid, signal.SIGKILL)
+
+    def stop(self):
+        """Stop the watchdog and wait for the thread to terminate."""
+        self.stopped.set()
+        self.join()
+
+
+# ------------------------------------------------------------------------------
+# API Methods
+# ------------------------------------------------------------------------------
+
+def execute(cmd, sample_interval=None, samples_file=None, stdout_file=None, stderr_file=None, output_limit=None, output_tail=0, timeout=None, report=False, metrics=None, started=None, cpus=None, env=None):
+    """Run the given command and wait for it to terminate. Returns a dictionary
+    containing the exit code, the run time in seconds, and the resource usage
+    of the process tree ('usage'). The peak memory usage ('max_rss') is
+    monitored while the command is running (see MemoryMonitor). The peak
+    that the kernel reports for the largest process of the terminated tree
+    ('max_rss_kernel') is kept as well. It includes the memory of this
+    process at the time the command was forked and is only used if it
+    exceeds that memory. The peak is None if the command terminated before
+    its memory usage could be read and the kernel value is not usable. If a
+    sample interval is given, the resource usage is sampled while the command
+    is running and written to the samples file. The number of samples is
+    contained in the result.
+
+    If output files are given, standard output and standard error of the
+    command are captured in compressed files (see OutputCapture). The size of
+    each output and the number of omitted bytes are contained in the result
+    ('output').
+
+    If a timeout is given, the process group of the command is terminated
+    when the command runs longer than timeout seconds. The result then
+    contains the flag 'timed_out'.
+
+    If the report flag is True or a metrics callback is given, objects that
+    are reported by the command on standard output are parsed (see
+    MetricsParser), whether the output is captured or not. The result
+    contains the number of reported objects and the last reported value of
+    every key ('metrics') if the command reported any. Reported objects are
+    passed to the metrics callback. The result contains the flag 'stopped'
+    if the command was stopped by the callback.
+
+    If a list of CPUs is given, the command and all processes it starts only
+    run on these CPUs. Given environment variables are added to the
+    environment of the command.
+
+    Parameters
+    ----------
+    cmd: list(string)
+        Command line components
+    sample_interval: float, optional
+        Seconds between samples
+    samples_file: string, optional
+        Path to the output file for samples
+    stdout_file: string, optional
+        Path to the compressed file for standard output
+    stderr_file: string, optional
+        Path to the compressed file for standard error
+    output_limit: int, optional
+        Maximum number of bytes that are stored for each output
+    output_tail: int, optional
+        Number of bytes at the end of each output that are stored
+    timeout: float, optional
+        Maximum run time in seconds
+    report: bool, optional
+        Parse objects that are reported by the command
+    metrics: func, optional
+        Function that is called with every object reported by the command.
+        The command is stopped if the function returns True.
+    started: func, optional
+        Function that is called with the process id once the command has
+        been started
+    cpus: list(int), optional
+        CPUs on which the command runs
+    env: dict, optional
+        Additional environment variables for the command
+
+    Returns
+    -------
+    dict
+    """
+    report = report or not metrics is None
+    # The command becomes the leader of a new process group that can be
+    # terminated as a whole
+    new_session = not timeout is None or not metrics is None
+    preexec = list()
+    if new_session:
+        preexec.append(os.setsid)
+    if not cpus is None:
+        preexec.append(get_affinity_setter(cpus))
+    def preexec_fn():
+        for func in preexec:
+            func()
+    environ = None
+    if not env is None:
+        environ = dict(os.environ)
+        environ.update(env)
+    start = time.time()
+    captures = dict()
+    if not stdout_file is None:
+        captures['stdout'] = stdout_file
+    if not stderr_file is None:
+        captures['stderr'] = stderr_file
+    # Peak memory of the forked child before it executes the command
+    fork_rss = read_peak_rss(os.getpid())
+    with phase('spawn'):
+        proc = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE if 'stdout' in captures or report else None,
+            stderr=subprocess.PIPE if 'stderr' in captures else None,
+            preexec_fn=preexec_fn if len(preexec) > 0 else None,
+            env=environ
+        )
+    if not started is None:
+        started(proc.pid)
+    monitor = MemoryMonitor(proc.pid)
+    monitor.start()
+    parser = None
+    if report:
+        parser = MetricsParser(proc.pid, callback=metrics)
+    for key in captures:
+        pipe = getattr(proc, key)
+        # The capture thread owns a duplicate of the pipe descriptor
+        captures[key] = OutputCapture(
+            os.dup(pipe.fileno()),
+            captures[key],
+            limit=output_limit,
+            tail=output_tail,
+            parser=parser if key == 'stdout' else None
+        )
+        pipe.close()
+        captures[key].start()
+    reader = None
+    if report and not 'stdout' in captures:
+        reader = MetricsReader(os.dup(proc.stdout.fileno()), parser)
+        proc.stdout.close()
+        reader.start()
+    sampler = None
+    if not sample_interval is None:
+        sampler = Sampler(proc.pid, sample_interval, samples_file)
+        sampler.start()
+    watchdog = None
+    if not timeout is None:
+        watchdog = Watchdog(proc.pid, timeout)
+        watchdog.start()
+    try:
+        with phase('wait'):
+            _, status, usage = wait_process(proc.pid)
+    except BaseException:
+        # The command does not receive signals from the terminal if it runs
+        # in a new session
+        if new_session:
+            kill_group(proc.pid, signal.SIGKILL)
+        raise
+    finally:
+        monitor.stop()
+        if not sampler is None:
+            sampler.stop()
+        if not watchdog is None:
+            watchdog.stop()
+    if (not watchdog is None and watchdog.expired) or (not parser is None and parser.stopped):
+        # Kill remaining processes in the group that ignored termination
+        kill_group(proc.pid, signal.SIGKILL)
+    # Output is read until all processes that hold the pipes terminate
+    for capture in captures.values():
+        capture.join()
+    if not reader is None:
+        reader.join()
+    if os.WIFSIGNALED(status):
+        proc.returncode = -os.WTERMSIG(status)
+    else:
+        proc.returncode = os.WEXITSTATUS(status)
+    # ru_maxrss is given in kilobytes on Linux
+    max_rss_kernel = usage.ru_maxrss * 1024
+    max_rss = monitor.peak
+    if not sampler is None and sampler.max_rss > 0:
+        max_rss = max(max_rss, sampler.max_rss)
+    if max_rss_kernel > fork_rss:
+        # The kernel value can only exceed the memory of the forked child if
+        # a process of the command used more memory
+        max_rss = max(max_rss, max_rss_kernel)
+    result = {
+        'exit_code': proc.returncode,
+        'duration': time.time() - start,
+        'usage': {
+            'cpu_user': usage.ru_utime,
+            'cpu_system': usage.ru_stime,
+            'max_rss': max_rss,
+            'max_rss_kernel': max_rss_kernel,
+            'read_bytes': usage.ru_inblock * BLOCK_SIZE,
+            'write_bytes': usage.ru_oublock * BLOCK_SIZE
+        }
+    }
+    if not sampler is None:
+        result['samples'] = sampler.count
+    if not watchdog is None and watchdog.expired:
+        result['timed_out'] = True
+    if not parser is None and parser.count > 0:
+        result['metrics'] = {'count': parser.count, 'last': parser.last}
+    if not parser is None and parser.stopped:
+        result['stopped'] = True
+    if len(captures) > 0:
+        result['output'] = dict()
+        for key in captures:
+            result['output'][key] = captures[key].get_result()
+    return result
+
+
+def read_samples(filename):
+    """Read sample records from file. Each sample is a tuple of the time since
+    the start of the run, CPU utilization (in percent), resident set size,
+    and the number of bytes read and written.
+
+    Parameters
+    ----------
+    filename: string
+        Path to the samples file
+
+    Returns
+    -------
+    list(tuple)
+    """
+    samples = []
+    with open(filename, 'rb') as f:
+        while True:
+            buf = f.read(SAMPLE_RECORD.size)
+            if len(buf) < SAMPLE_RECORD.size:
+                break
+            samples.append(SAMPLE_RECORD.unpack(buf))
+    return samples
+
+
+# ------------------------------------------------------------------------------
+# Helper Methods
+# ------------------------------------------------------------------------------
+
+def get_children(pid):
+    """Get identifiers of the child processes of the given process. Returns an
+    empty list if the process does not exist.
+
+    Parameters
+    ----------
+    pid: int
+        Process identifier
+
+    Returns
+    -------
+    list(int)
+    """
+    children = []
+    task_dir = os.path.join('/proc', str(pid), 'task')
+    try:
+        for tid in os.listdir(task_dir):
+            with open(os.path.join(task_dir, tid, 'children'), 'r') as f:
+                children.extend([int(c) for c in f.read().split()])
+    except (IOError, OSError):
+        pass
+    return children
+
+
+def kill_group(pgid, signum):
+    """Send a signal to all processes in a process group. Ignores process
+    groups that no longer exist.
+
+    Parameters
+    ----------
+    pgid: int
+        Identifier of the process group
+    signum: int
+        Signal number
+    """
+    try:
+        os.killpg(pgid, signum)
+    except OSError as ex:
+        if ex.errno != errno.ESRCH:
+            raise
+
+
+def read_peak_rss(pid):
+    """Read the peak resident set size (high-water mark) of a process since
+    it executed its program. Returns zero if the value cannot be read (e.g.,
+    the process has terminated).
+
+    Parameters
+    ----------
+    pid: int
+        Process identifier
+
+    Returns
+    -------
+    int
+    """
+    try:
+        with open(os.path.join('/proc', str(pid), 'status'), 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    # The value is given in kilobytes
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError, IndexError, ValueError):
+        pass
+    return 0
+
+
+def read_process(pid):
+    """Read CPU time (in clock ticks), resident set size and I/O volume of a
+    single process from /proc. Values that cannot be read are zero.
+
+    Parameters
+    ----------
+    pid: int
+        Process identifier
+
+    Returns
+    -------
+    int, int, int, int
+    """
+    ticks, rss, read_bytes, write_bytes = 0, 0, 0, 0
+    proc_dir = os.path.join('/proc', str(pid))
+    try:
+        with open(os.path.join(proc_dir, 'stat'), 'r') as f:
+            # The command name may contain spaces and is enclosed in ()
+            fields = f.read().rsplit(')', 1)[1].split()
+            ticks = int(fields[11]) + int(fields[12])
+            rss = int(fields[21]) * PAGE_SIZE
+        with open(os.path.join(proc_dir, 'io'), 'r') as f:
+            for line in f:
+                key, value = line.split(':')
+                if key == 'read_bytes':
+                    read_bytes = int(value)
+                elif key == 'write_bytes':
+                    write_bytes = int(value)
+    except (IOError, OSError, IndexError, ValueError):
+        pass
+    return ticks, rss, read_bytes, write_bytes
+
+
+def read_process_tree(pid):
+    """Read the sum of CPU time (in clock ticks), resident set size and I/O
+    volume over the given process and all of its descendants.
+
+    Parameters
+    ----------
+    pid: int
+        Identifier of the root process
+
+    Returns
+    -------
+    int, int, int, int
+    """
+    total = [0, 0, 0, 0]
+    queue = [pid]
+    while len(queue) > 0:
+        p = queue.pop()
+        values = read_process(p)
+        for i in range(len(total)):
+            total[i] += values[i]
+        queue.extend(get_children(p))
+    return tuple(total)
+
+
+def wait_process(pid):
+    """Wait for the child process with the given identifier to terminate.
+    Returns the process identifier, exit status and resource usage. Retries
+    if waiting is interrupted by a signal.
+
+    Parameters
+    ----------
+    pid: int
+        Process identifier
+
+    Returns
+    -------
+    int, int, resource.struct_rusage
+    """
+    while True:
+        try:
+            return os.wait4(pid, 0)
+        except OSError as ex:
+            if ex.errno != errno.EINTR:
+                raise
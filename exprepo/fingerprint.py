@@ -0,0 +1,269 @@
+"""Everything related to content fingerprints of input files.
+
+The digest of a file is the SHA-1 hash of the SHA-1 digests of its chunks of
+HASH_CHUNK_SIZE bytes. Chunks of large files are hashed in parallel. The
+digest of a directory is the SHA-1 hash of the relative paths and digests of
+all files in the directory tree.
+
+Digests are kept in a persistent cache that is keyed by the absolute path,
+inode, size and modification time of a file. Files whose key has not changed
+are not hashed again. The cache is a file in JSON lines format to which new
+digests are appended. The last line for a path determines its digest. Files
+that were modified within MTIME_GRACE seconds before they were hashed are
+not cached since they could be modified again without changing their key.
+"""
+
+import hashlib
+import json
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+import os
+import time
+import uuid
+
+import exprepo as exp
+from exprepo.settings import FileLock
+from exprepo.timing import timed
+
+
+# ------------------------------------------------------------------------------
+# Constants
+# ------------------------------------------------------------------------------
+
+"""Number of bytes in a chunk that is hashed by a single thread."""
+HASH_CHUNK_SIZE = 64 * 1024 * 1024
+
+"""Default number of threads that hash chunks concurrently."""
+HASH_JOBS = min(4, cpu_count())
+
+"""Number of bytes that are read at a time."""
+READ_SIZE = 1024 * 1024
+
+"""Seconds between the last modification of a file and the time it was
+hashed before the digest is cached."""
+MTIME_GRACE = 2.0
+
+"""The cache file is compacted when it contains more than this number of
+lines in addition to twice the number of cached paths."""
+COMPACT_SLACK = 1000
+
+
+# ------------------------------------------------------------------------------
+# API Methods
+# ------------------------------------------------------------------------------
+
+@timed('fingerprint')
+def get_digests(paths, jobs=HASH_JOBS):
+    """Get the content digests for the given files and directories. Returns a
+    dictionary that maps absolute paths to their digest. The digest of a path
+    that does not exist is None. Only files that are not in the fingerprint
+    cache (or have changed) are hashed.
+
+    Parameters
+    ----------
+    paths: list(string)
+        Paths to input files or directories
+    jobs: int, optional
+        Maximum number of chunks that are hashed concurrently
+
+    Returns
+    -------
+    dict
+    """
+    paths = sorted(set([os.path.abspath(path) for path in paths]))
+    # Stat all files, including the files in input directories
+    files = dict()
+    dirs = dict()
+    for path in paths:
+        if os.path.isdir(path):
+            dirs[path] = list_files(path)
+            for filename in dirs[path]:
+                files[filename] = None
+        elif os.path.exists(path):
+            files[path] = None
+    for filename in files:
+        stat = os.stat(filename)
+        files[filename] = [stat.st_ino, stat.st_size, stat.st_mtime]
+    cache, lines = read_fingerprints()
+    digests = dict()
+    changed = list()
+    for filename, key in files.items():
+        record = cache.get(filename)
+        if not record is None and record['key'] == key:
+            digests[filename] = record['digest']
+        else:
+            changed.append(filename)
+    if len(changed) > 0:
+        hashed = time.time()
+        digests.update(hash_files(changed, files, jobs))
+        records = [
+            {'path': f, 'key': files[f], 'digest': digests[f]}
+                for f in changed if files[f][2] < hashed - MTIME_GRACE
+        ]
+        # Compact the cache if most of its lines are outdated
+        compact = lines + len(records) > 2 * len(cache) + COMPACT_SLACK
+        write_fingerprints(records, compact=compact)
+    result = dict()
+    for path in paths:
+        if path in dirs:
+            digest = hashlib.sha1()
+            for filename in dirs[path]:
+                digest.update(os.path.relpath(filename, path) + '\0' + digests[filename] + '\n')
+            result[path] = digest.hexdigest()
+        else:
+            result[path] = digests.get(path)
+    return result
+
+
+# ------------------------------------------------------------------------------
+# Helper Methods
+# ------------------------------------------------------------------------------
+
+def get_fingerprint_file():
+    """Get the path to the fingerprint cache of the repository in the current
+    working directory.
+
+    Returns
+    -------
+    string
+    """
+    return os.path.join(exp.REPO_DIR, exp.FINGERPRINT_FILE)
+
+
+def hash_chunk(task):
+    """Get the SHA-1 digest of a chunk of a file.
+
+    Parameters
+    ----------
+    task: (string, int)
+        Path to the file and chunk position
+
+    Returns
+    -------
+    string
+    """
+    filename, pos = task
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        f.seek(pos * HASH_CHUNK_SIZE)
+        remaining = HASH_CHUNK_SIZE
+        while remaining > 0:
+            data = f.read(min(READ_SIZE, remaining))
+            if len(data) == 0:
+                break
+            digest.update(data)
+            remaining -= len(data)
+    return digest.digest()
+
+
+def hash_files(filenames, keys, jobs):
+    """Compute the digests of the given files. The chunks of all files are
+    hashed by a pool of at most jobs threads.
+
+    Parameters
+    ----------
+    filenames: list(string)
+        Paths to the files
+    keys: dict
+        Inode, size and modification time of each file
+    jobs: int
+        Maximum number of chunks that are hashed concurrently
+
+    Returns
+    -------
+    dict
+    """
+    tasks = list()
+    for filename in filenames:
+        chunks = max(1, (keys[filename][1] + HASH_CHUNK_SIZE - 1) // HASH_CHUNK_SIZE)
+        tasks.extend([(filename, pos) for pos in range(chunks)])
+    if jobs > 1 and len(tasks) > 1:
+        pool = ThreadPool(min(jobs, len(tasks)))
+        try:
+            chunk_digests = pool.map(hash_chunk, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        chunk_digests = [hash_chunk(task) for task in tasks]
+    digests = dict()
+    for i in range(len(tasks)):
+        filename = tasks[i][0]
+        if not filename in digests:
+            digests[filename] = hashlib.sha1()
+        digests[filename].update(chunk_digests[i])
+    return dict([(f, d.hexdigest()) for f, d in digests.items()])
+
+
+def list_files(path):
+    """Get the sorted list of absolute paths of all files in a directory
+    tree.
+
+    Parameters
+    ----------
+    path: string
+        Path to the directory
+
+    Returns
+    -------
+    list(string)
+    """
+    result = list()
+    for dir_name, _, filenames in os.walk(path):
+        for filename in filenames:
+            result.append(os.path.join(dir_name, filename))
+    return sorted(result)
+
+
+def read_fingerprints():
+    """Read the fingerprint cache. Returns a dictionary that maps absolute
+    paths to their cached key and digest together with the number of lines
+    in the cache file. Lines that were only partially written are ignored.
+
+    Returns
+    -------
+    dict, int
+    """
+    cache = dict()
+    lines = 0
+    filename = get_fingerprint_file()
+    if not os.path.isfile(filename):
+        return cache, lines
+    with open(filename, 'r') as f:
+        for line in f:
+            lines += 1
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            cache[record['path']] = record
+    return cache, lines
+
+
+def write_fingerprints(records, compact=False):
+    """Append records to the fingerprint cache. If the compact flag is True,
+    the cache is rewritten with only the last record for each path.
+
+    Parameters
+    ----------
+    records: list(dict)
+        New cache records
+    compact: bool, optional
+        Rewrite the cache file
+    """
+    if len(records) == 0:
+        return
+    filename = get_fingerprint_file()
+    with FileLock(filename):
+        with open(filename, 'a') as f:
+            for record in records:
+                f.write(json.dumps(record, separators=(',', ':')) + '\n')
+        if not compact:
+            return
+        # Read the cache again to include records of concurrent writers
+        cache, _ = read_fingerprints()
+        tmp_file = filename + '.' + uuid.uuid4().hex
+        with open(tmp_file, 'w') as f:
+            for path in sorted(cache):
+                f.write(json.dumps(cache[path], separators=(',', ':')) + '\n')
+        os.rename(tmp_file, filename)
@@ -1,6 +1,7 @@
 """Everything needed to initialize the repository."""
 
 from exprepo import BASE_FILE, COMMAND_DIR, REPO_DIR, SETTINGS_FILE
+from exprepo.clones import register_clone
 from exprepo.command import COMMAND_SPEC_SUFFIX
 import json
 import os
@@ -35,6 +36,7 @@ def clone_repository(source_dir=None):
     """Initialize a cloned experiment repository by creating the required folder
     and setting file. Allows to specify an existing repository as source from
     which the current settings are copied as iitial values for the new
+    repository. The clone is added to the registry of clones in the base
     repository.
 
     Raises ValueError if a specified source directory does not exist or is not
@@ -78,6 +80,7 @@ def clone_repository(source_dir=None):
     create_repository()
     with open(os.path.join(REPO_DIR, BASE_FILE), 'w') as f:
         f.write(base_path)
+    register_clone()
     # Copy default settings file if it exists
     if not settings_file is None:
         if os.path.isfile(settings_file):
@@ -0,0 +1,208 @@
+"""Everything related to job arrays for batch schedulers.
+
+A job array consists of a job script and a parameter table. The table has a
+fixed-size header followed by fixed-width rows. Each row contains the command
+line components of one array task in JSON format. Array tasks read their row
+by position without parsing the rest of the table.
+"""
+
+import json
+import mmap
+import os
+from multiprocessing.pool import ThreadPool
+import pipes
+import struct
+import subprocess
+import sys
+import uuid
+
+import exprepo as exp
+
+
+# ------------------------------------------------------------------------------
+# Constants
+# ------------------------------------------------------------------------------
+
+"""Names of the files in a job array directory."""
+ARRAY_SCRIPT_FILE = 'job.sh'
+ARRAY_TABLE_FILE = 'PARAMS'
+
+"""Prefix of the line in a job script that names the batch scheduler."""
+SCHEDULER_PREFIX = '# scheduler:'
+
+"""Table header containing a format identifier, the number of rows and the
+row width."""
+TABLE_HEADER = struct.Struct('<8sQQ')
+TABLE_MAGIC = 'XPRARRAY'
+
+"""Supported batch schedulers. For each scheduler the directive that defines
+the array size, the environment variable that contains the task identifier
+and the identifier of the first task are given."""
+SCHEDULER_PBS = 'pbs'
+SCHEDULER_SGE = 'sge'
+SCHEDULER_SLURM = 'slurm'
+SCHEDULERS = {
+    SCHEDULER_PBS: ('#PBS -t {first}-{last}', 'PBS_ARRAYID', 0),
+    SCHEDULER_SGE: ('#$ -t {first}-{last}', 'SGE_TASK_ID', 1),
+    SCHEDULER_SLURM: ('#SBATCH --array={first}-{last}', 'SLURM_ARRAY_TASK_ID', 0)
+}
+
+
+# ------------------------------------------------------------------------------
+# API Methods
+# ------------------------------------------------------------------------------
+
+def exec_task(filename, index):
+    """Replace the current process with the command of the array task at the
+    given position in the parameter table.
+
+    Parameters
+    ----------
+    filename: string
+        Path to the parameter table
+    index: int
+        Task position (starting at 0)
+    """
+    cmd = read_task(filename, index)
+    os.execvp(cmd[0], cmd)
+
+
+def get_array_dir(array_id):
+    """Get the directory for the job array with the given identifier.
+
+    Parameters
+    ----------
+    array_id: string
+        Unique job array identifier
+
+    Returns
+    -------
+    string
+    """
+    return os.path.join(exp.REPO_DIR, exp.ARRAY_DIR, array_id)
+
+
+def read_task(filename, index):
+    """Read the command line components for the array task at the given
+    position from a parameter table.
+
+    Raises ValueError if the file is not a parameter table or if the index is
+    out of range.
+
+    Parameters
+    ----------
+    filename: string
+        Path to the parameter table
+    index: int
+        Task position (starting at 0)
+
+    Returns
+    -------
+    list(string)
+    """
+    with open(filename, 'rb') as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, rows, width = TABLE_HEADER.unpack_from(buf, 0)
+            if magic != TABLE_MAGIC:
+                raise ValueError('not a parameter table \'' + filename + '\'')
+            if index < 0 or index >= rows:
+                raise ValueError('invalid task index \'' + str(index) + '\'')
+            buf.seek(TABLE_HEADER.size + index * width)
+            return json.loads(buf.read(width))
+        finally:
+            buf.close()
+
+
+def run_array(array_id, jobs=1):
+    """Run all tasks of a job array locally. Simulates the batch scheduler by
+    running the job script once for every task with the task identifier set
+    in the environment. Prints the exit code of every task.
+
+    Raises ValueError if the job array does not exist.
+
+    Parameters
+    ----------
+    array_id: string
+        Unique job array identifier
+    jobs: int, optional
+        Maximum number of tasks that are run concurrently
+    """
+    array_dir = get_array_dir(array_id)
+    script_file = os.path.join(array_dir, ARRAY_SCRIPT_FILE)
+    table_file = os.path.join(array_dir, ARRAY_TABLE_FILE)
+    if not os.path.isfile(script_file):
+        raise ValueError('unknown job array \'' + array_id + '\'')
+    with open(table_file, 'rb') as f:
+        _, rows, _ = TABLE_HEADER.unpack(f.read(TABLE_HEADER.size))
+    scheduler = None
+    with open(script_file, 'r') as f:
+        for line in f:
+            if line.startswith(SCHEDULER_PREFIX):
+                scheduler = line[len(SCHEDULER_PREFIX):].strip()
+    if not scheduler in SCHEDULERS:
+        raise ValueError('unknown scheduler for job array \'' + array_id + '\'')
+    _, task_var, first = SCHEDULERS[scheduler]
+    def run_task(index):
+        env = dict(os.environ)
+        env[task_var] = str(first + index)
+        return index, subprocess.call(['sh', script_file], env=env)
+    pool = ThreadPool(max(1, min(jobs, rows)))
+    try:
+        for index, exit_code in pool.imap_unordered(run_task, range(rows)):
+            print 'task ' + str(index) + ': ' + str(exit_code)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def write_array(cmds, scheduler):
+    """Write job script and parameter table for a job array that runs the
+    given commands. Returns the unique identifier of the new job array.
+    Tasks run the exprepo module with the current Python interpreter, so the
+    script does not depend on how the program was called or on the PATH of
+    the compute nodes.
+
+    Raises ValueError if the scheduler is unknown or if no commands are
+    given.
+
+    Parameters
+    ----------
+    cmds: list(list(string))
+        Command line components for each task
+    scheduler: string
+        Name of the batch scheduler
+
+    Returns
+    -------
+    string
+    """
+    if not scheduler in SCHEDULERS:
+        raise ValueError('unknown scheduler \'' + scheduler + '\'')
+    if len(cmds) == 0:
+        raise ValueError('no commands for job array')
+    directive, task_var, first = SCHEDULERS[scheduler]
+    array_id = uuid.uuid4().hex[:16]
+    array_dir = get_array_dir(array_id)
+    os.makedirs(array_dir)
+    # Write the parameter table. All rows are padded to the same width.
+    rows = [json.dumps(cmd, separators=(',', ':')) for cmd in cmds]
+    width = max([len(row) for row in rows]) + 1
+    table_file = os.path.abspath(os.path.join(array_dir, ARRAY_TABLE_FILE))
+    with open(table_file, 'wb') as f:
+        f.write(TABLE_HEADER.pack(TABLE_MAGIC, len(rows), width))
+        for row in rows:
+            f.write(row.ljust(width - 1) + '\n')
+    # Write the job script. A comment line identifies the scheduler.
+    with open(os.path.join(array_dir, ARRAY_SCRIPT_FILE), 'w') as f:
+        f.write('#!/bin/sh\n')
+        f.write(SCHEDULER_PREFIX + ' ' + scheduler + '\n')
+        f.write(directive.format(first=first, last=first + len(rows) - 1) + '\n')
+        f.write('cd ' + pipes.quote(os.getcwd()) + '\n')
+        f.write(
+            'exec ' + pipes.quote(sys.executable) + ' -m exprepo ' +
+            exp.CMD_TASK + ' ' +
+            pipes.quote(table_file) +
+            ' $((' + task_var + ' - ' + str(first) + '))\n'
+        )
+    return array_id
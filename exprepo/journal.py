@@ -0,0 +1,230 @@
+"""Everything related to the journal of parameter sweeps.
+
+Every parameter sweep with more than one point, and every run that may be
+resumed, writes a journal that records the state of each point of the sweep.
+A point is planned when the sweep starts, running while its command is
+executed, and done or failed after the run has been added to the log. The
+journal is a file in JSON lines format. Each line contains the command line
+components of a point and its new state. The last line for a point
+determines its state.
+
+Sweeps are identified by the command name and the command lines of all
+points. Running the same sweep again with the resume flag skips all points
+that are done according to the journal. The journal is removed once all
+points are done. Processes that run the same sweep serialize their access to
+the journal with an exclusive lock on the journal file.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+
+import exprepo as exp
+
+
+# ------------------------------------------------------------------------------
+# Constants
+# ------------------------------------------------------------------------------
+
+"""States of points in a sweep."""
+STATE_DONE = 'done'
+STATE_FAILED = 'failed'
+STATE_PLANNED = 'planned'
+STATE_RUNNING = 'running'
+
+
+# ------------------------------------------------------------------------------
+# Classes
+# ------------------------------------------------------------------------------
+
+class SweepJournal(object):
+    """Journal of a parameter sweep. Updates are thread-safe. Updates that
+    complete a point are synced to disk.
+    """
+    def __init__(self, name, points):
+        """Initialize the journal for the sweep of the given command.
+
+        Parameters
+        ----------
+        name: string
+            Name of the command
+        points: list((list(string), dict))
+            Command line components and parameter values for each point
+        """
+        self.sweep_id = get_sweep_id(name, points)
+        self.filename = os.path.join(exp.REPO_DIR, exp.SWEEP_DIR, self.sweep_id)
+        self.points = points
+        self.lock = threading.Lock()
+        self.f = None
+        self.done = set()
+
+    def close(self):
+        """Close the journal file. The journal is removed if all points of
+        the sweep are done.
+        """
+        if self.f is None:
+            return
+        with self.lock:
+            fcntl.flock(self.f.fileno(), fcntl.LOCK_EX)
+            try:
+                if all(tuple(cmd) in self.done for cmd, _ in self.points):
+                    if is_current(self.f, self.filename):
+                        os.remove(self.filename)
+            finally:
+                fcntl.flock(self.f.fileno(), fcntl.LOCK_UN)
+                self.f.close()
+                self.f = None
+
+    def open(self, resume=False):
+        """Open the journal for writing. Returns the set of points that are
+        done according to an existing journal if the resume flag is True.
+        Otherwise, the existing journal is replaced. Points are identified
+        by the tuple of their command line components.
+
+        Parameters
+        ----------
+        resume: bool, optional
+            Continue an existing journal
+
+        Returns
+        -------
+        set(tuple)
+        """
+        journal_dir = os.path.dirname(self.filename)
+        if not os.path.isdir(journal_dir):
+            os.makedirs(journal_dir)
+        with self.lock:
+            while True:
+                self.f = open(self.filename, 'a')
+                fcntl.flock(self.f.fileno(), fcntl.LOCK_EX)
+                if is_current(self.f, self.filename):
+                    break
+                # The journal was removed by a process that completed the
+                # sweep before the lock was acquired
+                self.f.close()
+            try:
+                if resume:
+                    self.done = set(
+                        key for key, state in read_journal(self.filename).items()
+                            if state == STATE_DONE
+                    )
+                else:
+                    self.f.truncate(0)
+                if os.fstat(self.f.fileno()).st_size == 0:
+                    for cmd, _ in self.points:
+                        self.write(cmd, STATE_PLANNED)
+                    self.f.flush()
+            finally:
+                fcntl.flock(self.f.fileno(), fcntl.LOCK_UN)
+        return set(self.done)
+
+    def update(self, cmd, state, run_id=None):
+        """Record the new state of the point with the given command line.
+
+        Parameters
+        ----------
+        cmd: list(string)
+            Command line components
+        state: string
+            New state of the point
+        run_id: string, optional
+            Identifier of the run for the point
+        """
+        with self.lock:
+            if state == STATE_DONE:
+                self.done.add(tuple(cmd))
+            fcntl.flock(self.f.fileno(), fcntl.LOCK_EX)
+            try:
+                self.write(cmd, state, run_id=run_id)
+                self.f.flush()
+                if state in [STATE_DONE, STATE_FAILED]:
+                    os.fsync(self.f.fileno())
+            finally:
+                fcntl.flock(self.f.fileno(), fcntl.LOCK_UN)
+
+    def write(self, cmd, state, run_id=None):
+        """Write a journal line. Expects the caller to hold the lock and the
+        lock on the journal file.
+
+        Parameters
+        ----------
+        cmd: list(string)
+            Command line components
+        state: string
+            New state of the point
+        run_id: string, optional
+            Identifier of the run for the point
+        """
+        line = {'args': cmd, 'state': state, 'time': time.time()}
+        if not run_id is None:
+            line['id'] = run_id
+        self.f.write(json.dumps(line, separators=(',', ':')) + '\n')
+
+
+# ------------------------------------------------------------------------------
+# Helper Methods
+# ------------------------------------------------------------------------------
+
+def get_sweep_id(name, points):
+    """Get the identifier of the sweep of the given command.
+
+    Parameters
+    ----------
+    name: string
+        Name of the command
+    points: list((list(string), dict))
+        Command line components and parameter values for each point
+
+    Returns
+    -------
+    string
+    """
+    sweep = json.dumps([name.lower(), [cmd for cmd, _ in points]])
+    return hashlib.sha1(sweep).hexdigest()[:16]
+
+
+def is_current(f, filename):
+    """Test if the given open file is the file at the given path.
+
+    Parameters
+    ----------
+    f: file
+        Open file
+    filename: string
+        Path to the file
+
+    Returns
+    -------
+    bool
+    """
+    try:
+        return os.stat(filename).st_ino == os.fstat(f.fileno()).st_ino
+    except OSError:
+        return False
+
+
+def read_journal(filename):
+    """Read the state of each point from the given journal. Lines that were
+    only partially written are ignored.
+
+    Parameters
+    ----------
+    filename: string
+        Path to the journal file
+
+    Returns
+    -------
+    dict
+    """
+    states = dict()
+    with open(filename, 'r') as f:
+        for line in f:
+            try:
+                obj = json.loads(line)
+            except ValueError:
+                continue
+            states[tuple(obj['args'])] = obj['state']
+    return states
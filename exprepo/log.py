@@ -0,0 +1,901 @@
+"""Everything related to the execution log.
+
+The log is an append-only file in JSON lines format. Each line contains one
+log entry for a command that was run or submitted. The log is accompanied by
+an index file of fixed-size records containing the file offset and log time
+of every entry. The index allows to access entries by position and to find
+entries within a time range without scanning the whole log.
+
+Readers hold a shared lock on the log and do not need write access to it.
+Records for entries that are missing from the index are only written if the
+log is writable; otherwise they are kept in memory.
+"""
+
+import bisect
+from contextlib import contextmanager
+import fcntl
+import gzip
+import json
+import mmap
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+import uuid
+
+import exprepo as exp
+from exprepo.execute import read_samples
+from exprepo.placement import format_cpu_list
+from exprepo.runqueue import format_memory
+from exprepo.timing import timed
+
+
+# ------------------------------------------------------------------------------
+# Constants
+# ------------------------------------------------------------------------------
+
+"""Suffix for the log index file."""
+LOG_INDEX_SUFFIX = '.idx'
+
+"""Suffix for the backup of a log file in the original flat format."""
+LOG_BACKUP_SUFFIX = '.flat'
+
+"""Index records contain the file offset and the log time of an entry."""
+INDEX_RECORD = struct.Struct('<Qd')
+
+"""Status values for log entries."""
+STATUS_FAILED = 'failed'
+STATUS_SUBMITTED = 'submitted'
+STATUS_SUCCESS = 'success'
+STATUS_VALUES = [STATUS_FAILED, STATUS_SUBMITTED, STATUS_SUCCESS]
+
+"""Name of the file in a run directory that contains the resource usage
+samples."""
+SAMPLES_FILE = 'samples'
+
+"""Names of the files in a run directory that contain the captured standard
+output and standard error."""
+STDERR_FILE = 'stderr.gz'
+STDOUT_FILE = 'stdout.gz'
+
+"""Number of bytes that are decompressed at a time when output is shown."""
+OUTPUT_CHUNK_SIZE = 65536
+
+"""Resource usage values by which log entries can be sorted."""
+SORT_KEYS = {
+    'cpu': lambda e: e['usage']['cpu_user'] + e['usage']['cpu_system'],
+    'duration': lambda e: e['duration'],
+    'read': lambda e: e['usage']['read_bytes'],
+    'rss': lambda e: e['usage']['max_rss'] or 0,
+    'wait': lambda e: e['queue_wait'],
+    'write': lambda e: e['usage']['write_bytes']
+}
+
+"""Accepted formats for time arguments."""
+TIME_FORMATS = ['%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d']
+
+
+# ------------------------------------------------------------------------------
+# Classes
+# ------------------------------------------------------------------------------
+
+class LogIndex(object):
+    """Read-only view on the log index. Provides access to the file offset and
+    log time of entries by their position in the log. Records that are not
+    contained in the index file follow the records of the file.
+    """
+    def __init__(self, filename, tail=None):
+        """Memory-map the given index file. The index is empty if the file
+        does not exist.
+
+        Parameters
+        ----------
+        filename: string
+            Path to the index file
+        tail: list((int, float)), optional
+            File offset and log time of entries that follow the entries in
+            the index file
+        """
+        self.buf = None
+        self.size = 0
+        self.tail = tail if not tail is None else list()
+        if os.path.isfile(filename):
+            with open(filename, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                self.size = size // INDEX_RECORD.size
+                if self.size > 0:
+                    self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return self.size + len(self.tail)
+
+    def close(self):
+        """Release the memory map of the index file."""
+        if not self.buf is None:
+            self.buf.close()
+            self.buf = None
+
+    def offset(self, pos):
+        """Get file offset of the entry at the given position.
+
+        Parameters
+        ----------
+        pos: int
+            Entry position
+
+        Returns
+        -------
+        int
+        """
+        if pos >= self.size:
+            return self.tail[pos - self.size][0]
+        return INDEX_RECORD.unpack_from(self.buf, pos * INDEX_RECORD.size)[0]
+
+    def search(self, timestamp):
+        """Get position of the first entry that was logged at or after the
+        given time.
+
+        Parameters
+        ----------
+        timestamp: float
+            Log time
+
+        Returns
+        -------
+        int
+        """
+        return bisect.bisect_left(TimeSequence(self), timestamp)
+
+    def time(self, pos):
+        """Get log time of the entry at the given position.
+
+        Parameters
+        ----------
+        pos: int
+            Entry position
+
+        Returns
+        -------
+        float
+        """
+        if pos >= self.size:
+            return self.tail[pos - self.size][1]
+        return INDEX_RECORD.unpack_from(self.buf, pos * INDEX_RECORD.size)[1]
+
+
+class LogWriter(object):
+    """Group-committing writer for the log. Threads that complete runs
+    concurrently hand their entries to the writer. The first waiting thread
+    becomes the leader and appends all pending entries in a single locked and
+    synced write while the other threads wait for the batch that contains
+    their entries to be committed.
+    """
+    def __init__(self, filename=None):
+        """Initialize the writer for the given log file.
+
+        Parameters
+        ----------
+        filename: string, optional
+            Path to the log file. Uses the log of the current repository by
+            default.
+        """
+        self.filename = filename if not filename is None else get_log_file()
+        self.cond = threading.Condition()
+        self.pending = list()
+        # Number of the batch that collects new entries and number of the
+        # last batch that was written
+        self.batch = 1
+        self.committed = 0
+        self.writing = False
+        # Exceptions raised when writing a batch keyed by the batch number
+        self.errors = dict()
+
+    def append(self, entries):
+        """Append the given entries to the log. Blocks until the entries have
+        been written. Raises the exception of a failed write.
+
+        Parameters
+        ----------
+        entries: list(dict)
+            Log entries
+        """
+        with self.cond:
+            self.pending.extend(entries)
+            batch = self.batch
+            while self.committed < batch:
+                if self.writing:
+                    self.cond.wait()
+                    continue
+                # Become the leader for all entries that are pending
+                pending = self.pending
+                self.pending = list()
+                self.batch += 1
+                self.writing = True
+                self.cond.release()
+                try:
+                    append_entries(pending, filename=self.filename)
+                except Exception as ex:
+                    error = ex
+                else:
+                    error = None
+                finally:
+                    self.cond.acquire()
+                if not error is None:
+                    self.errors[batch] = error
+                self.committed = batch
+                self.writing = False
+                self.cond.notify_all()
+            if batch in self.errors:
+                raise self.errors[batch]
+
+
+class TimeSequence(object):
+    """Sequence view on the log times in a log index for binary search."""
+    def __init__(self, index):
+        self.index = index
+
+    def __getitem__(self, pos):
+        return self.index.time(pos)
+
+    def __len__(self):
+        return len(self.index)
+
+
+# ------------------------------------------------------------------------------
+# API Methods
+# ------------------------------------------------------------------------------
+
+@timed('log')
+def append_entries(entries, filename=None):
+    """Append the given entries to the log. Sets the log time of each entry.
+    The log file is locked while entries are written to ensure that log and
+    index remain consistent. Log and index are synced to disk before the lock
+    is released.
+
+    Parameters
+    ----------
+    entries: list(dict)
+        Log entries
+    filename: string, optional
+        Path to the log file. Uses the log of the current repository by
+        default.
+    """
+    if filename is None:
+        filename = get_log_file()
+    with locked_log(filename) as f:
+        update_index(filename)
+        f.seek(0, os.SEEK_END)
+        if f.tell() > 0 and not ends_with_newline(filename):
+            # Terminate an entry that was only partially written
+            f.write('\n')
+        records = []
+        for entry in entries:
+            entry['time'] = time.time()
+            records.append(INDEX_RECORD.pack(f.tell(), entry['time']))
+            f.write(json.dumps(entry, separators=(',', ':')) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+        with open(get_index_file(filename), 'ab') as f_index:
+            f_index.write(''.join(records))
+            f_index.flush()
+            os.fsync(f_index.fileno())
+
+
+def find_entry(run_id):
+    """Get the most recent log entry whose identifier starts with the given
+    value.
+
+    Raises ValueError if no matching entry exists.
+
+    Parameters
+    ----------
+    run_id: string
+        Unique run identifier (or a prefix of it)
+
+    Returns
+    -------
+    dict
+    """
+    filename = get_log_file()
+    if os.path.isfile(filename):
+        index = open_index(filename)
+        try:
+            with open(filename, 'rb') as f:
+                for pos in range(len(index) - 1, -1, -1):
+                    f.seek(index.offset(pos))
+                    entry = json.loads(f.readline())
+                    if entry['id'].startswith(run_id):
+                        return entry
+        finally:
+            index.close()
+    raise ValueError('unknown run \'' + run_id + '\'')
+
+
+def format_entry(entry, usage=False):
+    """Get a single line representation of a log entry. If the usage flag is
+    True the line includes the resource usage of the run.
+
+    Parameters
+    ----------
+    entry: dict
+        Log entry
+    usage: bool, optional
+        Include resource usage
+
+    Returns
+    -------
+    string
+    """
+    line = [
+        time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['time'])),
+        entry['id'],
+        entry['status']
+    ]
+    if not entry.get('exit_code') is None:
+        line.append(str(entry['exit_code']))
+    if not entry.get('duration') is None:
+        line.append('%.2fs' % entry['duration'])
+    if entry.get('timed_out'):
+        line.append('timeout')
+    if entry.get('stopped'):
+        line.append('stopped')
+    if usage and 'usage' in entry:
+        values = entry['usage']
+        line.append('cpu=%.2fs' % (values['cpu_user'] + values['cpu_system']))
+        if not values['max_rss'] is None:
+            line.append('rss=' + format_memory(values['max_rss']))
+        else:
+            line.append('rss=-')
+        line.append('read=' + format_memory(values['read_bytes']))
+        line.append('write=' + format_memory(values['write_bytes']))
+    if usage and 'queue_wait' in entry:
+        line.append('wait=%.2fs' % entry['queue_wait'])
+    if usage and not entry.get('placement', dict()).get('cpus') is None:
+        line.append('cpus=' + format_cpu_list(entry['placement']['cpus']))
+    line.append(' '.join(entry['args']))
+    return '  '.join(line)
+
+
+def get_index_file(filename):
+    """Get name of the index file for the given log file.
+
+    Parameters
+    ----------
+    filename: string
+        Path to the log file
+
+    Returns
+    -------
+    string
+    """
+    return filename + LOG_INDEX_SUFFIX
+
+
+def get_log_file():
+    """Get name of the repository file that stores the command execution log.
+
+    Returns
+    -------
+    string
+    """
+    return os.path.join(exp.REPO_DIR, exp.LOG_FILE)
+
+
+def get_run_dir(run_id):
+    """Get the directory for files that belong to the run with the given
+    identifier.
+
+    Parameters
+    ----------
+    run_id: string
+        Unique run identifier
+
+    Returns
+    -------
+    string
+    """
+    return os.path.join(exp.REPO_DIR, exp.RUN_DIR, run_id)
+
+
+def new_entry(command, args, params=None, status=STATUS_SUCCESS, exit_code=None, duration=None, run_id=None):
+    """Create a new log entry with a unique identifier. The log time is set
+    when the entry is appended to the log.
+
+    Parameters
+    ----------
+    command: string
+        Name of the registered command
+    args: list(string)
+        Command line components
+    params: dict, optional
+        Values of the command parameters
+    status: string, optional
+        Run status
+    exit_code: int, optional
+        Exit code of the command
+    duration: float, optional
+        Run time in seconds
+    run_id: string, optional
+        Unique run identifier. A new identifier is created by default.
+
+    Returns
+    -------
+    dict
+    """
+    return {
+        'id': run_id if not run_id is None else new_run_id(),
+        'command': command,
+        'args': args,
+        'params': params if not params is None else dict(),
+        'status': status,
+        'exit_code': exit_code,
+        'duration': duration,
+        'cwd': os.getcwd(),
+        'host': socket.gethostname()
+    }
+
+
+def new_run_id():
+    """Create a new unique run identifier.
+
+    Returns
+    -------
+    string
+    """
+    return uuid.uuid4().hex[:16]
+
+
+def open_index(filename):
+    """Open the index of the given log file. The log file is read while
+    holding a shared lock. Records for entries that are missing from the
+    index are added to the index file if the log is writable (see
+    sync_index). Otherwise, they are read from the log and kept in memory.
+
+    Parameters
+    ----------
+    filename: string
+        Path to the log file
+
+    Returns
+    -------
+    LogIndex
+    """
+    index_file = get_index_file(filename)
+    with shared_log(filename):
+        index = LogIndex(index_file)
+        tail = read_records(filename, index)
+        if (len(tail) == 0 and os.path.isfile(index_file)) or not is_writable(filename):
+            index.tail = tail
+            return index
+        index.close()
+    sync_index(filename)
+    with shared_log(filename):
+        index = LogIndex(index_file)
+        index.tail = read_records(filename, index)
+        return index
+
+
+def parse_time(value):
+    """Parse a time argument. Accepts seconds since the epoch or a local date
+    with optional time of day.
+
+    Raises ValueError if the value is not a valid time.
+
+    Parameters
+    ----------
+    value: string
+        Time argument
+
+    Returns
+    -------
+    float
+    """
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    for fmt in TIME_FORMATS:
+        try:
+            return time.mktime(time.strptime(value, fmt))
+        except ValueError:
+            pass
+    raise ValueError('invalid time \'' + value + '\'')
+
+
+def print_log(tail=None, skip=0, since=None, until=None, command=None, status=None, params=None, sort=None, usage=False):
+    """Print the log of experiment commands to standard output. See
+    read_entries for a description of the filter arguments. Entries are
+    printed in the order in which they were logged unless a sort key is
+    given. Sorted entries are printed in descending order of the resource
+    usage value. Entries without the value are printed last.
+
+    Raises ValueError if the sort key is unknown.
+
+    Parameters
+    ----------
+    sort: string, optional
+        Name of a resource usage value (see SORT_KEYS)
+    usage: bool, optional
+        Print the resource usage of each run
+    """
+    if not sort is None and not sort in SORT_KEYS:
+        raise ValueError('invalid sort key \'' + sort + '\'')
+    entries = read_entries(
+        tail=tail,
+        skip=skip,
+        since=since,
+        until=until,
+        command=command,
+        status=status,
+        params=params
+    )
+    if not sort is None:
+        def sort_key(entry):
+            try:
+                return (0, -SORT_KEYS[sort](entry))
+            except (KeyError, TypeError):
+                return (1, 0)
+        entries.sort(key=sort_key)
+    for entry in entries:
+        print format_entry(entry, usage=usage)
+
+
+def print_output(run_id, stderr=False):
+    """Print the captured standard output (or standard error) of a run. The
+    output is decompressed in chunks while it is written.
+
+    Raises ValueError if the run is unknown or its output was not captured.
+
+    Parameters
+    ----------
+    run_id: string
+        Unique run identifier (or a prefix of it)
+    stderr: bool, optional
+        Print the standard error instead of the standard output
+    """
+    entry = find_entry(run_id)
+    filename = os.path.join(
+        get_run_dir(entry['id']),
+        STDERR_FILE if stderr else STDOUT_FILE
+    )
+    if not 'output' in entry or not os.path.isfile(filename):
+        raise ValueError('no captured output for run \'' + entry['id'] + '\'')
+    f = gzip.open(filename, 'rb')
+    try:
+        while True:
+            data = f.read(OUTPUT_CHUNK_SIZE)
+            if data == '':
+                break
+            sys.stdout.write(data)
+    finally:
+        f.close()
+    sys.stdout.flush()
+
+
+def print_samples(run_id):
+    """Print the resource usage samples of a run. Each line contains the time
+    since the start of the run, CPU utilization, resident set size, and the
+    number of bytes read and written by the process tree.
+
+    Raises ValueError if the run is unknown or was not sampled.
+
+    Parameters
+    ----------
+    run_id: string
+        Unique run identifier (or a prefix of it)
+    """
+    entry = find_entry(run_id)
+    filename = os.path.join(get_run_dir(entry['id']), SAMPLES_FILE)
+    if not os.path.isfile(filename):
+        raise ValueError('no samples for run \'' + entry['id'] + '\'')
+    print format_entry(entry, usage=True) + '\n'
+    for elapsed, cpu, rss, read_bytes, write_bytes in read_samples(filename):
+        print '  '.join([
+            '%8.2fs' % elapsed,
+            'cpu=%.1f%%' % cpu,
+            'rss=' + format_memory(rss),
+            'read=' + format_memory(read_bytes),
+            'write=' + format_memory(write_bytes)
+        ])
+
+
+def read_entries(tail=None, skip=0, since=None, until=None, command=None, status=None, params=None, filename=None):
+    """Get log entries that satisfy all of the given filters in the order in
+    which they were logged. The time range is located using the log index.
+    If tail is given only the last matching entries are read, starting from
+    the end of the log.
+
+    Parameters
+    ----------
+    tail: int, optional
+        Only return the given number of most recent matching entries
+    skip: int, optional
+        Number of most recent matching entries to skip (for pagination)
+    since: float, optional
+        Only return entries that were logged at or after this time
+    until: float, optional
+        Only return entries that were logged before this time
+    command: string, optional
+        Only return entries for the given command
+    status: string, optional
+        Only return entries with the given status
+    params: dict, optional
+        Only return entries with the given parameter values
+    filename: string, optional
+        Path to the log file. Uses the log of the current repository by
+        default.
+
+    Returns
+    -------
+    list(dict)
+    """
+    if filename is None:
+        filename = get_log_file()
+    if not os.path.isfile(filename):
+        return list()
+    if not status is None and not status in STATUS_VALUES:
+        raise ValueError('invalid status \'' + status + '\'')
+    def matches(entry):
+        if not command is None and entry['command'] != command:
+            return False
+        if not status is None and entry['status'] != status:
+            return False
+        if not params is None:
+            for key in params:
+                if entry['params'].get(key) != params[key]:
+                    return False
+        return True
+    index = open_index(filename)
+    try:
+        start = index.search(since) if not since is None else 0
+        end = index.search(until) if not until is None else len(index)
+        result = list()
+        with open(filename, 'rb') as f:
+            if tail is None and skip == 0:
+                # Read all entries in the time range sequentially
+                for pos in range(start, end):
+                    # Entries are contiguous unless a corrupted entry was
+                    # skipped by the index
+                    offset = index.offset(pos)
+                    if f.tell() != offset:
+                        f.seek(offset)
+                    entry = json.loads(f.readline())
+                    if matches(entry):
+                        result.append(entry)
+            else:
+                # Read entries backwards until enough matches are found
+                for pos in range(end - 1, start - 1, -1):
+                    if not tail is None and len(result) == skip + tail:
+                        break
+                    f.seek(index.offset(pos))
+                    entry = json.loads(f.readline())
+                    if matches(entry):
+                        result.append(entry)
+                result = result[skip:]
+                result.reverse()
+        return result
+    finally:
+        index.close()
+
+
+def sync_index(filename):
+    """Ensure that the index contains records for all entries in the given
+    log file. The log file is locked while the index is updated (see
+    update_index).
+
+    Parameters
+    ----------
+    filename: string
+        Path to the log file
+    """
+    with locked_log(filename):
+        update_index(filename)
+
+
+def update_index(filename):
+    """Ensure that the index contains records for all entries in the given
+    log file. Records for entries that are missing from the index (e.g., due
+    to an interrupted write) are appended. The index is rebuilt if it does
+    not exist. Expects the log file to be locked by the caller (see
+    locked_log).
+
+    Parameters
+    ----------
+    filename: string
+        Path to the log file
+    """
+    index_file = get_index_file(filename)
+    index = LogIndex(index_file)
+    try:
+        count = len(index)
+        records = [INDEX_RECORD.pack(*r) for r in read_records(filename, index)]
+    finally:
+        index.close()
+    if count > 0 and len(records) > 0:
+        with open(index_file, 'ab') as f:
+            f.write(''.join(records))
+    elif count == 0:
+        # Replace the index atomically so that readers never map a
+        # truncated index
+        tmp_file = index_file + '.' + uuid.uuid4().hex
+        with open(tmp_file, 'wb') as f:
+            f.write(''.join(records))
+        os.rename(tmp_file, index_file)
+
+
+# ------------------------------------------------------------------------------
+# Helper Methods
+# ------------------------------------------------------------------------------
+
+def ends_with_newline(filename):
+    """Test whether the given non-empty file ends with a newline character.
+
+    Parameters
+    ----------
+    filename: string
+        Path to the file
+
+    Returns
+    -------
+    bool
+    """
+    with open(filename, 'rb') as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == '\n'
+
+
+def is_writable(filename):
+    """Test whether the current user can write the given log file and create
+    files in its directory.
+
+    Parameters
+    ----------
+    filename: string
+        Path to the log file
+
+    Returns
+    -------
+    bool
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    return os.access(filename, os.W_OK) and os.access(directory, os.W_OK)
+
+
+@contextmanager
+def locked_log(filename):
+    """Context manager that holds an exclusive lock on the given log file.
+    Yields the log file opened for appending. The file is opened again if it
+    was replaced while waiting for the lock. A log in the original flat
+    format is migrated once the lock is held.
+
+    Parameters
+    ----------
+    filename: string
+        Path to the log file
+    """
+    while True:
+        f = open(filename, 'ab')
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            if os.fstat(f.fileno()).st_ino == os.stat(filename).st_ino:
+                # The migration replaces the locked file
+                if os.path.isfile(get_index_file(filename)) or not migrate_log(filename):
+                    break
+        except OSError:
+            pass
+        f.close()
+    try:
+        yield f
+    finally:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        f.close()
+
+
+def migrate_log(filename):
+    """Convert a log file in the original flat format that contains one
+    command line per line into the current format. Entries of submitted
+    commands are prefixed by '*' in the flat format. The log time of all
+    migrated entries is the modification time of the original file. The
+    original file is kept as backup. Returns True if the log was migrated.
+
+    Parameters
+    ----------
+    filename: string
+        Path to the log file
+
+    Returns
+    -------
+    bool
+    """
+    if not os.path.isfile(filename):
+        return False
+    with open(filename, 'rb') as f:
+        line = f.readline()
+    if line == '' or line.startswith('{'):
+        return False
+    mtime = os.stat(filename).st_mtime
+    tmp_file = filename + '.' + str(os.getpid())
+    with open(filename, 'rb') as f_in:
+        with open(tmp_file, 'wb') as f_out:
+            for line in f_in:
+                line = line.strip()
+                if line == '':
+                    continue
+                if line.startswith('*'):
+                    entry = new_entry(None, line[1:].split(), status=STATUS_SUBMITTED)
+                else:
+                    entry = new_entry(None, line.split(), exit_code=0)
+                entry['cwd'] = None
+                entry['host'] = None
+                entry['time'] = mtime
+                f_out.write(json.dumps(entry, separators=(',', ':')) + '\n')
+    os.rename(filename, filename + LOG_BACKUP_SUFFIX)
+    os.rename(tmp_file, filename)
+    return True
+
+
+def read_records(filename, index):
+    """Read the file offset and log time of all entries in the given log
+    file that follow the last entry in the index. Partially written entries
+    at the end of the log and corrupted entries are ignored.
+
+    Parameters
+    ----------
+    filename: string
+        Path to the log file
+    index: LogIndex
+        Index of the log file
+
+    Returns
+    -------
+    list((int, float))
+    """
+    count = len(index)
+    offset = index.offset(count - 1) if count > 0 else 0
+    records = []
+    with open(filename, 'rb') as f:
+        f.seek(offset)
+        if count > 0:
+            # Skip the last indexed entry
+            f.readline()
+        while True:
+            pos = f.tell()
+            line = f.readline()
+            if not line.endswith('\n'):
+                # Ignore partially written entries
+                break
+            try:
+                records.append((pos, json.loads(line)['time']))
+            except ValueError:
+                # Skip entries that were corrupted by an interrupted write
+                pass
+    return records
+
+
+@contextmanager
+def shared_log(filename):
+    """Context manager that holds a shared lock on the given log file while
+    entries are read. Writers hold an exclusive lock (see locked_log). The
+    file is opened again if it was replaced while waiting for the lock.
+
+    Parameters
+    ----------
+    filename: string
+        Path to the log file
+    """
+    while True:
+        f = open(filename, 'rb')
+        fcntl.flock(f.fileno(), fcntl.LOCK_SH)
+        try:
+            if os.fstat(f.fileno()).st_ino == os.stat(filename).st_ino:
+                break
+        except OSError:
+            pass
+        f.close()
+    try:
+        yield f
+    finally:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        f.close()
@@ -0,0 +1,351 @@
+"""Everything related to running pipelines of registered commands.
+
+A pipeline is formed by registered commands that declare input and output
+files. A command depends on the commands that write its input files. Commands
+are run once all the commands they depend on have completed. Independent
+commands are run concurrently. Commands whose output files are newer than
+their input files are not run again.
+"""
+
+from multiprocessing.pool import ThreadPool
+import os
+import Queue
+
+from exprepo.command import CommandTemplate, expand_arguments, get_registry_entries
+from exprepo.command import log_results, resolve_files, run_process
+from exprepo.command import CmdElement
+from exprepo.fingerprint import get_digests
+from exprepo.settings import get_settings, get_global_variables
+
+
+# ------------------------------------------------------------------------------
+# Constants
+# ------------------------------------------------------------------------------
+
+"""States of pipeline stages."""
+STAGE_FAILED = 'failed'
+STAGE_PENDING = 'pending'
+STAGE_SKIPPED = 'skipped'
+STAGE_SUCCESS = 'success'
+STAGE_UP_TO_DATE = 'up-to-date'
+
+"""Seconds between checks for completed stages. Waiting with a timeout keeps
+the main thread responsive to keyboard interrupts."""
+WAIT_INTERVAL = 1.0
+
+
+# ------------------------------------------------------------------------------
+# Classes
+# ------------------------------------------------------------------------------
+
+class Stage(object):
+    """A registered command in a pipeline with its resolved command line
+    components and declared files.
+    """
+    def __init__(self, name, cmd, params, inputs, outputs):
+        """Initialize the stage.
+
+        Parameters
+        ----------
+        name: string
+            Command name
+        cmd: list(string)
+            Command line components
+        params: dict
+            Values of the command parameters
+        inputs: list(string)
+            Absolute paths of input files
+        outputs: list(string)
+            Absolute paths of output files
+        """
+        self.name = name
+        self.cmd = cmd
+        self.params = params
+        self.inputs = inputs
+        self.outputs = outputs
+        self.upstream = set()
+        self.downstream = set()
+        self.state = STAGE_PENDING
+
+    def is_up_to_date(self):
+        """Test whether all output files of the stage exist and are not older
+        than any of the input files. Stages without output files are never up
+        to date.
+
+        Returns
+        -------
+        bool
+        """
+        if len(self.outputs) == 0:
+            return False
+        for filename in self.outputs:
+            if not os.path.exists(filename):
+                return False
+        output_time = min([os.stat(f).st_mtime for f in self.outputs])
+        for filename in self.inputs:
+            if not os.path.exists(filename):
+                return False
+            if os.stat(filename).st_mtime > output_time:
+                return False
+        return True
+
+
+# ------------------------------------------------------------------------------
+# API Methods
+# ------------------------------------------------------------------------------
+
+def get_pipeline(names, args):
+    """Get the stages of the pipeline that produces the outputs of the given
+    commands. The pipeline contains the given commands and all commands that
+    they depend on. If no names are given, all registered commands that
+    declare input or output files are included. Stages are returned in
+    topological order.
+
+    Raises ValueError if a command is unknown, if a file is written by more
+    than one command, if an input file is neither written by another command
+    nor exists, or if the pipeline contains a cycle.
+
+    Parameters
+    ----------
+    names: list(string)
+        Names of the target commands
+    args: list(string)
+        Arguments that override the current configuration settings (expected
+        format is <key>=<value>)
+
+    Returns
+    -------
+    list(Stage)
+    """
+    overrides = expand_arguments(args)
+    if len(overrides) != 1:
+        raise ValueError('parameter sweeps are not supported for pipelines')
+    entries = get_registry_entries()
+    names = [name.lower() for name in names]
+    for name in names:
+        if not name in entries:
+            raise ValueError('unknown command \'' + name + '\'')
+    config = get_settings().overlay(overrides[0])
+    variables = get_global_variables()
+    # Resolve all commands that declare files. Errors are only raised for
+    # commands that are part of the pipeline.
+    stages = dict()
+    errors = dict()
+    for name in entries:
+        entry = entries[name]
+        inputs = entry.get('inputs', list())
+        outputs = entry.get('outputs', list())
+        if not name in names and len(inputs) == 0 and len(outputs) == 0:
+            continue
+        try:
+            spec = [CmdElement.from_dict(obj) for obj in entry['spec']]
+            cmd, params = CommandTemplate(spec).render(config, variables)
+            stages[name] = Stage(
+                name,
+                cmd,
+                params,
+                resolve_files(inputs, config, variables),
+                resolve_files(outputs, config, variables)
+            )
+        except ValueError as ex:
+            errors[name] = ex
+    producers = dict()
+    for name in sorted(stages):
+        for filename in stages[name].outputs:
+            if filename in producers:
+                raise ValueError(
+                    'file \'' + filename + '\' is written by \'' +
+                    producers[filename] + '\' and \'' + name + '\''
+                )
+            producers[filename] = name
+    # Collect the target stages and all stages they depend on
+    if len(names) == 0:
+        names = sorted(set(stages.keys()) | set(errors.keys()))
+    pipeline = dict()
+    queue = list(names)
+    while len(queue) > 0:
+        name = queue.pop()
+        if name in pipeline:
+            continue
+        if name in errors:
+            raise errors[name]
+        stage = stages[name]
+        pipeline[name] = stage
+        for filename in stage.inputs:
+            if filename in producers:
+                stage.upstream.add(producers[filename])
+                queue.append(producers[filename])
+            elif not os.path.exists(filename):
+                raise ValueError(
+                    'missing input \'' + filename + '\' for \'' + name + '\''
+                )
+    for name in pipeline:
+        for upstream in pipeline[name].upstream:
+            pipeline[upstream].downstream.add(name)
+    # Sort stages topologically
+    result = []
+    in_degree = dict([(name, len(pipeline[name].upstream)) for name in pipeline])
+    ready = sorted([name for name in in_degree if in_degree[name] == 0])
+    while len(ready) > 0:
+        name = ready.pop(0)
+        result.append(pipeline[name])
+        for downstream in sorted(pipeline[name].downstream):
+            in_degree[downstream] -= 1
+            if in_degree[downstream] == 0:
+                ready.append(downstream)
+    if len(result) != len(pipeline):
+        raise ValueError('pipeline contains a cycle')
+    return result
+
+
+def run_pipeline(prg_name, names, args, jobs=1):
+    """Run the pipeline that produces the outputs of the given commands (see
+    get_pipeline). Stages are run as soon as all stages they depend on have
+    completed, using a pool of at most jobs workers. Stages whose outputs are
+    up to date are not run unless a stage they depend on was run. If a stage
+    fails, all stages that depend on it are skipped. Runs are added to the
+    log.
+
+    Raises ValueError if the pipeline is invalid (see get_pipeline).
+
+    Parameters
+    ----------
+    prg_name: string
+        Name with which the program was called
+    names: list(string)
+        Names of the target commands
+    args: list(string)
+        Arguments that override the current configuration settings (expected
+        format is <key>=<value>)
+    jobs: int, optional
+        Maximum number of commands that are run concurrently
+    """
+    if jobs < 1:
+        raise ValueError('invalid number of jobs \'' + str(jobs) + '\'')
+    stages = get_pipeline(names, args)
+    pipeline = dict([(stage.name, stage) for stage in stages])
+    waiting = dict([(stage.name, len(stage.upstream)) for stage in stages])
+    rerun = set()
+    completed = Queue.Queue()
+    pool = ThreadPool(jobs)
+    try:
+        running = 0
+        ready = [stage.name for stage in stages if waiting[stage.name] == 0]
+        while len(ready) > 0 or running > 0:
+            # Start all stages that are ready. Stages that are up to date and
+            # do not depend on a stage that was run are completed immediately.
+            while len(ready) > 0:
+                stage = pipeline[ready.pop(0)]
+                if not stage.upstream & rerun and stage.is_up_to_date():
+                    print prg_name + ' (UP-TO-DATE): ' + stage.name
+                    stage.state = STAGE_UP_TO_DATE
+                    ready.extend(release(stage, pipeline, waiting))
+                else:
+                    pool.apply_async(run_stage, (prg_name, stage, completed))
+                    running += 1
+            if running == 0:
+                break
+            while True:
+                try:
+                    name, result = completed.get(True, WAIT_INTERVAL)
+                    break
+                except Queue.Empty:
+                    pass
+            running -= 1
+            stage = pipeline[name]
+            log_results(name, [result])
+            rerun.add(name)
+            if result[1]['exit_code'] == 0:
+                stage.state = STAGE_SUCCESS
+                ready.extend(release(stage, pipeline, waiting))
+            else:
+                stage.state = STAGE_FAILED
+                skip_downstream(prg_name, stage, pipeline)
+    finally:
+        pool.close()
+        pool.join()
+
+
+# ------------------------------------------------------------------------------
+# Helper Methods
+# ------------------------------------------------------------------------------
+
+def release(stage, pipeline, waiting):
+    """Mark the given stage as completed for all stages that depend on it.
+    Returns the names of stages that have no more pending dependencies.
+
+    Parameters
+    ----------
+    stage: Stage
+        Completed stage
+    pipeline: dict
+        Pipeline stages by name
+    waiting: dict
+        Number of pending dependencies by stage name
+
+    Returns
+    -------
+    list(string)
+    """
+    result = []
+    for name in sorted(stage.downstream):
+        waiting[name] -= 1
+        if waiting[name] == 0 and pipeline[name].state == STAGE_PENDING:
+            result.append(name)
+    return result
+
+
+def run_stage(prg_name, stage, completed):
+    """Run the command of a pipeline stage and add the stage name and the run
+    result (see run_process) to the queue of completed stages. The result
+    contains the content digests of the input files of the stage. A command
+    that cannot be executed is reported with exit code 127. Any other error
+    is reported with exit code 1, so that a result is always added to the
+    queue.
+
+    Parameters
+    ----------
+    prg_name: string
+        Name with which the program was called
+    stage: Stage
+        Pipeline stage
+    completed: Queue.Queue
+        Queue of completed stages
+    """
+    digests = None
+    try:
+        # Inputs are fingerprinted after all stages that write them completed
+        if len(stage.inputs) > 0:
+            digests = get_digests(stage.inputs)
+        result = run_process(prg_name, (stage.cmd, stage.params))
+    except OSError as ex:
+        print prg_name + ' (ERROR): ' + stage.name + ': ' + str(ex)
+        result = (stage.params, {'args': stage.cmd, 'exit_code': 127, 'duration': 0.0})
+    except Exception as ex:
+        print prg_name + ' (ERROR): ' + stage.name + ': ' + str(ex)
+        result = (stage.params, {'args': stage.cmd, 'exit_code': 1, 'duration': 0.0})
+    if not digests is None:
+        result[1]['inputs'] = digests
+    completed.put((stage.name, result))
+
+
+def skip_downstream(prg_name, stage, pipeline):
+    """Mark all stages that depend directly or indirectly on the given failed
+    stage as skipped.
+
+    Parameters
+    ----------
+    prg_name: string
+        Name with which the program was called
+    stage: Stage
+        Failed stage
+    pipeline: dict
+        Pipeline stages by name
+    """
+    queue = sorted(stage.downstream)
+    while len(queue) > 0:
+        downstream = pipeline[queue.pop(0)]
+        if downstream.state == STAGE_PENDING:
+            print prg_name + ' (SKIPPED): ' + downstream.name
+            downstream.state = STAGE_SKIPPED
+            queue.extend(sorted(downstream.downstream))
@@ -0,0 +1,482 @@
+"""Everything related to the placement of concurrent local runs on CPUs.
+
+A placement policy determines the set of CPUs on which a run may execute.
+The affinity of the command is set in the child process before the command
+is executed, so that all threads and processes that the command starts
+inherit it. Policies are:
+
+- pin: each run is pinned to a dedicated set of physical cores, including
+  all hardware threads (SMT siblings) of these cores. Cores are taken from a
+  single NUMA node if the node has enough idle cores. If there are more
+  concurrent runs than cores, runs share the least used cores.
+- numa: each run is confined to all cores of one NUMA node. Runs are
+  assigned to the node with the fewest runs.
+- node:<n>: all runs are confined to the cores of NUMA node n.
+
+Allocations are coordinated between all processes of the user on the
+machine (e.g., runs that are started by hand in separate terminals). They
+are kept in a state file in the run queue directory and every access is
+serialized by a file lock. Allocations of processes that no longer exist
+are removed automatically.
+
+Memory is allocated on the node of the CPU that first touches it by
+default, so confining a run to the cores of a node keeps its memory local.
+
+The number of threads of common numerical libraries (OpenMP, MKL, OpenBLAS)
+is set consistently for every run through environment variables. Runs that
+are pinned use as many threads as they have physical cores unless a thread
+count is given.
+
+NUMA nodes are read from the sysfs. Only CPUs that the current process may
+run on are used. On systems without NUMA information all CPUs belong to
+node 0. Python 2 has no os.sched_setaffinity. The system call is invoked
+through ctypes instead.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import fcntl
+import json
+from multiprocessing import cpu_count
+import os
+import re
+import socket
+import uuid
+
+from exprepo.runqueue import get_queue_dir, is_alive, open_shared
+
+
+# ------------------------------------------------------------------------------
+# Constants
+# ------------------------------------------------------------------------------
+
+"""Placement policies."""
+POLICY_NODE = 'node'
+POLICY_NUMA = 'numa'
+POLICY_PIN = 'pin'
+
+"""Separator between the node policy and the node number."""
+NODE_SEPARATOR = ':'
+
+"""Directories that contain the NUMA nodes and the CPUs of the system."""
+CPU_DIR = '/sys/devices/system/cpu'
+NODE_DIR = '/sys/devices/system/node'
+
+"""Names of the files in the run queue directory that contain the CPU
+allocations of all runs on the machine."""
+PLACEMENT_LOCK_FILE = 'placement.lock'
+PLACEMENT_STATE_FILE = 'placement'
+
+"""File in /proc that contains the CPUs the current process may run on."""
+STATUS_FILE = '/proc/self/status'
+
+"""Maximum number of CPUs in an affinity mask (as in glibc's cpu_set_t)."""
+CPU_SETSIZE = 1024
+
+"""Environment variables that set the number of threads of numerical
+libraries."""
+THREAD_VARIABLES = [
+    'MKL_NUM_THREADS',
+    'NUMEXPR_NUM_THREADS',
+    'OMP_NUM_THREADS',
+    'OPENBLAS_NUM_THREADS',
+    'VECLIB_MAXIMUM_THREADS'
+]
+
+
+# ------------------------------------------------------------------------------
+# Classes
+# ------------------------------------------------------------------------------
+
+class CpuAllocator(object):
+    """Allocator of CPU sets for concurrent runs according to a placement
+    policy. The allocations of all allocators on the machine are kept in a
+    shared state file (see PlacementLock). Methods are thread-safe.
+    """
+    def __init__(self, policy=None, cpus=1, threads=None):
+        """Initialize the allocator. If no policy is given, runs are not
+        pinned but the thread count is still applied.
+
+        Raises ValueError if the policy is unknown, if the number of cores
+        or threads is invalid, or if the node does not exist.
+
+        Parameters
+        ----------
+        policy: string, optional
+            Placement policy (pin, numa, or node:<n>)
+        cpus: int, optional
+            Number of physical cores for each run that is pinned
+        threads: int, optional
+            Number of threads of numerical libraries in each run
+        """
+        self.policy, self.node = parse_policy(policy)
+        if cpus < 1:
+            raise ValueError('invalid number of cpus \'' + str(cpus) + '\'')
+        if not threads is None and threads < 1:
+            raise ValueError('invalid number of threads \'' + str(threads) + '\'')
+        self.cpus = cpus
+        self.threads = threads
+        self.nodes = get_cores() if not self.policy is None else dict()
+        if self.policy == POLICY_PIN:
+            available = sum([len(c) for c in self.nodes.values()])
+            if cpus > available:
+                raise ValueError('only ' + str(available) + ' cores available for placement')
+        if self.policy == POLICY_NODE and not self.node in self.nodes:
+            raise ValueError('unknown node \'' + str(self.node) + '\'')
+
+    def acquire(self):
+        """Allocate the CPUs for a run. Returns an allocation identifier
+        (None if no CPUs are allocated) and the placement of the run. The
+        placement contains the policy ('policy'), the list of CPUs ('cpus'),
+        the node if all CPUs are on one node ('node'), and the number of
+        threads ('threads'). Values that do not apply are None.
+
+        Returns
+        -------
+        string, dict
+        """
+        placement = {
+            'policy': self.policy,
+            'cpus': None,
+            'node': None,
+            'threads': self.threads
+        }
+        if self.policy is None:
+            return None, placement
+        alloc_id = uuid.uuid4().hex[:16]
+        with PlacementLock() as state:
+            if self.policy == POLICY_PIN:
+                node, cores = self.select_cores(state)
+                cpus = sorted([cpu for core in cores for cpu in core])
+                if placement['threads'] is None:
+                    placement['threads'] = len(cores)
+            else:
+                node = self.node
+                if self.policy == POLICY_NUMA:
+                    runs = dict((n, 0) for n in self.nodes)
+                    for alloc in state.values():
+                        if alloc['node'] in runs:
+                            runs[alloc['node']] += 1
+                    # Ties are broken by the lowest node number
+                    node = min(sorted(self.nodes), key=lambda n: runs[n])
+                cpus = sorted([cpu for core in self.nodes[node] for cpu in core])
+            state[alloc_id] = {
+                'pid': os.getpid(),
+                'host': socket.gethostname(),
+                'cpus': cpus,
+                'node': node
+            }
+        placement['cpus'] = cpus
+        placement['node'] = node
+        if self.policy == POLICY_NODE:
+            placement['policy'] = POLICY_NODE + NODE_SEPARATOR + str(node)
+        return alloc_id, placement
+
+    def release(self, alloc_id):
+        """Release the CPUs of an allocation that was returned by acquire.
+
+        Parameters
+        ----------
+        alloc_id: string
+            Allocation identifier
+        """
+        if alloc_id is None:
+            return
+        with PlacementLock() as state:
+            state.pop(alloc_id, None)
+
+    def select_cores(self, state):
+        """Select the physical cores for a pinned run. A core is used by
+        every allocation that contains one of its CPUs. Cores are taken from
+        the node with the most idle cores. If that node does not have enough
+        idle cores, the least used cores are taken, preferring cores on that
+        node. Returns the node (None if the cores span several nodes) and
+        the list of cores.
+
+        Parameters
+        ----------
+        state: dict
+            Allocations of all runs on the machine
+
+        Returns
+        -------
+        int, list(tuple(int))
+        """
+        used = dict()
+        for alloc in state.values():
+            for cpu in alloc['cpus']:
+                used[cpu] = used.get(cpu, 0) + 1
+        core_runs = dict()
+        core_nodes = dict()
+        for node, cores in self.nodes.items():
+            for core in cores:
+                core_runs[core] = max([used.get(cpu, 0) for cpu in core])
+                core_nodes[core] = node
+        idle = dict(
+            (node, [c for c in cores if core_runs[c] == 0])
+                for node, cores in self.nodes.items()
+        )
+        # Ties are broken by the lowest node number
+        node = max(sorted(self.nodes), key=lambda n: len(idle[n]))
+        if len(idle[node]) >= self.cpus:
+            return node, idle[node][:self.cpus]
+        cores = sorted(
+            core_runs,
+            key=lambda c: (core_runs[c], core_nodes[c] != node, c)
+        )[:self.cpus]
+        if len(set([core_nodes[c] for c in cores])) > 1:
+            node = None
+        return node, sorted(cores)
+
+
+class PlacementLock(object):
+    """Exclusive lock on the CPU allocations of all runs on the machine.
+    Reads the allocations when the lock is acquired and writes them when the
+    lock is released. Allocations of processes that no longer exist are
+    removed.
+    """
+    def __init__(self):
+        self.queue_dir = get_queue_dir()
+        self.state = None
+        self.f_lock = None
+
+    def __enter__(self):
+        self.f_lock = open_shared(os.path.join(self.queue_dir, PLACEMENT_LOCK_FILE))
+        fcntl.flock(self.f_lock.fileno(), fcntl.LOCK_EX)
+        self.state = dict()
+        filename = os.path.join(self.queue_dir, PLACEMENT_STATE_FILE)
+        with open_shared(filename, 'r') as f:
+            try:
+                self.state = json.load(f)
+            except ValueError:
+                # Start without allocations if the state is empty or
+                # corrupted
+                pass
+        host = socket.gethostname()
+        for alloc_id in list(self.state.keys()):
+            alloc = self.state[alloc_id]
+            if alloc['host'] == host and not is_alive(alloc['pid']):
+                del self.state[alloc_id]
+        return self.state
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            filename = os.path.join(self.queue_dir, PLACEMENT_STATE_FILE)
+            with open_shared(filename) as f:
+                f.truncate()
+                json.dump(self.state, f)
+        finally:
+            fcntl.flock(self.f_lock.fileno(), fcntl.LOCK_UN)
+            self.f_lock.close()
+        return False
+
+
+# ------------------------------------------------------------------------------
+# API Methods
+# ------------------------------------------------------------------------------
+
+def format_cpu_list(cpus):
+    """Get the representation of a list of CPUs in the format of the kernel
+    (e.g., 0-3,8).
+
+    Parameters
+    ----------
+    cpus: list(int)
+        CPU numbers
+
+    Returns
+    -------
+    string
+    """
+    ranges = list()
+    for cpu in sorted(set(cpus)):
+        if len(ranges) > 0 and ranges[-1][1] == cpu - 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ','.join([
+        str(r[0]) if r[0] == r[1] else str(r[0]) + '-' + str(r[1])
+            for r in ranges
+    ])
+
+
+def get_affinity_setter(cpus):
+    """Get a function that sets the CPU affinity of the calling process to
+    the given CPUs. The function is meant to run in a child process before
+    the command is executed. The affinity mask is built up front so that the
+    child only makes the system call.
+
+    Raises ValueError if a CPU number exceeds the size of the affinity mask.
+
+    Parameters
+    ----------
+    cpus: list(int)
+        CPU numbers
+
+    Returns
+    -------
+    func
+    """
+    if hasattr(os, 'sched_setaffinity'):
+        return lambda: os.sched_setaffinity(0, cpus)
+    word_bits = 8 * ctypes.sizeof(ctypes.c_ulong)
+    mask = (ctypes.c_ulong * (CPU_SETSIZE // word_bits))()
+    for cpu in cpus:
+        if cpu < 0 or cpu >= CPU_SETSIZE:
+            raise ValueError('invalid cpu \'' + str(cpu) + '\'')
+        mask[cpu // word_bits] |= 1 << (cpu % word_bits)
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    sched_setaffinity = libc.sched_setaffinity
+    def set_affinity():
+        if sched_setaffinity(0, ctypes.sizeof(mask), ctypes.byref(mask)) != 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code))
+    return set_affinity
+
+
+def get_allowed_cpus():
+    """Get the sorted list of CPUs that the current process may run on.
+
+    Returns
+    -------
+    list(int)
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    try:
+        with open(STATUS_FILE, 'r') as f:
+            for line in f:
+                if line.startswith('Cpus_allowed_list:'):
+                    return parse_cpu_list(line.split(':', 1)[1])
+    except IOError as ex:
+        if ex.errno != errno.ENOENT:
+            raise
+    return list(range(cpu_count()))
+
+
+def get_cores():
+    """Get the physical cores of each NUMA node that the current process may
+    run on. Returns a dictionary that maps node numbers to sorted lists of
+    cores. Each core is a tuple of the CPUs (hardware threads) that share
+    it. Without topology information, every CPU is a core.
+
+    Returns
+    -------
+    dict
+    """
+    result = dict()
+    for node, cpus in get_numa_nodes().items():
+        cores = set()
+        for cpu in cpus:
+            filename = os.path.join(
+                CPU_DIR,
+                'cpu' + str(cpu),
+                'topology',
+                'thread_siblings_list'
+            )
+            siblings = [cpu]
+            if os.path.isfile(filename):
+                with open(filename, 'r') as f:
+                    siblings = parse_cpu_list(f.read())
+            cores.add(tuple([c for c in siblings if c in cpus] or [cpu]))
+        result[node] = sorted(cores)
+    return result
+
+
+def get_numa_nodes():
+    """Get the CPUs of each NUMA node that the current process may run on.
+    Returns a dictionary that maps node numbers to sorted lists of CPUs.
+    Nodes without such CPUs are omitted. All CPUs belong to node 0 if the
+    system has no NUMA information.
+
+    Returns
+    -------
+    dict
+    """
+    allowed = set(get_allowed_cpus())
+    nodes = dict()
+    if os.path.isdir(NODE_DIR):
+        for name in os.listdir(NODE_DIR):
+            match = re.match(r'^node(\d+)$', name)
+            if match is None:
+                continue
+            with open(os.path.join(NODE_DIR, name, 'cpulist'), 'r') as f:
+                cpus = [c for c in parse_cpu_list(f.read()) if c in allowed]
+            if len(cpus) > 0:
+                nodes[int(match.group(1))] = cpus
+    if len(nodes) == 0:
+        nodes[0] = sorted(allowed)
+    return nodes
+
+
+def get_thread_env(threads):
+    """Get the environment variables that set the number of threads of
+    numerical libraries.
+
+    Parameters
+    ----------
+    threads: int
+        Number of threads
+
+    Returns
+    -------
+    dict
+    """
+    return dict((var, str(threads)) for var in THREAD_VARIABLES)
+
+
+def parse_cpu_list(value):
+    """Parse a list of CPUs in the format of the kernel (e.g., 0-3,8).
+
+    Raises ValueError if the value is of invalid format.
+
+    Parameters
+    ----------
+    value: string
+        CPU list
+
+    Returns
+    -------
+    list(int)
+    """
+    cpus = list()
+    for token in value.strip().split(','):
+        if token == '':
+            continue
+        bounds = token.split('-')
+        try:
+            if len(bounds) == 1:
+                cpus.append(int(bounds[0]))
+            elif len(bounds) == 2:
+                cpus.extend(range(int(bounds[0]), int(bounds[1]) + 1))
+            else:
+                raise ValueError()
+        except ValueError:
+            raise ValueError('invalid cpu list \'' + value.strip() + '\'')
+    return sorted(set(cpus))
+
+
+def parse_policy(policy):
+    """Parse a placement policy. Returns the policy name and the node number
+    for the node policy (None otherwise).
+
+    Raises ValueError if the policy is unknown.
+
+    Parameters
+    ----------
+    policy: string
+        Placement policy (pin, numa, or node:<n>)
+
+    Returns
+    -------
+    string, int
+    """
+    if policy is None or policy in [POLICY_NUMA, POLICY_PIN]:
+        return policy, None
+    if policy.startswith(POLICY_NODE + NODE_SEPARATOR):
+        try:
+            return POLICY_NODE, int(policy[len(POLICY_NODE) + 1:])
+        except ValueError:
+            pass
+    raise ValueError('unknown placement policy \'' + str(policy) + '\'')
@@ -0,0 +1,371 @@
+"""Programmatic interface to an experiment repository.
+
+The Repository class is intended for driver scripts that resolve, run or
+submit many commands from within a single Python process. Command templates,
+settings and global variables are kept in memory and are only read again
+when the underlying files change. Results are returned as log entries
+instead of being printed.
+"""
+
+from contextlib import contextmanager
+import os
+
+import exprepo as exp
+from exprepo.command import CommandTemplate, CmdElement
+from exprepo.command import get_input_digests, get_placement
+from exprepo.command import get_registry_entry, get_request
+from exprepo.command import lookup_cache
+from exprepo.command import run_points, submit_points
+from exprepo.settings import get_global_variables, get_settings
+
+
+# ------------------------------------------------------------------------------
+# Constants
+# ------------------------------------------------------------------------------
+
+"""Program name that is used in job scripts of submitted job arrays."""
+PRG_NAME = 'xpr'
+
+
+# ------------------------------------------------------------------------------
+# Classes
+# ------------------------------------------------------------------------------
+
+class Repository(object):
+    """Experiment repository in a given directory. All methods are executed
+    with the repository directory as the working directory. The working
+    directory of the process is restored when a method returns. Note that
+    the working directory is shared by all threads of the process.
+
+    Parameter overrides are given as dictionaries that map parameter paths
+    (e.g., 'model/lr') to values.
+    """
+    def __init__(self, path=None, prg_name=PRG_NAME):
+        """Open the repository in the given directory.
+
+        Raises RuntimeError if the directory does not contain a repository.
+
+        Parameters
+        ----------
+        path: string, optional
+            Repository directory. Uses the current working directory by
+            default.
+        prg_name: string, optional
+            Program name that is used in job scripts of submitted job arrays
+        """
+        self.path = os.path.abspath(path if not path is None else os.getcwd())
+        self.prg_name = prg_name
+        # Compiled command templates by command name. Templates are compiled
+        # again when the registry entry for the command changes.
+        self.templates = dict()
+        with self.working_directory():
+            # Raise an exception if the directory is not a repository
+            exp.get_base()
+
+    def get_settings(self):
+        """Get the current configuration settings of the repository.
+
+        Returns
+        -------
+        exprepo.settings.Config
+        """
+        with self.working_directory():
+            return get_settings()
+
+    def get_template(self, name):
+        """Get the compiled template and the declared input files for the
+        registered command with the given name. Expects the repository
+        directory to be the working directory.
+
+        Raises ValueError if the command is unknown.
+
+        Parameters
+        ----------
+        name: string
+            Command name
+
+        Returns
+        -------
+        CommandTemplate, list(string)
+        """
+        entry = get_registry_entry(name)
+        key = (entry['mtime'], entry['size'])
+        cached = self.templates.get(name.lower())
+        if cached is None or cached[0] != key:
+            spec = [CmdElement.from_dict(obj) for obj in entry['spec']]
+            cached = (key, CommandTemplate(spec), entry.get('inputs', list()))
+            self.templates[name.lower()] = cached
+        return cached[1], cached[2]
+
+    def get_variables(self):
+        """Get the global variables of the repository.
+
+        Returns
+        -------
+        exprepo.settings.Config
+        """
+        with self.working_directory():
+            return get_global_variables()
+
+    def resolve(self, name, overrides=None):
+        """Get the command line components and parameter values for the
+        registered command with the given name.
+
+        Raises ValueError if the command is unknown or if a referenced
+        parameter or variable does not exist.
+
+        Parameters
+        ----------
+        name: string
+            Command name
+        overrides: dict, optional
+            Parameter values that override the configuration settings
+
+        Returns
+        -------
+        list(string), dict
+        """
+        return self.resolve_many(name, [overrides])[0]
+
+    def resolve_many(self, name, overrides):
+        """Get the command line components and parameter values for each of
+        the given sets of parameter overrides.
+
+        Raises ValueError if the command is unknown or if a referenced
+        parameter or variable does not exist.
+
+        Parameters
+        ----------
+        name: string
+            Command name
+        overrides: list(dict)
+            Sets of parameter values that override the configuration
+            settings
+
+        Returns
+        -------
+        list((list(string), dict))
+        """
+        with self.working_directory():
+            template, _ = self.get_template(name)
+            return template.render_many(
+                get_settings(),
+                get_global_variables(),
+                [normalize(values) for values in overrides]
+            )
+
+    def run(self, name, overrides=None, use_cache=False, inputs=None, queue=None, sample=None, capture=None, timeout=None, retries=0, placement=None, threads=None):
+        """Run the registered command with the given name. Returns the log
+        entry of the run. The entry contains the run identifier ('id'), the
+        exit code ('exit_code'), the run time ('duration') and the resource
+        usage ('usage'). See run_many for a description of the options.
+
+        Raises ValueError if the command is unknown or if a referenced
+        parameter or variable does not exist.
+
+        Parameters
+        ----------
+        name: string
+            Command name
+        overrides: dict, optional
+            Parameter values that override the configuration settings
+
+        Returns
+        -------
+        dict
+        """
+        return self.run_many(
+            name,
+            [overrides],
+            use_cache=use_cache,
+            inputs=inputs,
+            queue=queue,
+            sample=sample,
+            capture=capture,
+            timeout=timeout,
+            retries=retries,
+            placement=placement,
+            threads=threads
+        )[0]
+
+    def run_many(self, name, overrides, jobs=1, use_cache=False, inputs=None, queue=None, sample=None, capture=None, timeout=None, retries=0, placement=None, threads=None):
+        """Run the registered command for each of the given sets of parameter
+        overrides using a pool of at most jobs workers. Returns the log
+        entries of the runs in the order of the given overrides.
+
+        If the use cache flag is True, commands that have been run
+        successfully before are not run again. The cached log entry is
+        returned instead and contains the flag 'cached'.
+
+        Raises ValueError if the command is unknown or if a referenced
+        parameter or variable does not exist.
+
+        Parameters
+        ----------
+        name: string
+            Command name
+        overrides: list(dict)
+            Sets of parameter values that override the configuration
+            settings
+        jobs: int, optional
+            Maximum number of commands that are run concurrently
+        use_cache: bool, optional
+            Flag indicating whether to skip commands that have been run
+            successfully before
+        inputs: list(string), optional
+            Paths to additional input files whose content digests are logged
+            and part of the cache key
+        queue: dict, optional
+            Number of CPUs ('cpus'), memory in bytes ('memory') and priority
+            ('priority') for admission by the run queue
+        sample: float, optional
+            Seconds between samples of the resource usage of a run
+        capture: dict, optional
+            Maximum number of bytes ('limit') and number of bytes at the end
+            ('tail') that are stored for each output of a run. Output is
+            captured in the run directory if given (an empty dictionary
+            captures the complete output).
+        timeout: float, optional
+            Maximum run time of a command in seconds
+        retries: int, optional
+            Number of times a failed command is run again
+        placement: string, optional
+            Placement policy for concurrent runs (pin, numa, or node:<n>).
+            The placement of each run is contained in its log entry.
+        threads: int, optional
+            Number of threads of numerical libraries in each run
+
+        Returns
+        -------
+        list(dict)
+        """
+        overrides = [normalize(values) for values in overrides]
+        with self.working_directory():
+            template, spec_inputs = self.get_template(name)
+            config = get_settings()
+            variables = get_global_variables()
+            points = template.render_many(config, variables, overrides)
+            digests = get_input_digests(
+                spec_inputs,
+                overrides,
+                points,
+                config,
+                variables,
+                inputs=inputs
+            )
+            cache_keys = None
+            cached = dict()
+            if use_cache:
+                cache_keys, cached = lookup_cache(points, digests=digests)
+            pending = [i for i in range(len(points)) if not i in cached]
+            entries = run_points(
+                self.prg_name,
+                name,
+                [points[i] for i in pending],
+                jobs=jobs,
+                cache_keys=cache_keys,
+                digests=digests,
+                request=get_request(name, queue),
+                sample=sample,
+                capture=capture,
+                timeout=timeout,
+                retries=retries,
+                placement=get_placement(
+                    name,
+                    policy=placement,
+                    threads=threads,
+                    queue=queue
+                ),
+                verbose=False
+            )
+        result = [None] * len(points)
+        for pos, entry in zip(pending, entries):
+            result[pos] = entry
+        for pos in cached:
+            entry = dict(cached[pos])
+            entry['cached'] = True
+            result[pos] = entry
+        return result
+
+    def submit(self, name, overrides=None, scheduler=None, spool=False):
+        """Submit the registered command for each of the given sets of
+        parameter overrides without running it. If a scheduler is given, the
+        commands are written as a job array. If the spool flag is True, the
+        commands are written to the spool for workers. Returns the log
+        entries for the submitted commands.
+
+        Raises ValueError if the command is unknown, if a referenced
+        parameter or variable does not exist, or if the scheduler is unknown.
+
+        Parameters
+        ----------
+        name: string
+            Command name
+        overrides: list(dict), optional
+            Sets of parameter values that override the configuration
+            settings. The command is submitted once without overrides by
+            default.
+        scheduler: string, optional
+            Name of the batch scheduler
+        spool: bool, optional
+            Write the commands to the spool
+
+        Returns
+        -------
+        list(dict)
+        """
+        if overrides is None:
+            overrides = [dict()]
+        points = self.resolve_many(name, overrides)
+        with self.working_directory():
+            return submit_points(
+                self.prg_name,
+                name,
+                points,
+                scheduler=scheduler,
+                spool=spool,
+                verbose=False
+            )
+
+    @contextmanager
+    def working_directory(self):
+        """Context manager that changes the working directory to the
+        repository directory.
+        """
+        cwd = os.getcwd()
+        if cwd == self.path:
+            yield
+        else:
+            os.chdir(self.path)
+            try:
+                yield
+            finally:
+                os.chdir(cwd)
+
+
+# ------------------------------------------------------------------------------
+# Helper Methods
+# ------------------------------------------------------------------------------
+
+def normalize(values):
+    """Convert parameter override values to strings. Returns an empty
+    dictionary if no values are given.
+
+    Parameters
+    ----------
+    values: dict
+        Parameter values keyed by parameter path
+
+    Returns
+    -------
+    dict
+    """
+    if values is None:
+        return dict()
+    result = dict()
+    for key in values:
+        value = values[key]
+        if not isinstance(value, basestring):
+            value = str(value)
+        result[key] = value
+    return result
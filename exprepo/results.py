@@ -0,0 +1,687 @@
+"""Everything related to the columnar results store.
+
+The results store is a directory in the repository that contains one file
+per column with a value for every completed run in the log. Columns are the
+run attributes (id, command, status, time, duration, exit_code), the
+resolved parameter values of the run and the last value of every numeric
+metric that the run reported. Numeric columns are arrays of doubles where
+missing values are NaN. Other columns are arrays of integer codes into a
+dictionary file that contains one JSON value per line, where missing values
+are -1. The run identifier column is a dictionary file only.
+
+The schema file lists the columns with their kind and type, the number of
+rows and the number of log entries that have been added to the store. The
+store is synced with the log by appending rows for the entries that follow.
+Column files are appended before the schema is replaced, so data of an
+interrupted sync is truncated by the next sync.
+
+Queries refer to columns by their name. Parameters and metrics can be
+qualified as param:<name> and metric:<name> if the name is ambiguous.
+"""
+
+import array
+import json
+import math
+import os
+import uuid
+
+import exprepo as exp
+from exprepo.log import get_log_file, open_index
+from exprepo.log import STATUS_SUBMITTED
+from exprepo.settings import FileLock
+from exprepo.timing import timed
+
+
+# ------------------------------------------------------------------------------
+# Constants
+# ------------------------------------------------------------------------------
+
+"""Aggregate functions."""
+AGGREGATES = {
+    'count': lambda values: len(values),
+    'max': lambda values: max(values) if len(values) > 0 else None,
+    'mean': lambda values: sum(values) / len(values) if len(values) > 0 else None,
+    'min': lambda values: min(values) if len(values) > 0 else None,
+    'sum': lambda values: sum(values)
+}
+
+"""Column kinds and the prefixes of qualified column names."""
+KIND_METRIC = 'metric'
+KIND_PARAM = 'param'
+KIND_RUN = 'run'
+
+"""Column types. Numeric columns contain doubles, coded columns contain codes
+into a dictionary of values and unique columns contain a dictionary only."""
+TYPE_CODED = 'i'
+TYPE_NUMERIC = 'd'
+TYPE_UNIQUE = 'u'
+
+"""Values that represent missing values in columns."""
+MISSING_CODE = -1
+MISSING_NUMBER = float('nan')
+
+"""Comparison operators for filters. Two-character operators come first to
+be matched before their prefixes."""
+OPERATORS = [
+    ('!=', lambda a, b: a != b),
+    ('<=', lambda a, b: a <= b),
+    ('>=', lambda a, b: a >= b),
+    ('=', lambda a, b: a == b),
+    ('<', lambda a, b: a < b),
+    ('>', lambda a, b: a > b)
+]
+
+"""Columns for the run attributes of log entries."""
+RUN_COLUMNS = [
+    ('id', TYPE_UNIQUE),
+    ('command', TYPE_CODED),
+    ('status', TYPE_CODED),
+    ('time', TYPE_NUMERIC),
+    ('duration', TYPE_NUMERIC),
+    ('exit_code', TYPE_NUMERIC)
+]
+
+"""Name of the schema file in the results directory."""
+SCHEMA_FILE = 'SCHEMA'
+
+"""Suffix of dictionary files."""
+DICT_SUFFIX = '.dict'
+
+
+# ------------------------------------------------------------------------------
+# Classes
+# ------------------------------------------------------------------------------
+
+class ResultColumn(object):
+    """Column in the results store. Values are read on demand."""
+    def __init__(self, name, kind, type, file_id, size=0, length=0):
+        """Initialize the column.
+
+        Parameters
+        ----------
+        name: string
+            Column name
+        kind: string
+            Column kind (run, param or metric)
+        type: string
+            Column type
+        file_id: string
+            Name of the column file in the results directory
+        size: int, optional
+            Number of values in the dictionary of the column
+        length: int, optional
+            Length of the dictionary file in bytes
+        """
+        self.name = name
+        self.kind = kind
+        self.type = type
+        self.file_id = file_id
+        self.size = size
+        self.length = length
+
+    def append_dictionary(self, labels):
+        """Append JSON values to the dictionary file. Data beyond the
+        length of the dictionary (i.e., data of an interrupted sync) is
+        discarded first.
+
+        Parameters
+        ----------
+        labels: list(string)
+            JSON serializations of the values
+        """
+        with open(get_column_file(self.file_id) + DICT_SUFFIX, 'ab') as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() > self.length:
+                f.truncate(self.length)
+            for label in labels:
+                f.write(label + '\n')
+                self.length += len(label) + 1
+        self.size += len(labels)
+
+    def read_dictionary(self):
+        """Read the dictionary of a coded or unique column.
+
+        Returns
+        -------
+        list
+        """
+        if self.length == 0:
+            return list()
+        with open(get_column_file(self.file_id) + DICT_SUFFIX, 'rb') as f:
+            return [json.loads(line) for line in f.read(self.length).splitlines()]
+
+    def read_values(self, rows):
+        """Read the array of the first rows values of a numeric or coded
+        column.
+
+        Parameters
+        ----------
+        rows: int
+            Number of rows
+
+        Returns
+        -------
+        array.array
+        """
+        values = array.array(self.type)
+        if rows > 0:
+            with open(get_column_file(self.file_id), 'rb') as f:
+                values.fromfile(f, rows)
+        return values
+
+    def to_dict(self):
+        """Get the dictionary serialization of the column for the schema.
+
+        Returns
+        -------
+        dict
+        """
+        return {
+            'name': self.name,
+            'kind': self.kind,
+            'type': self.type,
+            'file_id': self.file_id,
+            'size': self.size,
+            'length': self.length
+        }
+
+
+# ------------------------------------------------------------------------------
+# API Methods
+# ------------------------------------------------------------------------------
+
+def print_results(filters=None, group_by=None, aggregates=None):
+    """Print aggregates over the runs in the results store. Runs are
+    filtered by expressions of format <column><op><value> where op is one of
+    =, !=, <, <=, >, >=. Aggregates are given as <function>:<column> or as
+    count. Without a grouping a single row is printed. The store is synced
+    with the log first.
+
+    Raises ValueError if a column, filter or aggregate is invalid.
+
+    Parameters
+    ----------
+    filters: list(string), optional
+        Filter expressions
+    group_by: list(string), optional
+        Names of the columns by which runs are grouped
+    aggregates: list(string), optional
+        Aggregates for each group. By default, runs are counted.
+    """
+    filters = filters if not filters is None else list()
+    group_by = group_by if not group_by is None else list()
+    if aggregates is None or len(aggregates) == 0:
+        aggregates = ['count']
+    schema = sync_results()
+    rows = schema['rows']
+    columns = [ResultColumn(**c) for c in schema['columns']]
+    loaded = dict()
+    def load(name):
+        column = find_column(columns, name)
+        if not column.file_id in loaded:
+            loaded[column.file_id] = load_column(column, rows)
+        return loaded[column.file_id]
+    # Parse aggregates before filtering to fail early
+    aggs = list()
+    for spec in aggregates:
+        func, _, name = spec.partition(':')
+        if not func in AGGREGATES or (name == '' and func != 'count'):
+            raise ValueError('invalid aggregate \'' + spec + '\'')
+        aggs.append((spec, func, name if name != '' else None))
+    # Positions of the rows that satisfy all filters
+    selected = range(rows)
+    for expr in filters:
+        name, op, value = parse_filter(expr)
+        compare = dict(OPERATORS)[op]
+        values, labels = load(name)
+        if labels is None:
+            try:
+                operand = float(value)
+            except ValueError:
+                raise ValueError('invalid number \'' + value + '\'')
+            matches = [not math.isnan(values[i]) and compare(values[i], operand) for i in selected]
+        else:
+            # Evaluate the filter once for each dictionary value. Values are
+            # ordered as numbers if both are numeric. Equality is tested on
+            # the formatted values.
+            operand = to_number(value) if not op in ['=', '!='] else None
+            codes = list()
+            for label in labels:
+                number = to_number(label)
+                if not operand is None and not number is None:
+                    codes.append(compare(number, operand))
+                else:
+                    codes.append(compare(format_value(label), value))
+            matches = [values[i] != MISSING_CODE and codes[values[i]] for i in selected]
+        selected = [selected[i] for i in range(len(selected)) if matches[i]]
+    # Group the selected rows
+    keys = [load(name) for name in group_by]
+    groups = dict()
+    for i in selected:
+        key = tuple(get_label(values, labels, i) for values, labels in keys)
+        groups.setdefault(key, list()).append(i)
+    if len(group_by) == 0 and len(groups) == 0:
+        groups[tuple()] = list()
+    # Compute and print the aggregates for each group
+    header = list(group_by) + [spec for spec, _, _ in aggs]
+    lines = [header]
+    for key in sorted(groups, key=sort_key):
+        line = [format_value(k) for k in key]
+        for spec, func, name in aggs:
+            if name is None:
+                line.append(str(len(groups[key])))
+                continue
+            values, labels = load(name)
+            numbers = list()
+            for i in groups[key]:
+                if labels is None:
+                    number = values[i]
+                    if math.isnan(number):
+                        number = None
+                elif values[i] != MISSING_CODE:
+                    number = to_number(labels[values[i]])
+                else:
+                    number = None
+                if not number is None:
+                    numbers.append(number)
+            line.append(format_value(AGGREGATES[func](numbers)))
+        lines.append(line)
+    widths = [max(len(line[i]) for line in lines) for i in range(len(header))]
+    for line in lines:
+        print '  '.join(line[i].ljust(widths[i]) for i in range(len(line))).rstrip()
+
+
+@timed('results')
+def sync_results():
+    """Append rows for all completed runs in the log that are not in the
+    results store yet. Returns the schema of the store. The store is rebuilt
+    if the log contains fewer entries than have been added to the store.
+
+    Returns
+    -------
+    dict
+    """
+    results_dir = get_results_dir()
+    if not os.path.isdir(results_dir):
+        try:
+            os.makedirs(results_dir)
+        except OSError:
+            # The directory may have been created by a concurrent sync
+            if not os.path.isdir(results_dir):
+                raise
+    schema_file = os.path.join(results_dir, SCHEMA_FILE)
+    with FileLock(schema_file):
+        schema = read_schema()
+        log_file = get_log_file()
+        if not os.path.isfile(log_file):
+            return schema
+        index = open_index(log_file)
+        try:
+            if schema['entries'] > len(index):
+                schema = new_schema()
+            if schema['entries'] == len(index):
+                return schema
+            entries = list()
+            with open(log_file, 'rb') as f:
+                for pos in range(schema['entries'], len(index)):
+                    offset = index.offset(pos)
+                    if f.tell() != offset:
+                        f.seek(offset)
+                    entry = json.loads(f.readline())
+                    if entry['status'] != STATUS_SUBMITTED:
+                        entries.append(entry)
+            schema['entries'] = len(index)
+        finally:
+            index.close()
+        append_rows(schema, entries)
+        write_schema(schema)
+    return schema
+
+
+# ------------------------------------------------------------------------------
+# Helper Methods
+# ------------------------------------------------------------------------------
+
+def append_rows(schema, entries):
+    """Append rows for the given log entries to the column files. Adds new
+    columns to the schema for parameters and metrics that have not been seen
+    before. Data beyond the number of rows in the schema (i.e., data of an
+    interrupted sync) is discarded first.
+
+    Parameters
+    ----------
+    schema: dict
+        Schema of the results store
+    entries: list(dict)
+        Log entries of completed runs
+    """
+    rows = schema['rows']
+    columns = dict()
+    for c in schema['columns']:
+        column = ResultColumn(**c)
+        columns[(column.kind, column.name)] = column
+    # Collect the values for each column
+    batch = dict()
+    for i in range(len(entries)):
+        entry = entries[i]
+        for name, type in RUN_COLUMNS:
+            batch.setdefault((KIND_RUN, name), dict())[i] = entry.get(name)
+        for name, value in entry.get('params', dict()).items():
+            # Parameter values are stored as strings such that values from
+            # settings and from command arguments are grouped together
+            if not value is None and not isinstance(value, basestring):
+                value = json.dumps(value)
+            batch.setdefault((KIND_PARAM, name), dict())[i] = value
+        last = (entry.get('metrics') or dict()).get('last') or dict()
+        for name, value in last.items():
+            if isinstance(value, (int, long, float)) and not isinstance(value, bool):
+                batch.setdefault((KIND_METRIC, name), dict())[i] = value
+    for key in batch:
+        if key in columns:
+            continue
+        kind, name = key
+        if kind == KIND_RUN:
+            type = dict(RUN_COLUMNS)[name]
+        elif kind == KIND_METRIC:
+            type = TYPE_NUMERIC
+        else:
+            type = TYPE_CODED
+        file_id = 'c' + str(len(columns))
+        columns[key] = ResultColumn(name, kind, type, file_id)
+        schema['columns'].append(columns[key].to_dict())
+    # Append the values of every column. Columns that are new to the store are
+    # padded with missing values for all previous rows.
+    for key, column in columns.items():
+        values = batch.get(key, dict())
+        if column.type == TYPE_UNIQUE:
+            column.append_dictionary(
+                [json.dumps(values.get(i)) for i in range(len(entries))]
+            )
+        elif column.type == TYPE_NUMERIC:
+            data = array.array(TYPE_NUMERIC)
+            for i in range(len(entries)):
+                value = values.get(i)
+                data.append(float(value) if not value is None else MISSING_NUMBER)
+            append_array(column, rows, data, MISSING_NUMBER)
+        else:
+            labels = dict()
+            if len(values) > 0:
+                dictionary = column.read_dictionary()
+                for code in range(len(dictionary)):
+                    labels[json.dumps(dictionary[code])] = code
+            new_labels = list()
+            data = array.array(TYPE_CODED)
+            for i in range(len(entries)):
+                if not i in values or values[i] is None:
+                    data.append(MISSING_CODE)
+                    continue
+                label = json.dumps(values[i])
+                if not label in labels:
+                    labels[label] = column.size + len(new_labels)
+                    new_labels.append(label)
+                data.append(labels[label])
+            column.append_dictionary(new_labels)
+            append_array(column, rows, data, MISSING_CODE)
+    schema['rows'] = rows + len(entries)
+    schema['columns'] = [
+        columns[(c['kind'], c['name'])].to_dict() for c in schema['columns']
+    ]
+
+
+def append_array(column, rows, data, missing):
+    """Append an array of values to a column file that contains values for
+    the given number of rows. Files that are shorter (i.e., new columns) are
+    padded with missing values and longer files are truncated.
+
+    Parameters
+    ----------
+    column: ResultColumn
+        Numeric or coded column
+    rows: int
+        Number of rows in the store
+    data: array.array
+        Values for the appended rows
+    missing: int or float
+        Missing value
+    """
+    with open(get_column_file(column.file_id), 'ab') as f:
+        f.seek(0, os.SEEK_END)
+        count = f.tell() // data.itemsize
+        if count > rows:
+            f.truncate(rows * data.itemsize)
+        elif count < rows:
+            array.array(column.type, [missing] * (rows - count)).tofile(f)
+        data.tofile(f)
+
+
+def find_column(columns, name):
+    """Find a column by its name. Run attributes take precedence over
+    parameters and parameters over metrics unless the name is qualified.
+
+    Raises ValueError if the column does not exist.
+
+    Parameters
+    ----------
+    columns: list(ResultColumn)
+        Columns in the results store
+    name: string
+        Column name
+
+    Returns
+    -------
+    ResultColumn
+    """
+    kinds = [KIND_RUN, KIND_PARAM, KIND_METRIC]
+    col_name = name
+    for kind in [KIND_PARAM, KIND_METRIC]:
+        if name.startswith(kind + ':'):
+            kinds, col_name = [kind], name[len(kind) + 1:]
+    for kind in kinds:
+        for column in columns:
+            if column.kind == kind and column.name == col_name:
+                return column
+    raise ValueError('unknown column \'' + name + '\'')
+
+
+def format_value(value):
+    """Format a column value for printing.
+
+    Parameters
+    ----------
+    value: any
+
+    Returns
+    -------
+    string
+    """
+    if value is None:
+        return '-'
+    if isinstance(value, float):
+        return '%g' % value
+    if isinstance(value, basestring):
+        return value
+    return json.dumps(value)
+
+
+def get_column_file(file_id):
+    """Get the path to a column file.
+
+    Parameters
+    ----------
+    file_id: string
+        Name of the column file
+
+    Returns
+    -------
+    string
+    """
+    return os.path.join(get_results_dir(), file_id)
+
+
+def get_label(values, labels, pos):
+    """Get the value of a loaded column at the given position. Returns None
+    for missing values.
+
+    Parameters
+    ----------
+    values: array.array or list
+        Column values or codes
+    labels: list
+        Dictionary of the column (None for numeric columns)
+    pos: int
+        Row position
+
+    Returns
+    -------
+    any
+    """
+    if labels is None:
+        return values[pos] if not math.isnan(values[pos]) else None
+    code = values[pos]
+    return labels[code] if code != MISSING_CODE else None
+
+
+def get_results_dir():
+    """Get the path to the results directory of the repository in the current
+    working directory.
+
+    Returns
+    -------
+    string
+    """
+    return os.path.join(exp.REPO_DIR, exp.RESULTS_DIR)
+
+
+def load_column(column, rows):
+    """Load the values of a column. Returns the array of values or codes and
+    the dictionary of the column (None for numeric columns). Unique columns
+    are returned as coded columns with one code per row.
+
+    Parameters
+    ----------
+    column: ResultColumn
+        Column in the results store
+    rows: int
+        Number of rows
+
+    Returns
+    -------
+    array.array or list, list
+    """
+    if column.type == TYPE_NUMERIC:
+        return column.read_values(rows), None
+    if column.type == TYPE_UNIQUE:
+        return range(rows), column.read_dictionary()
+    return column.read_values(rows), column.read_dictionary()
+
+
+def new_schema():
+    """Get the schema of an empty results store.
+
+    Returns
+    -------
+    dict
+    """
+    return {'rows': 0, 'entries': 0, 'columns': list()}
+
+
+def parse_filter(expr):
+    """Parse a filter expression of format <column><op><value>. Returns the
+    column name, the comparison operator and the value.
+
+    Raises ValueError if the expression is invalid.
+
+    Parameters
+    ----------
+    expr: string
+        Filter expression
+
+    Returns
+    -------
+    string, string, string
+    """
+    pos = len(expr)
+    match = None
+    for op, func in OPERATORS:
+        i = expr.find(op)
+        if i > 0 and (i < pos or (i == pos and len(op) > len(match[0]))):
+            pos, match = i, (op, func)
+    if match is None:
+        raise ValueError('invalid filter \'' + expr + '\'')
+    return expr[:pos], match[0], expr[pos + len(match[0]):]
+
+
+def read_schema():
+    """Read the schema of the results store. Returns the schema of an empty
+    store if the schema file does not exist.
+
+    Returns
+    -------
+    dict
+    """
+    schema_file = os.path.join(get_results_dir(), SCHEMA_FILE)
+    if not os.path.isfile(schema_file):
+        return new_schema()
+    with open(schema_file, 'r') as f:
+        return json.load(f)
+
+
+def sort_key(key):
+    """Sort key for group values. Numbers are sorted before other values and
+    missing values come last.
+
+    Parameters
+    ----------
+    key: tuple
+        Group values
+
+    Returns
+    -------
+    tuple
+    """
+    result = list()
+    for value in key:
+        number = to_number(value)
+        if not number is None:
+            result.append((0, number, ''))
+        elif value is None:
+            result.append((2, 0, ''))
+        else:
+            result.append((1, 0, format_value(value)))
+    return tuple(result)
+
+
+def to_number(value):
+    """Convert a value to float. Returns None if the value is not numeric.
+
+    Parameters
+    ----------
+    value: any
+
+    Returns
+    -------
+    float
+    """
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def write_schema(schema):
+    """Replace the schema file of the results store atomically.
+
+    Parameters
+    ----------
+    schema: dict
+        Schema of the results store
+    """
+    schema_file = os.path.join(get_results_dir(), SCHEMA_FILE)
+    tmp_file = schema_file + '.' + uuid.uuid4().hex
+    with open(tmp_file, 'w') as f:
+        json.dump(schema, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp_file, schema_file)
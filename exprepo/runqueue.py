@@ -0,0 +1,414 @@
+"""Everything related to the local run queue.
+
+The run queue coordinates runs of all repositories that use the same queue
+directory on a machine. It does not require a server process. The queue
+state is kept in a file in the queue directory and every access is
+serialized by a file lock. Each run requests a ticket for the number of CPUs
+and the amount of memory it needs. Tickets are admitted in order of their
+priority (and request time) once enough resources are available. Tickets of
+processes that no longer exist are removed automatically.
+
+The default queue directory is private to the user. Teammates share a queue
+by setting XPR_QUEUE_DIR to a group-writable directory that any of them may
+own, as long as all of them are members of the group of the directory.
+Queue directories that any user can write to are rejected, and files in the
+queue directory are never opened through symbolic links.
+"""
+
+import errno
+import fcntl
+import json
+import multiprocessing
+import os
+import socket
+import stat
+import time
+import uuid
+
+
+# ------------------------------------------------------------------------------
+# Constants
+# ------------------------------------------------------------------------------
+
+"""Environment variables that override the queue directory and the resources
+of the machine."""
+ENV_QUEUE_CPUS = 'XPR_QUEUE_CPUS'
+ENV_QUEUE_DIR = 'XPR_QUEUE_DIR'
+ENV_QUEUE_MEMORY = 'XPR_QUEUE_MEMORY'
+
+"""Prefix of the default queue directory. The directory name ends with the
+user id."""
+QUEUE_DIR = '/tmp/exprepo-queue-'
+
+"""Names of the files in the queue directory."""
+QUEUE_LOCK_FILE = 'lock'
+QUEUE_STATE_FILE = 'state'
+
+"""Seconds between attempts to admit a waiting ticket."""
+POLL_INTERVAL = 0.5
+
+"""Suffixes for memory sizes."""
+MEMORY_UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+
+# ------------------------------------------------------------------------------
+# Classes
+# ------------------------------------------------------------------------------
+
+class QueueLock(object):
+    """Exclusive lock on the queue state. Reads the state when the lock is
+    acquired and writes it when the lock is released.
+    """
+    def __init__(self):
+        self.queue_dir = get_queue_dir()
+        self.state = None
+        self.f_lock = None
+
+    def __enter__(self):
+        self.f_lock = open_shared(os.path.join(self.queue_dir, QUEUE_LOCK_FILE))
+        fcntl.flock(self.f_lock.fileno(), fcntl.LOCK_EX)
+        filename = os.path.join(self.queue_dir, QUEUE_STATE_FILE)
+        self.state = {'running': dict(), 'waiting': dict()}
+        with open_shared(filename, 'r') as f:
+            try:
+                self.state = json.load(f)
+            except ValueError:
+                # Start with an empty queue if the state is empty or
+                # corrupted
+                pass
+        prune(self.state)
+        return self.state
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            # The state file is overwritten in place since the files of
+            # other group members cannot be replaced in a shared queue
+            # directory. It is only truncated after the new state has been
+            # written and is synced before the lock is released.
+            filename = os.path.join(self.queue_dir, QUEUE_STATE_FILE)
+            with open_shared(filename) as f:
+                json.dump(self.state, f)
+                f.truncate(f.tell())
+                f.flush()
+                os.fsync(f.fileno())
+        finally:
+            fcntl.flock(self.f_lock.fileno(), fcntl.LOCK_UN)
+            self.f_lock.close()
+        return False
+
+
+# ------------------------------------------------------------------------------
+# API Methods
+# ------------------------------------------------------------------------------
+
+def acquire(cpus=1, memory=0, priority=0):
+    """Request a ticket for a run with the given resource requirements and
+    block until the ticket is admitted. Returns the ticket identifier and the
+    time in seconds that the run waited in the queue.
+
+    Raises ValueError if the requirements exceed the resources of the machine.
+
+    Parameters
+    ----------
+    cpus: int, optional
+        Number of CPUs
+    memory: int, optional
+        Memory in bytes
+    priority: int, optional
+        Priority of the run. Runs with higher priority are admitted first.
+
+    Returns
+    -------
+    string, float
+    """
+    capacity_cpus, capacity_memory = get_capacity()
+    if cpus > capacity_cpus:
+        raise ValueError('cannot request more than ' + str(capacity_cpus) + ' CPUs')
+    if memory > capacity_memory:
+        raise ValueError('cannot request more than ' + str(capacity_memory) + ' bytes of memory')
+    ticket_id = uuid.uuid4().hex[:16]
+    start = time.time()
+    with QueueLock() as state:
+        state['waiting'][ticket_id] = {
+            'pid': os.getpid(),
+            'host': socket.gethostname(),
+            'cwd': os.getcwd(),
+            'cpus': cpus,
+            'memory': memory,
+            'priority': priority,
+            'time': start
+        }
+    try:
+        while True:
+            with QueueLock() as state:
+                if is_admissible(state, ticket_id, capacity_cpus, capacity_memory):
+                    ticket = state['waiting'].pop(ticket_id)
+                    state['running'][ticket_id] = ticket
+                    return ticket_id, time.time() - start
+            time.sleep(POLL_INTERVAL)
+    except BaseException:
+        # Remove the ticket if waiting is interrupted
+        release(ticket_id)
+        raise
+
+
+def get_capacity():
+    """Get the number of CPUs and the amount of memory (in bytes) that are
+    available for runs on this machine.
+
+    Returns
+    -------
+    int, int
+    """
+    if ENV_QUEUE_CPUS in os.environ:
+        cpus = int(os.environ[ENV_QUEUE_CPUS])
+    else:
+        cpus = multiprocessing.cpu_count()
+    if ENV_QUEUE_MEMORY in os.environ:
+        memory = parse_memory(os.environ[ENV_QUEUE_MEMORY])
+    else:
+        memory = 0
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemTotal:'):
+                    memory = int(line.split()[1]) * 1024
+                    break
+    return cpus, memory
+
+
+def get_queue_dir():
+    """Get the queue directory. The default directory is private to the
+    current user and is created if it does not exist. A directory of another
+    user is accepted if the current user is a member of its group.
+
+    Raises RuntimeError if the directory is neither owned by the current user
+    (or root) nor by a group of the current user, or if it is writable by all
+    users.
+
+    Returns
+    -------
+    string
+    """
+    queue_dir = os.environ.get(ENV_QUEUE_DIR)
+    if queue_dir is None:
+        queue_dir = QUEUE_DIR + str(os.getuid())
+        try:
+            os.mkdir(queue_dir, 0o700)
+        except OSError as ex:
+            if ex.errno != errno.EEXIST:
+                raise
+    # Use lstat to reject a symbolic link in place of the directory
+    info = os.lstat(queue_dir)
+    if not stat.S_ISDIR(info.st_mode):
+        raise RuntimeError('queue directory \'' + queue_dir + '\' is not a directory')
+    if info.st_mode & stat.S_IWOTH:
+        raise RuntimeError('insecure queue directory \'' + queue_dir + '\'')
+    if not info.st_uid in [os.getuid(), 0]:
+        if not info.st_gid in [os.getgid()] + os.getgroups():
+            raise RuntimeError('insecure queue directory \'' + queue_dir + '\'')
+    return queue_dir
+
+
+def parse_memory(value):
+    """Parse a memory size. The value is either a number of bytes or a number
+    followed by one of the units K, M, G, or T.
+
+    Raises ValueError if the value is not a valid memory size.
+
+    Parameters
+    ----------
+    value: string
+        Memory size
+
+    Returns
+    -------
+    int
+    """
+    value = str(value).strip().upper()
+    factor = 1
+    if value[-1:] in MEMORY_UNITS:
+        factor = MEMORY_UNITS[value[-1]]
+        value = value[:-1]
+    try:
+        return int(float(value) * factor)
+    except ValueError:
+        raise ValueError('invalid memory size \'' + value + '\'')
+
+
+def print_queue():
+    """Print the running and waiting tickets in the queue."""
+    cpus, memory = get_capacity()
+    with QueueLock() as state:
+        running = state['running']
+        waiting = state['waiting']
+    used_cpus = sum([running[t]['cpus'] for t in running])
+    used_memory = sum([running[t]['memory'] for t in running])
+    print 'cpus: ' + str(used_cpus) + '/' + str(cpus)
+    print 'memory: ' + format_memory(used_memory) + '/' + format_memory(memory)
+    for label, tickets in [('running', running), ('waiting', waiting)]:
+        print '\n' + label + ':'
+        for ticket_id in sorted(tickets, key=lambda t: rank(tickets[t])):
+            ticket = tickets[ticket_id]
+            print '  ' + '  '.join([
+                ticket_id,
+                str(ticket['pid']),
+                'cpus=' + str(ticket['cpus']),
+                'memory=' + format_memory(ticket['memory']),
+                'priority=' + str(ticket['priority']),
+                ticket['cwd']
+            ])
+
+
+def release(ticket_id):
+    """Remove the ticket with the given identifier from the queue.
+
+    Parameters
+    ----------
+    ticket_id: string
+        Unique ticket identifier
+    """
+    with QueueLock() as state:
+        state['running'].pop(ticket_id, None)
+        state['waiting'].pop(ticket_id, None)
+
+
+# ------------------------------------------------------------------------------
+# Helper Methods
+# ------------------------------------------------------------------------------
+
+def format_memory(value):
+    """Get a human readable representation of a memory size.
+
+    Parameters
+    ----------
+    value: int
+        Memory size in bytes
+
+    Returns
+    -------
+    string
+    """
+    for unit in ['T', 'G', 'M', 'K']:
+        if value >= MEMORY_UNITS[unit]:
+            return '%.1f%s' % (float(value) / MEMORY_UNITS[unit], unit)
+    return str(value)
+
+
+def is_admissible(state, ticket_id, capacity_cpus, capacity_memory):
+    """Test whether the waiting ticket with the given identifier can be
+    admitted. A ticket is admitted if it is the first waiting ticket in rank
+    order and if enough resources are available.
+
+    Parameters
+    ----------
+    state: dict
+        Queue state
+    ticket_id: string
+        Unique ticket identifier
+    capacity_cpus: int
+        Number of CPUs of the machine
+    capacity_memory: int
+        Memory of the machine in bytes
+
+    Returns
+    -------
+    bool
+    """
+    waiting = state['waiting']
+    head = min(waiting, key=lambda t: rank(waiting[t]))
+    if head != ticket_id:
+        return False
+    running = state['running']
+    ticket = waiting[ticket_id]
+    used_cpus = sum([running[t]['cpus'] for t in running])
+    used_memory = sum([running[t]['memory'] for t in running])
+    if used_cpus + ticket['cpus'] > capacity_cpus:
+        return False
+    return used_memory + ticket['memory'] <= capacity_memory
+
+
+def is_alive(pid):
+    """Test whether a process with the given identifier exists.
+
+    Parameters
+    ----------
+    pid: int
+        Process identifier
+
+    Returns
+    -------
+    bool
+    """
+    try:
+        os.kill(pid, 0)
+    except OSError as ex:
+        # The process exists if it belongs to another user
+        return ex.errno == errno.EPERM
+    return True
+
+
+def open_shared(filename, mode='w'):
+    """Open a file in the queue directory. The file is created if it does
+    not exist. Symbolic links are not followed. The file can be modified by
+    the group if the queue directory is group-writable.
+
+    Raises RuntimeError if the path is not a regular file.
+
+    Parameters
+    ----------
+    filename: string
+        Path to the file
+    mode: string, optional
+        Open the file for reading ('r') or writing ('w')
+
+    Returns
+    -------
+    file
+    """
+    flags = os.O_RDONLY if mode == 'r' else os.O_WRONLY
+    dir_mode = os.stat(os.path.dirname(os.path.abspath(filename))).st_mode
+    file_mode = 0o660 if dir_mode & stat.S_IWGRP else 0o600
+    fd = os.open(filename, flags | os.O_CREAT | os.O_NOFOLLOW, file_mode)
+    try:
+        info = os.fstat(fd)
+        if not stat.S_ISREG(info.st_mode):
+            raise RuntimeError('invalid queue file \'' + filename + '\'')
+        if info.st_uid == os.getuid() and stat.S_IMODE(info.st_mode) != file_mode:
+            # The creation mode is restricted by the umask
+            os.fchmod(fd, file_mode)
+    except BaseException:
+        os.close(fd)
+        raise
+    return os.fdopen(fd, mode)
+
+
+def prune(state):
+    """Remove tickets of processes that no longer exist from the queue state.
+
+    Parameters
+    ----------
+    state: dict
+        Queue state
+    """
+    host = socket.gethostname()
+    for tickets in [state['running'], state['waiting']]:
+        for ticket_id in list(tickets.keys()):
+            ticket = tickets[ticket_id]
+            if ticket['host'] == host and not is_alive(ticket['pid']):
+                del tickets[ticket_id]
+
+
+def rank(ticket):
+    """Get the sort key for a ticket. Tickets with higher priority come first.
+    Tickets with equal priority are ordered by their request time.
+
+    Parameters
+    ----------
+    ticket: dict
+        Queue ticket
+
+    Returns
+    -------
+    tuple
+    """
+    return (-ticket['priority'], ticket['time'])
@@ -0,0 +1,390 @@
+"""Everything related to adaptive parameter search.
+
+A search runs a registered command for a given number of trials. The
+parameter values of each trial are sampled from the search space that is
+given by the command arguments. Arguments are of format <key>=<value>, where
+the value is either a list of values or an integer range (as for parameter
+sweeps), a continuous range <low>:<high>, a log-scaled continuous range
+<low>:<high>:log, or a single fixed value. Values are sampled at random or
+from a Latin hypercube that spreads the samples evenly over each dimension.
+
+Commands report metrics by printing JSON objects on standard output (e.g.,
+{"step": 3, "loss": 0.25}). With asynchronous successive halving (asha) or
+Hyperband, runs are stopped early at rungs of the step value if their metric
+is not among the best 1/eta of the values that were reported at the same
+rung. Stopped runs free their slot for the next trial. Hyperband distributes
+the trials over brackets whose first rung is at increasing steps.
+"""
+
+import math
+import random
+import threading
+
+from exprepo.command import CommandTemplate, expand_value, get_command
+from exprepo.command import run_points
+from exprepo.results import sync_results
+from exprepo.settings import get_global_variables, get_settings
+
+
+# ------------------------------------------------------------------------------
+# Constants
+# ------------------------------------------------------------------------------
+
+"""Search methods."""
+METHOD_ASHA = 'asha'
+METHOD_HYPERBAND = 'hyperband'
+METHOD_LHS = 'lhs'
+METHOD_RANDOM = 'random'
+SEARCH_METHODS = [METHOD_ASHA, METHOD_HYPERBAND, METHOD_LHS, METHOD_RANDOM]
+
+"""Optimization modes for the metric."""
+MODE_MAX = 'max'
+MODE_MIN = 'min'
+
+"""Separator for continuous ranges and the flag for log-scaled ranges."""
+SEARCH_RANGE_SEPARATOR = ':'
+SEARCH_RANGE_LOG = 'log'
+
+"""Key of the step value in reported metrics."""
+STEP_KEY = 'step'
+
+"""Number of best trials that are printed at the end of a search."""
+SUMMARY_SIZE = 10
+
+
+# ------------------------------------------------------------------------------
+# Classes
+# ------------------------------------------------------------------------------
+
+class Dimension(object):
+    """Dimension of the search space. A dimension is either a list of
+    choices or a continuous range that may be log-scaled.
+    """
+    def __init__(self, key, choices=None, low=None, high=None, log=False):
+        """Initialize the dimension.
+
+        Parameters
+        ----------
+        key: string
+            Parameter path
+        choices: list(string), optional
+            List of values
+        low: float, optional
+            Lower bound of a continuous range
+        high: float, optional
+            Upper bound of a continuous range
+        log: bool, optional
+            Sample the continuous range on a log scale
+        """
+        self.key = key
+        self.choices = choices
+        self.low = low
+        self.high = high
+        self.log = log
+
+    @staticmethod
+    def parse(arg):
+        """Parse a command argument of format <key>=<value>.
+
+        Raises ValueError if the argument is of invalid format.
+
+        Parameters
+        ----------
+        arg: string
+            Command argument
+
+        Returns
+        -------
+        Dimension
+        """
+        pos = arg.find('=')
+        if pos < 0:
+            raise ValueError('invalid argument \'' + arg + '\'')
+        key, value = arg[:pos], arg[pos+1:]
+        bounds = value.split(SEARCH_RANGE_SEPARATOR)
+        if len(bounds) == 1:
+            return Dimension(key, choices=expand_value(value))
+        log = len(bounds) == 3 and bounds[2] == SEARCH_RANGE_LOG
+        if len(bounds) > 3 or (len(bounds) == 3 and not log):
+            raise ValueError('invalid range \'' + value + '\'')
+        try:
+            low, high = float(bounds[0]), float(bounds[1])
+        except ValueError:
+            raise ValueError('invalid range \'' + value + '\'')
+        if low >= high or (log and low <= 0):
+            raise ValueError('invalid range \'' + value + '\'')
+        return Dimension(key, low=low, high=high, log=log)
+
+    def value(self, u):
+        """Get the value at the given quantile of the dimension.
+
+        Parameters
+        ----------
+        u: float
+            Quantile in [0, 1)
+
+        Returns
+        -------
+        string
+        """
+        if not self.choices is None:
+            return self.choices[min(int(u * len(self.choices)), len(self.choices) - 1)]
+        if self.log:
+            low, high = math.log(self.low), math.log(self.high)
+            return repr(math.exp(low + u * (high - low)))
+        return repr(self.low + u * (self.high - self.low))
+
+
+class SuccessiveHalving(object):
+    """Asynchronous successive halving of runs based on reported metrics.
+    Each trial belongs to a bracket. The rungs of bracket s are at steps
+    min_step * eta^(s + k). When a run reports its metric at or after a rung
+    step, the run is stopped unless its value is among the best 1/eta of all
+    values reported at this rung so far. Methods are thread-safe.
+    """
+    def __init__(self, metric, mode=MODE_MIN, min_step=1, eta=3, brackets=1):
+        """Initialize the rungs.
+
+        Parameters
+        ----------
+        metric: string
+            Key of the metric in reported objects
+        mode: string, optional
+            Minimize (min) or maximize (max) the metric
+        min_step: int, optional
+            Step of the first rung in the first bracket
+        eta: int, optional
+            Reduction factor
+        brackets: int, optional
+            Number of brackets
+        """
+        self.metric = metric
+        self.mode = mode
+        self.min_step = min_step
+        self.eta = eta
+        self.brackets = brackets
+        self.lock = threading.Lock()
+        # Reported values for each rung keyed by bracket and rung index
+        self.rungs = dict()
+        # Bracket and index of the next rung for each run
+        self.runs = dict()
+
+    def report(self, run_id, obj):
+        """Record a reported object of a run. Returns True if the run should
+        be stopped. Objects without the metric are ignored.
+
+        Parameters
+        ----------
+        run_id: string
+            Unique run identifier
+        obj: dict
+            Reported object
+
+        Returns
+        -------
+        bool
+        """
+        if not self.metric in obj or not STEP_KEY in obj:
+            return False
+        try:
+            value = float(obj[self.metric])
+            step = float(obj[STEP_KEY])
+        except (TypeError, ValueError):
+            return False
+        if self.mode == MODE_MAX:
+            value = -value
+        with self.lock:
+            if not run_id in self.runs:
+                # Assign runs to brackets in the order of their first report
+                self.runs[run_id] = [len(self.runs) % self.brackets, 0]
+            bracket, rung = self.runs[run_id]
+            rung_step = self.min_step * self.eta ** (bracket + rung)
+            if step < rung_step:
+                return False
+            values = self.rungs.setdefault((bracket, rung), list())
+            values.append(value)
+            self.runs[run_id][1] = rung + 1
+            # Keep the run if its value is among the best 1/eta of the values
+            # at this rung
+            k = max(1, len(values) // self.eta)
+            return value > sorted(values)[k - 1]
+
+
+# ------------------------------------------------------------------------------
+# API Methods
+# ------------------------------------------------------------------------------
+
+def run_search(prg_name, name, args, method=METHOD_RANDOM, trials=10, jobs=1, metric=None, mode=MODE_MIN, min_step=1, max_step=None, eta=3, seed=None):
+    """Run a search over the parameter space that is given by the command
+    arguments. Each trial runs the registered command with sampled parameter
+    values. Trials are run using a pool of at most jobs workers and every run
+    is added to the log. With successive halving (asha) or Hyperband, runs
+    whose metric is not among the best at a rung are stopped early. At the
+    end, the best trials by their last reported metric are printed.
+
+    Raises ValueError if the command is unknown or if an argument or option
+    is invalid.
+
+    Parameters
+    ----------
+    prg_name: string
+        Name with which the program was called
+    name: string
+        Name of the command
+    args: list(string)
+        Search space (see Dimension.parse)
+    method: string, optional
+        Search method
+    trials: int, optional
+        Number of trials
+    jobs: int, optional
+        Maximum number of trials that are run concurrently
+    metric: string, optional
+        Key of the metric in objects reported by the command
+    mode: string, optional
+        Minimize (min) or maximize (max) the metric
+    min_step: int, optional
+        Step of the first rung
+    max_step: int, optional
+        Maximum step of a run (determines the number of Hyperband brackets)
+    eta: int, optional
+        Reduction factor for successive halving
+    seed: int, optional
+        Seed for the random number generator
+    """
+    if not method in SEARCH_METHODS:
+        raise ValueError('unknown search method \'' + str(method) + '\'')
+    if not mode in [MODE_MAX, MODE_MIN]:
+        raise ValueError('invalid mode \'' + str(mode) + '\'')
+    if trials < 1:
+        raise ValueError('invalid number of trials \'' + str(trials) + '\'')
+    if min_step <= 0:
+        raise ValueError('invalid minimum step \'' + str(min_step) + '\'')
+    if eta < 2:
+        raise ValueError('invalid reduction factor \'' + str(eta) + '\'')
+    pruner = None
+    if method in [METHOD_ASHA, METHOD_HYPERBAND]:
+        if metric is None:
+            raise ValueError('missing metric for method \'' + method + '\'')
+        brackets = 1
+        if method == METHOD_HYPERBAND:
+            if max_step is None or max_step < min_step:
+                raise ValueError('invalid maximum step \'' + str(max_step) + '\'')
+            brackets = int(math.log(float(max_step) / min_step, eta) + 1e-9) + 1
+        pruner = SuccessiveHalving(
+            metric,
+            mode=mode,
+            min_step=min_step,
+            eta=eta,
+            brackets=brackets
+        )
+    rng = random.Random(seed)
+    dimensions = [Dimension.parse(arg) for arg in args]
+    if method == METHOD_LHS:
+        overrides = sample_latin_hypercube(dimensions, trials, rng)
+    else:
+        overrides = sample_random(dimensions, trials, rng)
+    template = CommandTemplate(get_command(name))
+    points = template.render_many(get_settings(), get_global_variables(), overrides)
+    # Reported objects are recorded for all methods but runs are only
+    # stopped by successive halving
+    if pruner is None:
+        report = lambda run_id, obj: False
+    else:
+        report = pruner.report
+    entries = run_points(prg_name, name, points, jobs=jobs, metrics=report)
+    sync_results()
+    print_summary(entries, metric=metric, mode=mode)
+
+
+# ------------------------------------------------------------------------------
+# Helper Methods
+# ------------------------------------------------------------------------------
+
+def print_summary(entries, metric=None, mode=MODE_MIN):
+    """Print the number of completed and stopped trials and the best trials
+    by their last reported metric value.
+
+    Parameters
+    ----------
+    entries: list(dict)
+        Log entries of the trials
+    metric: string, optional
+        Key of the metric in reported objects
+    mode: string, optional
+        Minimize (min) or maximize (max) the metric
+    """
+    stopped = len([e for e in entries if e.get('stopped')])
+    print str(len(entries) - stopped) + ' trials completed, ' + str(stopped) + ' stopped'
+    if metric is None:
+        return
+    ranked = list()
+    for entry in entries:
+        last = entry.get('metrics', dict()).get('last')
+        if not last is None and metric in last:
+            try:
+                ranked.append((float(last[metric]), entry))
+            except (TypeError, ValueError):
+                pass
+    ranked.sort(key=lambda e: e[0], reverse=(mode == MODE_MAX))
+    for value, entry in ranked[:SUMMARY_SIZE]:
+        last = entry['metrics']['last']
+        line = [entry['id'], metric + '=' + str(value)]
+        if STEP_KEY in last:
+            line.append(STEP_KEY + '=' + str(last[STEP_KEY]))
+        if entry.get('stopped'):
+            line.append('stopped')
+        line.append(' '.join(entry['args']))
+        print '  '.join(line)
+
+
+def sample_latin_hypercube(dimensions, trials, rng):
+    """Sample parameter values from a Latin hypercube. Each dimension is
+    divided into as many strata as there are trials and every stratum is
+    sampled once.
+
+    Parameters
+    ----------
+    dimensions: list(Dimension)
+        Dimensions of the search space
+    trials: int
+        Number of trials
+    rng: random.Random
+        Random number generator
+
+    Returns
+    -------
+    list(dict)
+    """
+    overrides = [dict() for i in range(trials)]
+    for dim in dimensions:
+        strata = list(range(trials))
+        rng.shuffle(strata)
+        for i in range(trials):
+            overrides[i][dim.key] = dim.value((strata[i] + rng.random()) / trials)
+    return overrides
+
+
+def sample_random(dimensions, trials, rng):
+    """Sample parameter values independently and uniformly at random.
+
+    Parameters
+    ----------
+    dimensions: list(Dimension)
+        Dimensions of the search space
+    trials: int
+        Number of trials
+    rng: random.Random
+        Random number generator
+
+    Returns
+    -------
+    list(dict)
+    """
+    overrides = list()
+    for i in range(trials):
+        values = dict()
+        for dim in dimensions:
+            values[dim.key] = dim.value(rng.random())
+        overrides.append(values)
+    return overrides
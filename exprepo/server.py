@@ -0,0 +1,362 @@
+"""Everything related to the repository server.
+
+The repository server is an optional background process that runs commands
+for the repository in its working directory. Clients connect to the server
+through a unix socket in the repository directory (see exprepo.client). The
+server keeps the command registry, settings and global variables in memory
+and reloads them when the files change. Each request is handled in a forked
+child process that inherits the loaded data. The child runs the command with
+the working directory, environment, standard input, standard output and
+standard error of the client.
+
+Terminated children are reaped when the server receives SIGCHLD. The number
+of concurrent requests is not limited since forwarded runs can take long.
+Each child is the leader of its own process group. Signals that the client
+forwards are sent to this group, as a terminal would do for a command that
+runs in the foreground.
+
+Only the owner of the server can use it. The socket is only accessible by
+the owner and connections of processes of other users are rejected.
+"""
+
+from _multiprocessing import recvfd
+import errno
+import json
+import os
+import signal
+import socket
+import SocketServer
+import struct
+import sys
+import threading
+import time
+import traceback
+
+import exprepo as exp
+from exprepo.client import get_socket_file, read_frame, send_frame
+from exprepo.client import FRAME_ACCEPT, FRAME_CONFIRM, FRAME_EXIT
+from exprepo.client import FRAME_REQUEST, FRAME_SIGNAL, FORWARDED_FDS
+from exprepo.command import get_registry_entries
+from exprepo.settings import get_global_variables, get_settings
+
+
+# ------------------------------------------------------------------------------
+# Constants
+# ------------------------------------------------------------------------------
+
+"""Seconds to wait for the server to start or stop."""
+SERVER_TIMEOUT = 5.0
+
+"""Socket option for the credentials of the peer process (pid, uid, gid).
+Python 2 does not define the constant; 17 is its value on Linux."""
+SO_PEERCRED = getattr(socket, 'SO_PEERCRED', 17)
+PEERCRED = struct.Struct('3i')
+
+
+# ------------------------------------------------------------------------------
+# Classes
+# ------------------------------------------------------------------------------
+
+class RepositoryServer(SocketServer.ForkingMixIn, SocketServer.UnixStreamServer):
+    """Unix socket server that forks a child process for every request. The
+    in-memory copies of registry and settings are refreshed before the child
+    is forked. Terminated children are reaped without blocking. The socket
+    is only accessible by the owner of the server and connections of other
+    users are rejected.
+    """
+    def server_bind(self):
+        # Create the socket without permissions for other users
+        umask = os.umask(0o077)
+        try:
+            SocketServer.UnixStreamServer.server_bind(self)
+        finally:
+            os.umask(umask)
+        os.chmod(self.server_address, 0o600)
+
+    def collect_children(self):
+        """Reap all terminated children. Unlike ForkingMixIn, never blocks
+        to limit the number of children.
+        """
+        while True:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except OSError as ex:
+                if ex.errno == errno.EINTR:
+                    continue
+                if ex.errno != errno.ECHILD:
+                    raise
+                pid = 0
+            if pid == 0:
+                break
+            if not self.active_children is None:
+                self.active_children.discard(pid)
+
+    def process_request(self, request, client_address):
+        try:
+            refresh()
+        except Exception:
+            # Errors are reported to the client when the command is run
+            traceback.print_exc()
+        SocketServer.ForkingMixIn.process_request(self, request, client_address)
+
+    def verify_request(self, request, client_address):
+        try:
+            creds = request.getsockopt(socket.SOL_SOCKET, SO_PEERCRED, PEERCRED.size)
+        except socket.error:
+            return False
+        _, uid, _ = PEERCRED.unpack(creds)
+        return uid == os.getuid()
+
+
+class RequestHandler(SocketServer.BaseRequestHandler):
+    """Handler that runs a forwarded command in the forked child process. The
+    command is only run after the client confirmed that it still waits for
+    the request to be accepted and passed its standard file descriptors.
+    """
+    def handle(self):
+        # Commands are waited for by the child itself
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, interrupt)
+        os.setpgid(0, 0)
+        frame = read_frame(self.request)
+        if frame is None or frame[0] != FRAME_REQUEST:
+            return
+        send_frame(self.request, FRAME_ACCEPT, '')
+        confirm = read_frame(self.request)
+        if confirm is None or confirm[0] != FRAME_CONFIRM:
+            return
+        try:
+            fds = [recvfd(self.request.fileno()) for _ in FORWARDED_FDS]
+        except OSError:
+            return
+        exit_code = handle_request(self.request, json.loads(frame[1]), fds)
+        send_frame(self.request, FRAME_EXIT, str(exit_code))
+
+
+# ------------------------------------------------------------------------------
+# API Methods
+# ------------------------------------------------------------------------------
+
+def get_server_pid():
+    """Get the process identifier of the server for the repository in the
+    current working directory. Returns None if no server is running.
+
+    Returns
+    -------
+    int
+    """
+    filename = get_pid_file()
+    if not os.path.isfile(filename):
+        return None
+    with open(filename, 'r') as f:
+        try:
+            pid = int(f.read().strip())
+        except ValueError:
+            return None
+    try:
+        os.kill(pid, 0)
+    except OSError as ex:
+        if ex.errno != errno.EPERM:
+            return None
+    return pid
+
+
+def print_server_status():
+    """Print whether a server is running for the repository in the current
+    working directory.
+    """
+    pid = get_server_pid()
+    if pid is None:
+        print 'server not running'
+    else:
+        print 'server running (pid ' + str(pid) + ')'
+
+
+def start_server():
+    """Start a server for the repository in the current working directory.
+    The server runs as a background process. Output of the server process is
+    written to the server log file in the repository directory.
+
+    Raises RuntimeError if the current directory is not a repository or if
+    a server is already running.
+    """
+    # Raise an exception if the current directory is not a repository
+    exp.get_base()
+    pid = get_server_pid()
+    if not pid is None:
+        raise RuntimeError('server already running (pid ' + str(pid) + ')')
+    socket_file = get_socket_file()
+    if os.path.exists(socket_file):
+        # Remove the socket of a server that was not shut down properly
+        os.remove(socket_file)
+    sys.stdout.flush()
+    pid = os.fork()
+    if pid == 0:
+        os.setsid()
+        null_fd = os.open(os.devnull, os.O_RDONLY)
+        log_fd = os.open(
+            os.path.join(exp.REPO_DIR, exp.SERVER_LOG_FILE),
+            os.O_WRONLY | os.O_CREAT | os.O_APPEND,
+            0o644
+        )
+        os.dup2(null_fd, 0)
+        os.dup2(log_fd, 1)
+        os.dup2(log_fd, 2)
+        try:
+            serve()
+        finally:
+            os._exit(0)
+    # Wait for the server to create the socket
+    start = time.time()
+    while not os.path.exists(socket_file):
+        if time.time() - start > SERVER_TIMEOUT:
+            raise RuntimeError('server did not start')
+        time.sleep(0.05)
+    print 'server started (pid ' + str(pid) + ')'
+
+
+def stop_server():
+    """Stop the server for the repository in the current working directory.
+
+    Raises RuntimeError if no server is running.
+    """
+    pid = get_server_pid()
+    if pid is None:
+        raise RuntimeError('server not running')
+    os.kill(pid, signal.SIGTERM)
+    start = time.time()
+    while not get_server_pid() is None:
+        if time.time() - start > SERVER_TIMEOUT:
+            raise RuntimeError('server did not stop (pid ' + str(pid) + ')')
+        time.sleep(0.05)
+    print 'server stopped'
+
+
+# ------------------------------------------------------------------------------
+# Helper Methods
+# ------------------------------------------------------------------------------
+
+def get_pid_file():
+    """Get the path to the file that contains the process identifier of the
+    repository server.
+
+    Returns
+    -------
+    string
+    """
+    return os.path.join(exp.REPO_DIR, exp.SERVER_PID_FILE)
+
+
+def handle_request(sock, request, fds):
+    """Run a forwarded command in the current (forked) process with the
+    working directory, environment and standard file descriptors of the
+    client. Returns the exit code of the command.
+
+    Parameters
+    ----------
+    sock: socket.socket
+        Connection to the client
+    request: dict
+        Forwarded request
+    fds: list(int)
+        Standard input, standard output and standard error of the client
+
+    Returns
+    -------
+    int
+    """
+    # The command line interface imports this module
+    from exprepo.cli import run
+    os.chdir(request['cwd'])
+    os.environ.clear()
+    os.environ.update(request['env'])
+    sys.stdout.flush()
+    sys.stderr.flush()
+    for target, fd in zip(FORWARDED_FDS, fds):
+        os.dup2(fd, target)
+        os.close(fd)
+    state = {'done': False}
+    receiver = threading.Thread(target=receive_signals, args=(sock, state))
+    receiver.daemon = True
+    receiver.start()
+    try:
+        exit_code = run(request['prg_name'], request['args'])
+    except KeyboardInterrupt:
+        exit_code = 128 + signal.SIGINT
+    except Exception:
+        traceback.print_exc()
+        exit_code = 1
+    state['done'] = True
+    sys.stdout.flush()
+    sys.stderr.flush()
+    # Release the descriptors of the client before it is told the exit code
+    null_fd = os.open(os.devnull, os.O_RDWR)
+    for target in FORWARDED_FDS:
+        os.dup2(null_fd, target)
+    os.close(null_fd)
+    return exit_code
+
+
+def interrupt(signum, frame):
+    """Signal handler that interrupts a forwarded command like SIGINT."""
+    raise KeyboardInterrupt()
+
+
+def receive_signals(sock, state):
+    """Deliver signals that the client forwards to the process group of the
+    current (forked) process. The group is terminated if the client
+    disconnects before the command is done.
+
+    Parameters
+    ----------
+    sock: socket.socket
+        Connection to the client
+    state: dict
+        Flag that is set when the command is done ('done')
+    """
+    while True:
+        try:
+            frame = read_frame(sock)
+        except socket.error:
+            frame = None
+        if frame is None:
+            if not state['done']:
+                os.killpg(0, signal.SIGTERM)
+            return
+        if frame[0] == FRAME_SIGNAL:
+            os.killpg(0, int(frame[1]))
+
+
+def refresh():
+    """Load the command registry, settings and global variables of the
+    repository in the current working directory. Data is only read from file
+    if the file has changed since it was last read.
+    """
+    get_registry_entries()
+    get_settings()
+    get_global_variables()
+
+
+def serve():
+    """Run the server for the repository in the current working directory
+    until it receives SIGTERM.
+    """
+    def terminate(signum, frame):
+        raise SystemExit(0)
+    def reap(signum, frame):
+        server.collect_children()
+    signal.signal(signal.SIGTERM, terminate)
+    socket_file = get_socket_file()
+    pid_file = get_pid_file()
+    server = RepositoryServer(socket_file, RequestHandler)
+    signal.signal(signal.SIGCHLD, reap)
+    try:
+        with open(pid_file, 'w') as f:
+            f.write(str(os.getpid()))
+        refresh()
+        server.serve_forever()
+    finally:
+        server.server_close()
+        for filename in [socket_file, pid_file]:
+            if os.path.exists(filename):
+                os.remove(filename)
@@ -1,9 +1,39 @@
 """Everything related to configuration settings."""
 
+import fcntl
 import os
+import uuid
 import yaml
 
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
 import exprepo as exp
+from exprepo.timing import timed
+
+
+# ------------------------------------------------------------------------------
+# Constants
+# ------------------------------------------------------------------------------
+
+"""Yaml loader and dumper. Use the libyaml implementations if available."""
+try:
+    from yaml import CDumper as YamlDumper, CLoader as YamlLoader
+except ImportError:
+    from yaml import Dumper as YamlDumper, Loader as YamlLoader
+
+"""Suffix for binary snapshots of parsed Yaml files."""
+SNAPSHOT_SUFFIX = '.snapshot'
+
+"""Suffix for lock files that serialize updates of Yaml files."""
+LOCK_SUFFIX = '.lock'
+
+"""In-memory copies of parsed Yaml files keyed by the absolute file path. Each
+value is a tuple of modification time, size and parsed content of the
+file."""
+YAML_CACHE = dict()
 
 
 # ------------------------------------------------------------------------------
@@ -11,7 +41,13 @@ import exprepo as exp
 # ------------------------------------------------------------------------------
 
 class Config(object):
-    """Object excapsulating the dictionary containing repository settings."""
+    """Object excapsulating the dictionary containing repository settings. The
+    settings are represented as a chain of layers, e.g., the settings of the
+    base repository, the settings of a clone, and per-run overrides. Values in
+    upper layers take precedence over values in lower layers. Nested
+    dictionaries in different layers are merged lazily when a value is looked
+    up. Only the top layer is modified by update_value.
+    """
     def __init__(self, settings, defaults=None):
         """Initialize the settings dictionary from the given dictionary and an
         optional dictionary containing default values.
@@ -19,14 +55,58 @@ class Config(object):
         Parameters
         ----------
         settings: dict
-            Dictionary of settings
+            Dictionary of settings. An empty settings file is None.
         defaults: dict, optional
             Dictionary of default settings
         """
+        self.layers = [settings if not settings is None else dict()]
         if not defaults is None:
-            self.settings = nested_merge(defaults.copy(), settings)
+            self.layers.append(defaults)
+
+    def get_path(self, path):
+        """Return the value that is associated with the parameter with the
+        given path components. The value is taken from the uppermost layer
+        that contains the parameter.
+
+        Raises ValueError if the specified parameter does not exist or if it
+        references an internal dictionary in the nested settings dictionary.
+
+        Parameters
+        ----------
+        path: list(string)
+            Components of the configuration parameter path
+
+        Returns
+        -------
+        string
+        """
+        nodes = self.layers
+        for comp in path:
+            if nodes is None:
+                raise ValueError('cannot get value of \'' + '/'.join(path) + '\'')
+            # Collect the nested dictionaries for the path component from all
+            # layers until the first layer that contains a text value
+            children = []
+            value = None
+            for node in nodes:
+                if comp in node:
+                    el = node[comp]
+                    if isinstance(el, dict):
+                        children.append(el)
+                    else:
+                        if len(children) == 0:
+                            value = el
+                        break
+            if len(children) > 0:
+                nodes = children
+            elif not value is None:
+                nodes = None
+            else:
+                raise ValueError('unknown parameter \'' + '/'.join(path) + '\'')
+        if nodes is None:
+            return value
         else:
-            self.settings = settings
+            raise ValueError('cannot get value of \'' + '/'.join(path) + '\'')
 
     def get_value(self, para):
         """Return the value that is associated with the given parameter. The
@@ -44,25 +124,44 @@ class Config(object):
         -------
         string
         """
-        el = self.settings
-        for comp in para.split('/'):
-            if isinstance(el, dict):
-                if comp in el:
-                    el = el[comp]
-                else:
-                    raise ValueError('unknown parameter \'' + para + '\'')
-            else:
-                raise ValueError('cannot get value of \'' + para + '\'')
-        if not isinstance(el, dict):
-            return el
-        else:
-            raise ValueError('cannot get value of \'' + para + '\'')
+        return self.get_path(para.split('/'))
+
+    def overlay(self, values):
+        """Get a new configuration object that has an additional top layer
+        containing the given parameter values. The layers of this object are
+        shared with the new object and not copied.
+
+        Parameters
+        ----------
+        values: dict
+            Dictionary of parameter values keyed by parameter path
+
+        Returns
+        -------
+        Config
+        """
+        layer = dict()
+        for para in values:
+            path = para.strip('/').split('/')
+            el = layer
+            for comp in path[:-1]:
+                if not isinstance(el.get(comp), dict):
+                    el[comp] = dict()
+                el = el[comp]
+            el[path[-1]] = values[para]
+        config = Config(layer)
+        config.layers.extend(self.layers)
+        return config
 
     def print_values(self):
         """Print the current state of the settings dictionary. Output is in Yaml
         format.
         """
-        print yaml.dump(self.settings, default_flow_style=False)
+        print yaml.dump(
+            self.to_dict(),
+            Dumper=YamlDumper,
+            default_flow_style=False
+        )
 
     def update_value(self, para, value=None):
         """Update the value of a configuration parameter. The para argument may
@@ -92,7 +191,7 @@ class Config(object):
             raise ValueError('invalid parameter name \'' + para + '\'')
         # Find the element that is referenced by the path prefix. Create elements
         # along the path if necessary
-        el = self.settings
+        el = self.layers[0]
         for comp in path[:-1]:
             if not comp in el:
                 el[comp] = dict()
@@ -114,15 +213,53 @@ class Config(object):
         filename: string
             Path for the output file
         """
-        with open(filename, 'w') as f:
-            yaml.dump(self.settings, f, default_flow_style=False)
+        write_yaml_file(filename, self.to_dict())
+
+    def to_dict(self):
+        """Get a dictionary containing the merged settings from all layers.
+
+        Returns
+        -------
+        dict
+        """
+        result = dict()
+        for layer in reversed(self.layers):
+            nested_merge(result, layer, copy=True)
+        return result
+
+
+class FileLock(object):
+    """Exclusive lock for updates of a file. The lock is held on a separate
+    lock file next to the file since the file itself is replaced when it is
+    written.
+    """
+    def __init__(self, filename):
+        """Initialize the lock for the given file.
+
+        Parameters
+        ----------
+        filename: string
+            Path to the locked file
+        """
+        self.lock_file = filename + LOCK_SUFFIX
+        self.f_lock = None
+
+    def __enter__(self):
+        self.f_lock = open(self.lock_file, 'a')
+        fcntl.flock(self.f_lock.fileno(), fcntl.LOCK_EX)
+        return self
 
+    def __exit__(self, exc_type, exc_value, traceback):
+        fcntl.flock(self.f_lock.fileno(), fcntl.LOCK_UN)
+        self.f_lock.close()
+        return False
 
 
 # ------------------------------------------------------------------------------
 # API Methods
 # ------------------------------------------------------------------------------
 
+@timed('settings')
 def get_global_variables():
     """Get current state of the global variables. This will read the GLOBAL file
     in the base directory.
@@ -134,6 +271,7 @@ def get_global_variables():
     return Config(read_yaml_file(get_global_variables_file()))
 
 
+@timed('settings')
 def get_settings(include_defaults=True):
     """Get current repository settings. This will read the settings file in the
     current working directory. By default, the settings from the repositories
@@ -189,9 +327,7 @@ def update_global_variables(para, value=None):
     value: string, optional
         New variable value or None (indicating delete)
     """
-    variables = get_global_variables()
-    variables.update_value(para, value=value)
-    variables.write(get_global_variables_file())
+    update_yaml_file(get_global_variables_file(), para, value=value)
 
 
 def update_settings(para, value=None):
@@ -211,10 +347,8 @@ def update_settings(para, value=None):
     value: string, optional
         New parameter value or None (indicating delete)
     """
-    # Make sure to only read the local settings file
-    config = get_settings(include_defaults=False)
-    config.update_value(para, value=value)
-    config.write(get_settings_file())
+    # Make sure to only update the local settings file
+    update_yaml_file(get_settings_file(), para, value=value)
 
 
 # ------------------------------------------------------------------------------
@@ -258,7 +392,22 @@ def get_settings_file(base_dir=None):
         return os.path.join(exp.REPO_DIR, exp.SETTINGS_FILE)
 
 
-def nested_merge(d1, d2):
+def get_snapshot_file(filename):
+    """Return the file name of the binary snapshot for the given Yaml file.
+
+    Parameters
+    ----------
+    filename: string
+        Path to the Yaml file
+
+    Returns
+    -------
+    string
+    """
+    return filename + SNAPSHOT_SUFFIX
+
+
+def nested_merge(d1, d2, copy=False):
     """Merge two dictionaries such that d1 will contain all the values from d2.
 
     Parameters
@@ -267,25 +416,38 @@ def nested_merge(d1, d2):
         Dictionary into which the second dictionary is merged
     d2: dict
         Dictionary of values that are merged into the first dictionary.
+    copy: bool, optional
+        Flag indicating whether nested dictionaries from d2 are copied instead
+        of being added to d1 directly.
 
     Returns
     -------
     dict
     """
     for key in d2:
-        if not key in d1:
-            d1[key] = d2[key]
-        elif isinstance(d1[key], dict) and isinstance(d2[key], dict):
-            d1[key] = nested_merge(d1[key], d2[key])
+        if isinstance(d2[key], dict):
+            if key in d1 and isinstance(d1[key], dict):
+                d1[key] = nested_merge(d1[key], d2[key], copy=copy)
+            elif copy:
+                d1[key] = nested_merge(dict(), d2[key], copy=copy)
+            else:
+                d1[key] = d2[key]
         else:
             d1[key] = d2[key]
     return d1
 
 
+@timed('yaml')
 def read_yaml_file(filename):
     """Read settings from the given file. Expets the file content to be in Yaml
     format. Returns an empty dictionary if the file does not exist.
 
+    The parsed content is kept in memory and in a binary snapshot next to the
+    Yaml file. The in-memory copy or the snapshot are used instead of parsing
+    the file as long as the modification time and size of the file match
+    those recorded with the copy. The returned dictionary is shared and must
+    not be modified by the caller.
+
     Parameters
     ----------
     filename: string
@@ -296,8 +458,112 @@ def read_yaml_file(filename):
     dict
     """
     # Read the settings file if it exist. Otherwise return an empty dictionary.
-    if os.path.isfile(filename):
-        with open(filename, 'r') as f:
-            return yaml.load(f.read())
-    else:
+    if not os.path.isfile(filename):
         return dict()
+    stat = os.stat(filename)
+    key = os.path.abspath(filename)
+    cached = YAML_CACHE.get(key)
+    if not cached is None and cached[:2] == (stat.st_mtime, stat.st_size):
+        return cached[2]
+    data = None
+    snapshot_file = get_snapshot_file(filename)
+    if os.path.isfile(snapshot_file):
+        try:
+            with open(snapshot_file, 'rb') as f:
+                mtime, size, snapshot = pickle.load(f)
+            if mtime == stat.st_mtime and size == stat.st_size:
+                data = snapshot
+        except Exception:
+            # Ignore snapshots that cannot be read. They will be replaced.
+            pass
+    if data is None:
+        with open(filename, 'r') as f:
+            # The key of the parsed content is taken from the file that is
+            # read. The file may be replaced after it was parsed.
+            stat = os.fstat(f.fileno())
+            data = yaml.load(f.read(), Loader=YamlLoader)
+        write_snapshot(filename, data, stat)
+    YAML_CACHE[key] = (stat.st_mtime, stat.st_size, data)
+    return data
+
+
+def update_yaml_file(filename, para, value=None):
+    """Update the value of a parameter in the given Yaml file (see
+    Config.update_value). The file is locked while it is read, modified and
+    written so that concurrent updates are not lost.
+
+    Raises ValueError if an invalid parameter name is given or if an existing
+    text element is referenced as part of a path expression.
+
+    Parameters
+    ----------
+    filename: string
+        Path to the Yaml file
+    para: string
+        Parameter path
+    value: string, optional
+        New parameter value or None (indicating delete)
+    """
+    with FileLock(filename):
+        # Modify a copy since the parsed file content is shared
+        data = nested_merge(dict(), read_yaml_file(filename) or dict(), copy=True)
+        config = Config(data)
+        config.update_value(para, value=value)
+        config.write(filename)
+
+
+def write_snapshot(filename, data, stat):
+    """Write binary snapshot of the parsed content of the given Yaml file. The
+    snapshot is first written to a temporary file that then replaces any
+    existing snapshot. Errors are ignored since snapshots are only a cache.
+
+    Parameters
+    ----------
+    filename: string
+        Path to the Yaml file
+    data: dict
+        Parsed file content
+    stat: posix.stat_result
+        Status of the file from which the content was parsed (or to which
+        it was written)
+    """
+    snapshot_file = get_snapshot_file(filename)
+    tmp_file = snapshot_file + '.' + uuid.uuid4().hex
+    try:
+        with open(tmp_file, 'wb') as f:
+            pickle.dump(
+                (stat.st_mtime, stat.st_size, data),
+                f,
+                pickle.HIGHEST_PROTOCOL
+            )
+        os.rename(tmp_file, snapshot_file)
+    except (IOError, OSError):
+        pass
+
+
+def write_yaml_file(filename, data):
+    """Write the given dictionary to file in Yaml format. Updates the binary
+    snapshot for the file. The dictionary is written to a temporary file
+    first that then replaces the file. Readers therefore never see a
+    partially written file.
+
+    Parameters
+    ----------
+    filename: string
+        Path for the output file
+    data: dict
+        Dictionary that is written
+    """
+    tmp_file = filename + '.' + uuid.uuid4().hex
+    try:
+        with open(tmp_file, 'w') as f:
+            yaml.dump(data, f, Dumper=YamlDumper, default_flow_style=False)
+            f.flush()
+            os.fsync(f.fileno())
+            stat = os.fstat(f.fileno())
+        os.rename(tmp_file, filename)
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+    write_snapshot(filename, data, stat)
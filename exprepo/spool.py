@@ -0,0 +1,326 @@
+"""Everything related to the job spool.
+
+The spool is a directory in the repository that acts as a job queue on a
+shared file system. Submitted jobs are written to the pending directory.
+Workers (see exprepo.worker) claim a job by renaming its file into the
+running directory. Renaming is atomic, so each job is claimed by exactly one
+worker. While a job is running, the worker touches a heartbeat file next to
+the job file. Jobs whose heartbeat is older than the stale timeout are moved
+back to the pending directory by any other worker. Jobs that were claimed
+too often are moved to the failed directory. Finished jobs are moved to the
+done or failed directory together with the log entry of the run.
+
+Job files are named by the submission time and the job identifier such that
+jobs are claimed in the order in which they were submitted. A job that is
+reclaimed from a worker that is still alive may be run twice.
+"""
+
+import errno
+import json
+import os
+import time
+import uuid
+
+import exprepo as exp
+
+
+# ------------------------------------------------------------------------------
+# Constants
+# ------------------------------------------------------------------------------
+
+"""Directories in the spool for jobs in different states."""
+DONE_DIR = 'done'
+FAILED_DIR = 'failed'
+PENDING_DIR = 'pending'
+RUNNING_DIR = 'running'
+SPOOL_STATES = [PENDING_DIR, RUNNING_DIR, DONE_DIR, FAILED_DIR]
+
+"""Suffixes of job files and heartbeat files."""
+HEARTBEAT_SUFFIX = '.hb'
+JOB_SUFFIX = '.json'
+
+"""Maximum number of times a job is claimed before it is failed."""
+MAX_ATTEMPTS = 3
+
+
+# ------------------------------------------------------------------------------
+# API Methods
+# ------------------------------------------------------------------------------
+
+def claim_job(worker_id):
+    """Claim the oldest pending job. Returns the name of the job file and the
+    job or None if no job is pending.
+
+    Parameters
+    ----------
+    worker_id: string
+        Unique identifier of the claiming worker
+
+    Returns
+    -------
+    (string, dict)
+    """
+    for job_name in list_jobs(PENDING_DIR):
+        job_file = get_job_file(RUNNING_DIR, job_name)
+        try:
+            os.rename(get_job_file(PENDING_DIR, job_name), job_file)
+        except OSError as ex:
+            # The job was claimed by another worker
+            if ex.errno == errno.ENOENT:
+                continue
+            raise
+        touch(get_heartbeat_file(job_name))
+        with open(job_file, 'r') as f:
+            job = json.load(f)
+        job['attempts'] = job.get('attempts', 0) + 1
+        job['worker'] = worker_id
+        write_json(job_file, job)
+        return job_name, job
+    return None
+
+
+def finish_job(job_name, job, entry):
+    """Move a claimed job to the done or failed directory. The job file
+    contains the log entry of the run.
+
+    Parameters
+    ----------
+    job_name: string
+        Name of the job file
+    job: dict
+        Claimed job
+    entry: dict
+        Log entry of the run
+    """
+    job['entry'] = entry
+    state = DONE_DIR if entry['exit_code'] == 0 else FAILED_DIR
+    write_json(get_job_file(state, job_name), job)
+    for filename in [get_job_file(RUNNING_DIR, job_name), get_heartbeat_file(job_name)]:
+        try:
+            os.remove(filename)
+        except OSError as ex:
+            # The job may have been reclaimed by another worker
+            if ex.errno != errno.ENOENT:
+                raise
+
+
+def get_spool_dir():
+    """Get the path to the spool directory of the repository in the current
+    working directory.
+
+    Returns
+    -------
+    string
+    """
+    return os.path.join(exp.REPO_DIR, exp.SPOOL_DIR)
+
+
+def list_jobs(state):
+    """Get the names of the job files in the directory for the given state in
+    order of their submission.
+
+    Parameters
+    ----------
+    state: string
+        Spool directory name
+
+    Returns
+    -------
+    list(string)
+    """
+    state_dir = os.path.join(get_spool_dir(), state)
+    if not os.path.isdir(state_dir):
+        return list()
+    return sorted([f for f in os.listdir(state_dir) if f.endswith(JOB_SUFFIX)])
+
+
+def print_spool():
+    """Print the number of jobs in each state and the running jobs with the
+    worker that claimed them and the age of their heartbeat.
+    """
+    for state in SPOOL_STATES:
+        print state + ': ' + str(len(list_jobs(state)))
+    now = time.time()
+    for job_name in list_jobs(RUNNING_DIR):
+        try:
+            with open(get_job_file(RUNNING_DIR, job_name), 'r') as f:
+                job = json.load(f)
+        except (IOError, ValueError):
+            # The job was finished or reclaimed in the meantime
+            continue
+        age = now - get_heartbeat(job_name)
+        print '  '.join([
+            job['id'],
+            job.get('worker', '?'),
+            'heartbeat %.0fs ago' % age,
+            ' '.join(job['args'])
+        ])
+
+
+def reclaim_jobs(stale):
+    """Move running jobs whose heartbeat is older than the given number of
+    seconds back to the pending directory. Jobs that have reached the
+    maximum number of attempts are moved to the failed directory instead.
+    Returns the jobs that were failed.
+
+    Parameters
+    ----------
+    stale: float
+        Seconds after which a heartbeat is stale
+
+    Returns
+    -------
+    list(dict)
+    """
+    failed = list()
+    now = time.time()
+    for job_name in list_jobs(RUNNING_DIR):
+        if now - get_heartbeat(job_name) <= stale:
+            continue
+        job_file = get_job_file(RUNNING_DIR, job_name)
+        # Move the job out of the running directory first to make sure that
+        # it is reclaimed by a single worker only
+        reclaim_file = job_file + '.' + uuid.uuid4().hex
+        try:
+            os.rename(job_file, reclaim_file)
+        except OSError as ex:
+            if ex.errno == errno.ENOENT:
+                continue
+            raise
+        with open(reclaim_file, 'r') as f:
+            job = json.load(f)
+        if job.get('attempts', 0) >= MAX_ATTEMPTS:
+            os.rename(reclaim_file, get_job_file(FAILED_DIR, job_name))
+            failed.append(job)
+        else:
+            os.rename(reclaim_file, get_job_file(PENDING_DIR, job_name))
+        try:
+            os.remove(get_heartbeat_file(job_name))
+        except OSError:
+            pass
+    return failed
+
+
+def spool_jobs(name, points, entries):
+    """Write jobs for the resolved points of a parameter sweep to the pending
+    directory of the spool. The identifier of the log entry for a point is
+    used as the job identifier.
+
+    Parameters
+    ----------
+    name: string
+        Name of the command
+    points: list((list(string), dict))
+        Command line components and parameter values for each point
+    entries: list(dict)
+        Log entries of the submitted points
+    """
+    for state in SPOOL_STATES:
+        state_dir = os.path.join(get_spool_dir(), state)
+        if not os.path.isdir(state_dir):
+            try:
+                os.makedirs(state_dir)
+            except OSError:
+                # The directory may have been created by a concurrent submit
+                if not os.path.isdir(state_dir):
+                    raise
+    submitted = int(time.time() * 1000000)
+    for i in range(len(points)):
+        cmd, params = points[i]
+        job = {
+            'id': entries[i]['id'],
+            'command': name,
+            'args': cmd,
+            'params': params,
+            'submitted': time.time()
+        }
+        job_name = '%016d-%s%s' % (submitted + i, job['id'], JOB_SUFFIX)
+        write_json(get_job_file(PENDING_DIR, job_name), job)
+
+
+def touch(filename):
+    """Set the modification time of a file to the current time. Creates the
+    file if it does not exist.
+
+    Parameters
+    ----------
+    filename: string
+        Path to the file
+    """
+    with open(filename, 'a'):
+        os.utime(filename, None)
+
+
+# ------------------------------------------------------------------------------
+# Helper Methods
+# ------------------------------------------------------------------------------
+
+def get_heartbeat(job_name):
+    """Get the time of the last heartbeat of a running job. Uses the time at
+    which the job file was renamed (i.e., claimed) if there is no heartbeat.
+
+    Parameters
+    ----------
+    job_name: string
+        Name of the job file
+
+    Returns
+    -------
+    float
+    """
+    try:
+        return os.stat(get_heartbeat_file(job_name)).st_mtime
+    except OSError:
+        pass
+    try:
+        return os.stat(get_job_file(RUNNING_DIR, job_name)).st_ctime
+    except OSError:
+        return time.time()
+
+
+def get_heartbeat_file(job_name):
+    """Get the path to the heartbeat file of a running job.
+
+    Parameters
+    ----------
+    job_name: string
+        Name of the job file
+
+    Returns
+    -------
+    string
+    """
+    return get_job_file(RUNNING_DIR, job_name) + HEARTBEAT_SUFFIX
+
+
+def get_job_file(state, job_name):
+    """Get the path to a job file in the directory for the given state.
+
+    Parameters
+    ----------
+    state: string
+        Spool directory name
+    job_name: string
+        Name of the job file
+
+    Returns
+    -------
+    string
+    """
+    return os.path.join(get_spool_dir(), state, job_name)
+
+
+def write_json(filename, obj):
+    """Write an object in JSON format. The file is replaced atomically.
+
+    Parameters
+    ----------
+    filename: string
+        Path to the file
+    obj: dict
+        Object
+    """
+    tmp_file = filename + '.' + uuid.uuid4().hex
+    with open(tmp_file, 'w') as f:
+        json.dump(obj, f, separators=(',', ':'))
+    os.rename(tmp_file, filename)
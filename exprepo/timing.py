@@ -0,0 +1,215 @@
+"""Timing instrumentation for the phases of repository commands.
+
+Code paths mark phases with the phase context manager or the timed
+decorator. Timing is disabled by default, in which case a phase only costs a
+flag test. When timing is enabled (e.g., by the --profile option of the
+command line interface or by the XPR_PROFILE environment variable), the
+number of calls, the total time and the self time (excluding nested phases)
+are accumulated for every phase name. Phases may be entered concurrently by
+multiple threads.
+"""
+
+import functools
+import sys
+import threading
+import time
+
+
+# ------------------------------------------------------------------------------
+# Constants
+# ------------------------------------------------------------------------------
+
+"""Environment variables that enable timing and write profiler statistics."""
+ENV_PROFILE = 'XPR_PROFILE'
+ENV_PROFILE_STATS = 'XPR_PROFILE_STATS'
+
+
+# ------------------------------------------------------------------------------
+# Classes
+# ------------------------------------------------------------------------------
+
+class Phase(object):
+    """Context manager that adds the time spent in its block to the timer."""
+    def __init__(self, timer, name):
+        """Initialize the phase.
+
+        Parameters
+        ----------
+        timer: PhaseTimer
+            Timer that accumulates the phase times
+        name: string
+            Phase name
+        """
+        self.timer = timer
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        if self.timer.enabled:
+            self.start = self.timer.push()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not self.start is None:
+            self.timer.pop(self.name, self.start)
+            self.start = None
+        return False
+
+
+class PhaseTimer(object):
+    """Accumulated times of named phases. Each thread keeps a stack of the
+    time spent in nested phases to compute the self time of a phase.
+    """
+    def __init__(self):
+        """Initialize an empty disabled timer."""
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.phases = dict()
+        self.local = threading.local()
+        self.started = time.time()
+
+    def pop(self, name, start):
+        """Leave a phase that was entered at the given time.
+
+        Parameters
+        ----------
+        name: string
+            Phase name
+        start: float
+            Time at which the phase was entered
+        """
+        elapsed = time.time() - start
+        nested = self.local.stack.pop()
+        if len(self.local.stack) > 0:
+            self.local.stack[-1] += elapsed
+        with self.lock:
+            stats = self.phases.setdefault(name, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] += elapsed - nested
+
+    def push(self):
+        """Enter a phase. Returns the current time.
+
+        Returns
+        -------
+        float
+        """
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = list()
+        self.local.stack.append(0.0)
+        return time.time()
+
+    def reset(self):
+        """Remove all accumulated phase times."""
+        with self.lock:
+            self.phases = dict()
+            self.started = time.time()
+
+
+"""Timer that is used by all instrumented code paths."""
+TIMER = PhaseTimer()
+
+
+# ------------------------------------------------------------------------------
+# API Methods
+# ------------------------------------------------------------------------------
+
+def enable(enabled=True):
+    """Enable or disable timing. Resets the accumulated times when timing is
+    enabled.
+
+    Parameters
+    ----------
+    enabled: bool, optional
+        Flag indicating whether timing is enabled
+    """
+    if enabled:
+        TIMER.reset()
+    TIMER.enabled = enabled
+
+
+def get_phases():
+    """Get the accumulated times of all phases. The result maps phase names
+    to dictionaries with the number of calls ('count'), the total time
+    ('total') and the time excluding nested phases ('self') in seconds.
+
+    Returns
+    -------
+    dict
+    """
+    with TIMER.lock:
+        return dict(
+            (name, {'count': s[0], 'total': s[1], 'self': s[2]})
+                for name, s in TIMER.phases.items()
+        )
+
+
+def phase(name):
+    """Get a context manager that times its block as the given phase.
+
+    Parameters
+    ----------
+    name: string
+        Phase name
+
+    Returns
+    -------
+    Phase
+    """
+    return Phase(TIMER, name)
+
+
+def print_phases(out=None):
+    """Print the accumulated phase times ordered by their self time together
+    with the wall time since timing was enabled. Output is written to
+    standard error by default.
+
+    Parameters
+    ----------
+    out: file, optional
+        Output stream
+    """
+    out = out if not out is None else sys.stderr
+    wall = time.time() - TIMER.started
+    phases = get_phases()
+    names = sorted(phases, key=lambda n: phases[n]['self'], reverse=True)
+    width = max([len(n) for n in names] + [len('phase')])
+    print >> out, '%-*s %8s %10s %10s %6s' % (width, 'phase', 'calls', 'total', 'self', '%')
+    for name in names:
+        stats = phases[name]
+        print >> out, '%-*s %8d %9.4fs %9.4fs %5.1f%%' % (
+            width,
+            name,
+            stats['count'],
+            stats['total'],
+            stats['self'],
+            100.0 * stats['self'] / wall if wall > 0 else 0.0
+        )
+    print >> out, '%-*s %8s %9.4fs' % (width, 'wall', '', wall)
+
+
+def timed(name):
+    """Decorator that times every call of a function as the given phase.
+
+    Parameters
+    ----------
+    name: string
+        Phase name
+
+    Returns
+    -------
+    func
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not TIMER.enabled:
+                return func(*args, **kwargs)
+            start = TIMER.push()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                TIMER.pop(name, start)
+        return wrapper
+    return decorator
@@ -0,0 +1,176 @@
+"""Worker that runs jobs from the spool.
+
+Any number of workers on any number of hosts can run jobs from the spool of
+a repository on a shared file system (see exprepo.spool). Each worker runs
+one or more slots. A slot repeatedly reclaims jobs of workers whose heartbeat
+is stale, claims the oldest pending job, runs it and adds the run to the log
+of the repository.
+"""
+
+import os
+import socket
+import threading
+
+from exprepo.command import log_results, run_process
+from exprepo.log import LogWriter, new_entry, STATUS_FAILED
+from exprepo.spool import claim_job, finish_job, get_heartbeat_file
+from exprepo.spool import list_jobs, reclaim_jobs, touch, RUNNING_DIR
+
+
+# ------------------------------------------------------------------------------
+# Constants
+# ------------------------------------------------------------------------------
+
+"""Seconds between heartbeats of a running job."""
+HEARTBEAT_INTERVAL = 5.0
+
+"""Seconds between checks of the spool if no job is pending."""
+POLL_INTERVAL = 1.0
+
+"""Default number of seconds after which the heartbeat of a job is stale."""
+STALE_TIMEOUT = 60.0
+
+
+# ------------------------------------------------------------------------------
+# Classes
+# ------------------------------------------------------------------------------
+
+class Heartbeat(threading.Thread):
+    """Thread that touches the heartbeat file of a running job at a fixed
+    interval.
+    """
+    def __init__(self, filename, interval=HEARTBEAT_INTERVAL):
+        """Initialize the heartbeat.
+
+        Parameters
+        ----------
+        filename: string
+            Path to the heartbeat file
+        interval: float, optional
+            Seconds between heartbeats
+        """
+        super(Heartbeat, self).__init__()
+        self.daemon = True
+        self.filename = filename
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                touch(self.filename)
+            except (IOError, OSError):
+                pass
+
+    def stop(self):
+        """Stop the heartbeat and wait for the thread to terminate."""
+        self.stopped.set()
+        self.join()
+
+
+# ------------------------------------------------------------------------------
+# API Methods
+# ------------------------------------------------------------------------------
+
+def run_worker(prg_name, jobs=1, drain=False, stale=STALE_TIMEOUT):
+    """Run jobs from the spool of the repository in the current working
+    directory using the given number of slots. Runs until interrupted or,
+    if the drain flag is True, until no job is pending or running. Running
+    jobs are waited for since they are pending again if their worker fails.
+
+    Raises ValueError if the number of jobs or the stale timeout is invalid.
+
+    Parameters
+    ----------
+    prg_name: string
+        Name with which the program was called
+    jobs: int, optional
+        Number of jobs that are run concurrently
+    drain: bool, optional
+        Stop when no job is pending or running
+    stale: float, optional
+        Seconds after which the heartbeat of a running job is stale
+    """
+    if jobs < 1:
+        raise ValueError('invalid number of jobs \'' + str(jobs) + '\'')
+    if stale <= HEARTBEAT_INTERVAL:
+        raise ValueError('invalid stale timeout \'' + str(stale) + '\'')
+    writer = LogWriter()
+    stopped = threading.Event()
+    worker_id = socket.gethostname() + ':' + str(os.getpid())
+    def run_slot(slot):
+        slot_id = worker_id + ':' + str(slot)
+        while not stopped.is_set():
+            for job in reclaim_jobs(stale):
+                entry = new_entry(
+                    job['command'],
+                    job['args'],
+                    params=job['params'],
+                    status=STATUS_FAILED,
+                    run_id=job['id']
+                )
+                entry['worker'] = job.get('worker')
+                writer.append([entry])
+                print prg_name + ' (FAILED): ' + ' '.join(job['args']) + ' [' + job['id'] + ']'
+            claimed = claim_job(slot_id)
+            if claimed is None:
+                if drain and len(list_jobs(RUNNING_DIR)) == 0:
+                    break
+                stopped.wait(POLL_INTERVAL)
+                continue
+            try:
+                run_job(prg_name, claimed[0], claimed[1], writer)
+            except Exception as ex:
+                # The job is reclaimed when its heartbeat becomes stale
+                print prg_name + ' (ERROR): ' + str(ex)
+    slots = [threading.Thread(target=run_slot, args=(i,)) for i in range(jobs)]
+    for slot in slots:
+        slot.daemon = True
+        slot.start()
+    try:
+        while len(slots) > 0:
+            # Join with a timeout to keep the main thread interruptible
+            slots[0].join(POLL_INTERVAL)
+            if not slots[0].is_alive():
+                slots.pop(0)
+    except KeyboardInterrupt:
+        stopped.set()
+        raise
+
+
+# ------------------------------------------------------------------------------
+# Helper Methods
+# ------------------------------------------------------------------------------
+
+def run_job(prg_name, job_name, job, writer):
+    """Run a claimed job while sending heartbeats. The run is added to the
+    log and the job is moved to the done or failed directory of the spool.
+
+    Parameters
+    ----------
+    prg_name: string
+        Name with which the program was called
+    job_name: string
+        Name of the job file
+    job: dict
+        Claimed job
+    writer: exprepo.log.LogWriter
+        Writer that is shared by all slots of the worker
+    """
+    heartbeat = Heartbeat(get_heartbeat_file(job_name))
+    heartbeat.start()
+    try:
+        params, result = run_process(
+            prg_name,
+            (job['args'], job['params']),
+            run_id=job['id']
+        )
+    finally:
+        heartbeat.stop()
+    result['worker'] = job['worker']
+    entry = log_results(
+        job['command'],
+        [(params, result)],
+        writer=writer
+    )[0]
+    finish_job(job_name, job, entry)